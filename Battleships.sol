@@ -7,41 +7,50 @@ pragma solidity >=0.4.22 <0.9.0;
 
 contract Battleships{
 
-    event newMatch(bytes32 id);
-    event size_ID(uint8 size, bytes32 id);
-    event size_only(uint8 size, bytes32 id);
-    event match_ready(bytes32 id);
+    event newMatch(bytes32 indexed id, address indexed player);
+    event size_ID(uint8 size, bytes32 indexed id);
+    event size_only(uint8 size, bytes32 indexed id);
+    event match_ready(bytes32 indexed id, address indexed player);
     event noMatches(uint res);
     event BattleshipsCreated(address addr);
-    event turn_played(bytes32 id, uint row, uint col);
-    event turn_response(bytes32 id, uint res);
-    event your_turn(bytes32 id);
-    event match_ended(bytes32 id, int outcome);
-    event bid_placed(bytes32 id, int bid);
-    event accuse(bytes32 id, uint256 block_num);
+    event turn_played(bytes32 indexed id, uint row, uint col);
+    event turn_response(bytes32 indexed id, uint res);
+    event your_turn(bytes32 indexed id);
+    event match_ended(bytes32 indexed id, int outcome);
+    event bid_placed(bytes32 indexed id, int bid);
+    event accuse(bytes32 indexed id, address indexed accuser, uint256 block_num);
+    event salvo_played(bytes32 indexed id, uint[] rows, uint[] cols);
+    event salvo_response(bytes32 indexed id, uint256[] res);
 
 
     ///@notice Struct representing a single match
+    ///@dev Fields are ordered to pack into 7 storage slots: everything check_move
+    ///     needs besides the root sits in the two player slots
     struct Match{
-            bool accuse;                //Flag for accusation
-            uint256 curr_block_num;     //Current block number
-            address payable accuser;    //Accuser address
-            bool full;                  //Flag for tracking full matches
-            uint8 size;                 //Match board size
-            int turn;                   //Regulate player turns: -1 (player_1) / 1 (player_2)
-            address payable player_1;   //Player_1 address
-            bytes32 board_1;            //Player_1 board Merkle root
-            address payable player_2;   //Player_2 address
-            bytes32 board_2;            //Player_2 board Merkle root
+            address payable player_1;   //Player_1 address                                   (slot 0)
             uint64 ships_1;             //Player_1 current ships
+            int8 turn;                  //Regulate player turns: -1 (player_1) / 1 (player_2)
+            uint8 size;                 //Match board size
+            bool full;                  //Flag for tracking full matches
+            bool accuse;                //Flag for accusation
+            address payable player_2;   //Player_2 address                                   (slot 1)
             uint64 ships_2;             //Player_2 current ships
-            uint64 total_ships;         //Match total ship number
-            uint reward;                //Winner prize
+            uint32 total_ships;         //Match total ship number (at most size*size)
+            address payable accuser;    //Accuser address                                    (slot 2)
+            uint64 curr_block_num;      //Block number of the accuse
+            bytes32 board_1;            //Player_1 board Merkle root                         (slot 3)
+            bytes32 board_2;            //Player_2 board Merkle root                         (slot 4)
+            uint reward;                //Winner prize                                       (slot 5)
+            uint256 fleet;              //Ships of each length, 16 bits per length: length l (1..16) at bit 16*(l-1) (slot 6)
     }
 
     mapping (bytes32 => Match) games;   //Dictionary ID -> Match
-    bytes32[] games_index;              //Auxiliary array for iterations over mapping
-    uint private len = 0;               //Auxiliary array length
+    mapping (uint8 => bytes32[]) open_matches; //Board size -> matches waiting for player_2
+    mapping (bytes32 => uint) open_pos;        //Match_id -> position in open_matches + 1 (0: not open)
+    uint8[] open_sizes;                        //Board sizes with at least one open match
+    mapping (uint8 => uint) size_pos;          //Board size -> position in open_sizes + 1 (0: no open match)
+    uint private len = 0;               //Number of live matches
+    mapping (bytes32 => bytes32) salvos; //Dictionary ID -> hash of the pending salvo indexes
 
 
     constructor(){
@@ -51,62 +60,139 @@ contract Battleships{
     ///@dev modifier checking whether the match exists and it's not already full
     ///@param id Match_id
     modifier isValid(bytes32 id){
-        require(games[id].player_1 != address(0), "No match found");
-        require(games[id].full == false, "Match already full");
+        Match storage g = games[id];
+        require(g.player_1 != address(0), "No match found");
+        require(g.full == false, "Match already full");
         _;
     }
 
     ///@dev modifier checking wether it's the correct player turn
     ///@param id Match_id
     modifier validTurn(bytes32 id){
-        require(games[id].player_1 != address(0), "No match found");
-        require(games[id].player_2 != address(0), "Match still pending");
-        require(games[id].player_1 != msg.sender || games[id].player_2 != msg.sender, ("User not allowed"));
-        require((msg.sender == games[id].player_1 && games[id].turn == -1) || 
-                (msg.sender == games[id].player_2 && games[id].turn == 1), 
-                "Not your turn - Wait for the opponent");
+        check_turn(id);
         _;
     }
 
-    ///@notice Function to remove elements from the array of matches
+    ///@dev body of validTurn, in a function so that its locals do not stay on the stack of the modified function
+    ///@param id Match_id
+    function check_turn(bytes32 id)
+    private
+    view
+    {
+        Match storage g = games[id];
+        address player_1 = g.player_1;
+        address player_2 = g.player_2;
+        int8 turn = g.turn;
+        require(player_1 != address(0), "No match found");
+        require(player_2 != address(0), "Match still pending");
+        require(player_1 != msg.sender || player_2 != msg.sender, ("User not allowed"));
+        require((msg.sender == player_1 && turn == -1) || 
+                (msg.sender == player_2 && turn == 1), 
+                "Not your turn - Wait for the opponent");
+    }
+
+    ///@notice Hash of two words, computed in the scratch space
+    ///@dev Same bytes as keccak256(abi.encode(a, b)) and abi.encodePacked(a, b), i.e. the
+    ///     uint256 leaves (cell, nonce) and the inner nodes of the front-end merkle_tree
+    function hash_pair(bytes32 a, bytes32 b)
+    private
+    pure
+    returns (bytes32 h)
+    {
+        assembly {
+            mstore(0x00, a)
+            mstore(0x20, b)
+            h := keccak256(0x00, 0x40)
+        }
+    }
+
+    ///@notice Function to remove a match and its pending data
     ///@param id Match_id
     function remove_match(bytes32 id)
     private
     {
+        close_match(id);
         delete games[id];
-        if(games_index.length == 1){
-            games_index.pop();
-            return;
-        }
-        uint i = 0;
-        while(games_index[i] != id && i<games_index.length){
-            i++;
+        delete salvos[id];
+        len -= 1;
+    }
+
+    ///@notice Function to queue a new match among the open ones of its size
+    ///@param id Match_id
+    function open_match(bytes32 id)
+    private
+    {
+        uint8 size = games[id].size;
+        bytes32[] storage queue = open_matches[size];
+        if(queue.length == 0){
+            open_sizes.push(size);
+            size_pos[size] = open_sizes.length;
         }
-        if(i == games_index.length){
-            games_index.pop();
+        queue.push(id);
+        open_pos[id] = queue.length;
+    }
+
+    ///@notice Function to dequeue a match that is no longer open (swap and pop)
+    ///@param id Match_id
+    function close_match(bytes32 id)
+    private
+    {
+        uint pos = open_pos[id];
+        if(pos == 0){
             return;
         }
-        if (games_index[i] == id){
-            for(uint j = i; j<games_index.length-1; j++){
-                games_index[j] = games_index[j+1];
-            }
-            games_index.pop();
-            return;
+        uint8 size = games[id].size;
+        bytes32[] storage queue = open_matches[size];
+        bytes32 last = queue[queue.length - 1];
+        queue[pos - 1] = last;
+        open_pos[last] = pos;
+        queue.pop();
+        delete open_pos[id];
+
+        if(queue.length == 0){
+            uint spos = size_pos[size];
+            uint8 last_size = open_sizes[open_sizes.length - 1];
+            open_sizes[spos - 1] = last_size;
+            size_pos[last_size] = spos;
+            open_sizes.pop();
+            delete size_pos[size];
         }
     }
 
     ///@notice Function for match creation
     ///@param board_1 Player_1's board merkle root
     ///@param _size Board size
-    ///@param n_ships Total number of ships
-    function create_match(bytes32 board_1, uint8 _size, uint64 n_ships)
-    public{
-        bytes32 id = keccak256(abi.encodePacked(msg.sender, board_1, block.number));
-        Match memory new_match = Match(false, 0, payable(address(0)), false, _size, 1, payable(msg.sender), board_1, payable(address(0)), 0x0, n_ships, n_ships, n_ships, 0);
-        games[id] = new_match;
-        games_index.push(id);
+    ///@param fleet Ships of each length, 16 bits per length: length l (1..16) at bit 16*(l-1)
+    ///@return id Match_id
+    function create_match(bytes32 board_1, uint8 _size, uint256 fleet)
+    public
+    returns (bytes32 id){
+        uint64 n_ships = fleet_cells(fleet);
+        require(n_ships > 0 && n_ships <= uint(_size) * uint(_size), "Invalid fleet");
+        id = keccak256(abi.encodePacked(msg.sender, board_1, block.number));
+        //Only the non-zero fields are written: 4 slots out of 7
+        Match storage new_match = games[id];
+        new_match.player_1 = payable(msg.sender);
+        new_match.ships_1 = n_ships;
+        new_match.turn = 1;
+        new_match.size = _size;
+        new_match.ships_2 = n_ships;
+        new_match.total_ships = uint32(n_ships);
+        new_match.board_1 = board_1;
+        new_match.fleet = fleet;
+        open_match(id);
         len += 1;
-        emit newMatch(id);
+        emit newMatch(id, msg.sender);
+    }
+
+    ///@notice Function for match creation with the bet of player_1 attached (create_match + bet)
+    ///@param board_1 Player_1's board merkle root
+    ///@param _size Board size
+    ///@param fleet Ships of each length, 16 bits per length: length l (1..16) at bit 16*(l-1)
+    function create_and_bet(bytes32 board_1, uint8 _size, uint256 fleet)
+    public
+    payable{
+        bet(create_match(board_1, _size, fleet));
     }
     
     ///@notice Function for match join with known ID
@@ -118,26 +204,28 @@ contract Battleships{
         emit size_only(games[id].size, id);
     }
 
-    ///@notice Function for joining a random match
+    ///@notice Function for joining a random match of any size
     function join_match()
     public{
-        uint i = 0;
-        bytes32 id;
-        bool found = false;
-        
-        //looks for the first pending match in the mapping
-        while(i<games_index.length && found == false){
-            if(games[games_index[i]].full == false /*&& games[games_index[i]].size != 0*/){
-                found = true;
-                id = games_index[i];
-            }
-            i+=1;
+        if(open_sizes.length == 0){
+            emit noMatches(len);
         }
-        if(found == false){
-            emit noMatches(len); 
+        else{
+            join_match(open_sizes[open_sizes.length - 1]);
+        }
+    }
+
+    ///@notice Function for joining a random match with the given board size
+    ///@param size Board size
+    function join_match(uint8 size)
+    public{
+        bytes32[] storage queue = open_matches[size];
+        if(queue.length == 0){
+            emit noMatches(len);
         }
         else{
-            emit size_ID(games[id].size, id);
+            bytes32 id = queue[queue.length - 1];
+            emit size_ID(size, id);
         }
     }
 
@@ -148,10 +236,92 @@ contract Battleships{
     public
     isValid(id)
     {
-        games[id].player_2 = payable(msg.sender);
-        games[id].board_2 = board;
-        games[id].full = true;
-        emit match_ready(id);
+        Match storage g = games[id];
+        g.player_2 = payable(msg.sender);
+        g.board_2 = board;
+        g.full = true;
+        close_match(id);
+        emit match_ready(id, msg.sender);
+    }
+
+    ///@notice Function for joining a match, uploading Player_2's board and placing the bet in one call
+    ///@dev With id 0 the last open match of the size is taken when the call is mined, so two
+    ///     joiners never race for the same match as with join_match + upload_board
+    ///@param id Match_id, 0 for any open match of the given size
+    ///@param size Board size the board was placed for
+    ///@param fleet Fleet the board was placed with, as in create_match
+    ///@param board Board's Merkle root
+    function join_and_bet(bytes32 id, uint8 size, uint256 fleet, bytes32 board)
+    public
+    payable{
+        if(id == 0){
+            bytes32[] storage queue = open_matches[size];
+            require(queue.length > 0, "No match found");
+            id = queue[queue.length - 1];
+        }
+        upload_board(id, board);
+        require(games[id].size == size, "Invalid size");
+        //With id 0 the match taken may have been created with another fleet than the one read
+        require(games[id].fleet == fleet, "Fleet mismatch");
+        bet(id);
+    }
+
+    ///@notice Board size of a match waiting for player_2, read before placing the ships
+    ///@param id Match_id
+    ///@return size Board size
+    function match_size(bytes32 id)
+    public
+    view
+    isValid(id)
+    returns (uint8 size)
+    {
+        return games[id].size;
+    }
+
+    ///@notice Fleet of a match, read before placing the ships
+    ///@param id Match_id
+    ///@return fleet Ships of each length as in create_match, 0 if the match does not exist
+    function match_fleet(bytes32 id)
+    public
+    view
+    returns (uint256 fleet)
+    {
+        return games[id].fleet;
+    }
+
+    ///@notice Turn and ships left of a match, read by a resumed front-end to tell whether its answer is on chain
+    ///@param id Match_id
+    ///@return turn 1 while player_1 answers or player_2 shoots, -1 the other way round, 0 if the match does not exist
+    ///@return ships_1 Player_1 ships left
+    ///@return ships_2 Player_2 ships left
+    function match_state(bytes32 id)
+    public
+    view
+    returns (int8 turn, uint64 ships_1, uint64 ships_2)
+    {
+        Match storage g = games[id];
+        return (g.turn, g.ships_1, g.ships_2);
+    }
+
+    ///@notice Last open match of a size, read before placing the ships (join_match without a transaction)
+    ///@param size Board size, 0 for any size
+    ///@return id Match_id, 0 if no match is open
+    ///@return _size Board size of the match
+    function find_match(uint8 size)
+    public
+    view
+    returns (bytes32 id, uint8 _size)
+    {
+        if(size == 0){
+            if(open_sizes.length == 0){
+                return (0, 0);
+            }
+            size = open_sizes[open_sizes.length - 1];
+        }
+        bytes32[] storage queue = open_matches[size];
+        if(queue.length > 0){
+            return (queue[queue.length - 1], size);
+        }
     }
 
     ///@notice Function for making a move
@@ -173,72 +343,59 @@ contract Battleships{
     function check_move(bytes32 id, uint256 res, uint index, uint256 nonce, bytes32[] calldata proof) 
     public 
     {
-        require((msg.sender == games[id].player_1 && games[id].turn == 1) || 
-                (msg.sender == games[id].player_2 && games[id].turn == -1), 
+        Match storage g = games[id];
+        int8 turn = g.turn;
+        bool is_player_1 = msg.sender == g.player_1;
+        require((is_player_1 && turn == 1) || 
+                (msg.sender == g.player_2 && turn == -1), 
                 "Not your turn - Wait for the opponent");
+        //A pending salvo is answered by check_salvo only, or its binding could be skipped
+        require(salvos[id] == 0, "Salvo pending");
         
-        bytes32 leaf = keccak256(abi.encode(res, nonce));
-        bytes32 _hash = leaf;
+        bytes32 _hash = hash_pair(bytes32(res), bytes32(nonce));
         for(uint i = 0; i<proof.length; i++){
-            if(index % 2 == 0){
-                _hash = keccak256(abi.encode(_hash,proof[i]));
+            if((index & 1) == 0){
+                _hash = hash_pair(_hash, proof[i]);
             }
             else{
-                _hash = keccak256(abi.encode(proof[i],_hash));
-                
+                _hash = hash_pair(proof[i], _hash);
             }
-            index = index/2;   
-        }
-
-        bytes32 root;
-        if(msg.sender == games[id].player_1){
-            root = games[id].board_1;
-        }
-        else{
-            root = games[id].board_2;
+            index >>= 1;
         }
 
         //Genuine response
-        if(_hash == root){
+        if(_hash == (is_player_1 ? g.board_1 : g.board_2)){
             if(res == 1){
-                if(games[id].turn == -1){
+                uint64 ships;
+                if(turn == -1){
                     //Player_1 Turn
-                    if(games[id].ships_2>1){
-                        games[id].ships_2 --;
-                    }
-                    else{
-                        //Match ended: Player_1 won
-                        games[id].ships_2 --;
-                        emit match_ended(id, 0);
-                        return;
-                    }
+                    ships = g.ships_2 - 1;
+                    g.ships_2 = ships;
                 }
                 else{
                     //Player_2 Turn
-                    if(games[id].ships_1>1){
-                        games[id].ships_1 --;
-                    }
-                    else{
-                        //Match ended: Player_2 won
-                        games[id].ships_1 --;
-                        emit match_ended(id, 0); 
-                        return;
-                    }
+                    ships = g.ships_1 - 1;
+                    g.ships_1 = ships;
+                }
+                if(ships == 0){
+                    //Match ended: the current player won
+                    emit match_ended(id, 0);
+                    return;
                 }
             }
             //Change turn
-            games[id].turn *= -1; 
+            g.turn = -turn; 
             emit turn_response(id, res);
         }
 
         //Cheating attempt
         else{
             emit match_ended(id, -1);
-            if(games[id].turn == 1){
-                payable(games[id].player_1).transfer(games[id].reward);
+            if(turn == 1){
+                payable(g.player_1).transfer(g.reward);
             }
             else{
-                payable(games[id].player_2).transfer(games[id].reward);
+                payable(g.player_2).transfer(g.reward);
             }
 
             remove_match(id);
@@ -248,37 +405,355 @@ contract Battleships{
         emit your_turn(id);
     }
 
-    ///@notice Function for board verification after the match ended
+    ///@notice Whether a match is still being played (not removed, no fleet sunk)
     ///@param id Match_id
-    ///@param board List of ships placed
-    function check_board(bytes32 id, uint64[] calldata board)
+    function live(bytes32 id)
+    private
+    view
+    returns (bool)
+    {
+        Match storage g = games[id];
+        return g.player_1 != address(0) && g.ships_1 != 0 && g.ships_2 != 0;
+    }
+
+    ///@notice Function for answering the opponent's shot and firing back in one call (check_move + play_turn)
+    ///@dev A genuine answer passes the turn to the sender: the shot is fired unless the answer ended the match
+    ///@param id Match_id
+    ///@param res Hit(1) or Miss(0)
+    ///@param index Position of value in the matrix
+    ///@param nonce Nonce used for leaf hash generation
+    ///@param proof Merkle proof
+    ///@param row row of the shot
+    ///@param col col of the shot
+    function answer_and_play(bytes32 id, uint256 res, uint index, uint256 nonce, bytes32[] calldata proof, uint row, uint col)
     public
-    {   
-        require((games[id].player_1 == msg.sender && games[id].ships_2 == 0) ||
-                (games[id].player_2 == msg.sender && games[id].ships_1 == 0),
-                "Match still not finished!");
-        
-        uint64 sum = 0;
-        for(uint i = 0; i< board.length; i++){
-            sum += board[i];
+    {
+        check_move(id, res, index, nonce, proof);
+        if(live(id)){
+            play_turn(id, row, col);
         }
-        
-        if(sum == games[id].total_ships){ //Legit Board
+    }
+
+    ///@notice Function for firing several shots in one turn
+    ///@param id Match_id
+    ///@param rows rows, with (row*size+col) strictly increasing
+    ///@param cols cols
+    function play_salvo(bytes32 id, uint[] calldata rows, uint[] calldata cols)
+    public
+    validTurn(id){
+        require(rows.length > 0 && rows.length == cols.length, "Invalid salvo");
+        uint size = games[id].size;
+        uint[] memory indexes = new uint[](rows.length);
+        for(uint i = 0; i<rows.length; i++){
+            require(rows[i] < size && cols[i] < size, "Invalid salvo");
+            indexes[i] = rows[i]*size + cols[i];
+            require(i == 0 || indexes[i] > indexes[i-1], "Salvo must be sorted");
+        }
+        salvos[id] = keccak256(abi.encodePacked(indexes));
+        emit salvo_played(id, rows, cols);
+    }
+
+    ///@notice Function for rebuilding one level of a multiproof, in place
+    ///@param keys Indexes of the known nodes, strictly increasing
+    ///@param hashes Hashes of the known nodes
+    ///@param m Number of known nodes
+    ///@param proof Sibling nodes not computable from the known ones
+    ///@param p Next proof element to consume
+    ///@return n Number of nodes on the upper level (0 if the proof is too short)
+    ///@return q Next proof element to consume
+    function multiproof_level(uint[] memory keys, bytes32[] memory hashes, uint m, bytes32[] memory proof, uint p)
+    private
+    pure
+    returns (uint n, uint q)
+    {
+        uint i = 0;
+        while(i < m){
+            uint k = keys[i];
+            bytes32 h;
+            if(i+1 < m && keys[i+1] == (k ^ 1)){
+                h = hash_pair(hashes[i], hashes[i+1]);
+                i += 2;
+            }
+            else{
+                if(p == proof.length){
+                    return (0, p);
+                }
+                if((k & 1) == 0){
+                    h = hash_pair(hashes[i], proof[p]);
+                }
+                else{
+                    h = hash_pair(proof[p], hashes[i]);
+                }
+                p++;
+                i++;
+            }
+            keys[n] = k >> 1;
+            hashes[n] = h;
+            n++;
+        }
+        return (n, p);
+    }
+
+    ///@notice Function for rebuilding the root of a multiproof
+    ///@param keys Leaf indexes, strictly increasing
+    ///@param hashes Leaf hashes
+    ///@param size Board size
+    ///@param proof Sibling nodes not computable from the leaves, level by level
+    ///@return valid Whether the whole proof was consumed down to a single root
+    ///@return root Rebuilt root
+    function multiproof_root(uint[] memory keys, bytes32[] memory hashes, uint size, bytes32[] memory proof)
+    private
+    pure
+    returns (bool valid, bytes32 root)
+    {
+        //Depth of the padded tree
+        uint depth = 0;
+        while((uint(1) << depth) < size*size){
+            depth++;
+        }
+        uint m = keys.length;
+        uint p = 0;
+        for(uint d = 0; d<depth; d++){
+            (m, p) = multiproof_level(keys, hashes, m, proof, p);
+            if(m == 0){
+                return (false, 0x0);
+            }
+        }
+        return (m == 1 && p == proof.length, hashes[0]);
+    }
+
+    ///@notice Function for answering a salvo with a single Merkle multiproof
+    ///@param id Match_id
+    ///@param res Hit(1) or Miss(0) for each shot
+    ///@param indexes Positions of the shots in the matrix, as fired
+    ///@param nonces Nonces used for leaf hash generation
+    ///@param proof Sibling nodes not computable from the leaves, level by level
+    function check_salvo(bytes32 id, uint256[] memory res, uint256[] memory indexes, uint256[] memory nonces, bytes32[] memory proof)
+    public
+    {
+        Match storage g = games[id];
+        int8 turn = g.turn;
+        require((msg.sender == g.player_1 && turn == 1) || 
+                (msg.sender == g.player_2 && turn == -1), 
+                "Not your turn - Wait for the opponent");
+        require(salvos[id] != 0 && keccak256(abi.encodePacked(indexes)) == salvos[id], "No matching salvo");
+        require(res.length == indexes.length && nonces.length == indexes.length, "Invalid response");
+        delete salvos[id];
+
+        //Leaves of the fired cells
+        bytes32[] memory hashes = new bytes32[](indexes.length);
+        uint hits = 0;
+        for(uint i = 0; i<indexes.length; i++){
+            hashes[i] = hash_pair(bytes32(res[i]), bytes32(nonces[i]));
+            if(res[i] == 1){
+                hits++;
+            }
+        }
+        (bool valid, bytes32 _hash) = multiproof_root(indexes, hashes, g.size, proof);
+
+        //Genuine response
+        if(valid && _hash == (turn == 1 ? g.board_1 : g.board_2)){
+            if(turn == -1){
+                //Player_1 Turn
+                if(g.ships_2 > hits){
+                    g.ships_2 -= uint64(hits);
+                }
+                else{
+                    //Match ended: Player_1 won
+                    g.ships_2 = 0;
+                    emit match_ended(id, 0);
+                    return;
+                }
+            }
+            else{
+                //Player_2 Turn
+                if(g.ships_1 > hits){
+                    g.ships_1 -= uint64(hits);
+                }
+                else{
+                    //Match ended: Player_2 won
+                    g.ships_1 = 0;
+                    emit match_ended(id, 0);
+                    return;
+                }
+            }
+            //Change turn
+            g.turn = -turn;
+            emit salvo_response(id, res);
+            emit your_turn(id);
+        }
+
+        //Cheating attempt
+        else{
+            emit match_ended(id, -1);
+            if(turn == 1){
+                payable(g.player_1).transfer(g.reward);
+            }
+            else{
+                payable(g.player_2).transfer(g.reward);
+            }
+            remove_match(id);
+        }
+    }
+
+    ///@notice Function for answering the opponent's salvo and firing back in one call (check_salvo + play_salvo)
+    ///@param id Match_id
+    ///@param res Hit(1) or Miss(0) for each shot
+    ///@param indexes Positions of the shots in the matrix, as fired
+    ///@param nonces Nonces used for leaf hash generation
+    ///@param proof Sibling nodes not computable from the leaves, level by level
+    ///@param rows rows of the salvo, with (row*size+col) strictly increasing
+    ///@param cols cols of the salvo
+    function answer_salvo_and_play(bytes32 id, uint256[] memory res, uint256[] memory indexes, uint256[] memory nonces, bytes32[] memory proof,
+                                   uint[] calldata rows, uint[] calldata cols)
+    public
+    {
+        check_salvo(id, res, indexes, nonces, proof);
+        if(live(id)){
+            play_salvo(id, rows, cols);
+        }
+    }
+
+    ///@notice Ship cells of a fleet
+    ///@param fleet Ships of each length, 16 bits per length: length l (1..16) at bit 16*(l-1)
+    ///@return cells Total number of ship cells
+    function fleet_cells(uint256 fleet)
+    private
+    pure
+    returns (uint64 cells)
+    {
+        for(uint l = 1; l<=16; l++){
+            cells += uint64(l * ((fleet >> (16 * (l-1))) & 0xffff));
+        }
+    }
+
+    ///@notice Lays one revealed ship: a straight line inside the board on ship cells no other
+    ///        ship covers, cleared from the cells left as it is laid
+    ///@param left Ship cells not covered yet, packed as the revealed bitmap
+    ///@param ship Start cell (16 bits), length (7 bits), vertical (1 bit)
+    ///@param size Board size
+    ///@return length Ship length, 0 for an invalid ship
+    function lay_ship(uint256[] memory left, uint ship, uint size)
+    private
+    pure
+    returns (uint length)
+    {
+        length = (ship >> 16) & 127;
+        uint start = ship & 0xffff;
+        uint step = (ship >> 23) == 1 ? size : 1;
+        //The last cell stays on the board, in the row of the first one for horizontal ships
+        if(length < 1 || length > 16 || start >= size*size ||
+           (step == 1 ? start % size : start / size) + length > size){
+            return 0;
+        }
+        for(uint i = start; i<start+length*step; i += step){
+            uint bit = uint(1) << (i & 255); //A literal 1 would be a uint8 and shift out
+            if((left[i >> 8] & bit) == 0){ //No ship on the cell, or covered twice
+                return 0;
+            }
+            left[i >> 8] ^= bit;
+        }
+    }
+
+    ///@notice Fleet composition of a revealed board: the ships cover every ship cell, each one
+    ///        once, and there are as many ships of each length as in the fleet of the match
+    ///@dev A cell left set after laying the ships is a cell no ship covers (bits past the last
+    ///     cell included)
+    ///@param bitmap Cells packed 256 per word, cell i is bit (i % 256) of word i / 256
+    ///@param ships Ships packed 10 per word, ship k is bits 24*(k % 10) of word k / 10:
+    ///       start cell (16 bits), length (7 bits), vertical (1 bit); all zero is padding
+    ///@param size Board size
+    ///@param fleet Fleet of the match, as in create_match
+    ///@return legit Whether the board is made of the fleet ships
+    function fleet_ok(uint256[] calldata bitmap, uint256[] calldata ships, uint size, uint256 fleet)
+    private
+    pure
+    returns (bool)
+    {
+        uint256[] memory left = bitmap;
+        uint256 counts; //Packed as the fleet: a lane cannot overflow, the ships cover distinct cells
+        for(uint k = 0; k<ships.length*10; k++){
+            uint ship = (ships[k / 10] >> (24 * (k % 10))) & 0xffffff;
+            if(ship == 0){
+                continue;
+            }
+            uint length = lay_ship(left, ship, size);
+            if(length == 0){
+                return false;
+            }
+            counts += uint(1) << (16 * (length-1));
+        }
+        for(uint w = 0; w<left.length; w++){
+            if(left[w] != 0){
+                return false;
+            }
+        }
+        return counts == fleet;
+    }
+
+    ///@notice Root of a revealed board, leaves rebuilt from the bitmap and the nonce seed
+    ///@dev Leaf i is hash_pair(bit i, keccak256(seed, i)) as in the front-end SeedNonces,
+    ///     padding leaves are zero up to the next power of two, levels are hashed in place
+    ///@param bitmap Cells packed 256 per word, cell i is bit (i % 256) of word i / 256
+    ///@param seed Nonce seed
+    ///@param cells Board cells
+    ///@return root Rebuilt root
+    function bitmap_root(uint256[] calldata bitmap, bytes32 seed, uint cells)
+    private
+    pure
+    returns (bytes32 root)
+    {
+        uint width = 2;
+        while(width < cells){
+            width <<= 1;
+        }
+        bytes32[] memory level = new bytes32[](width);
+        for(uint i = 0; i<cells; i++){
+            level[i] = hash_pair(bytes32((bitmap[i >> 8] >> (i & 255)) & 1), hash_pair(seed, bytes32(i)));
+        }
+        for(; width > 1; width >>= 1){
+            for(uint j = 0; j < width >> 1; j++){
+                level[j] = hash_pair(level[2*j], level[2*j+1]);
+            }
+        }
+        return level[0];
+    }
+
+    ///@notice Function for board verification after the match ended: the winner reveals its
+    ///        board as a bitmap with its nonce seed, checked against the committed root, and
+    ///        the ships the bitmap is made of, checked against the fleet of the match
+    ///@param id Match_id
+    ///@param bitmap Cells packed 256 per word, cell i is bit (i % 256) of word i / 256
+    ///@param seed Seed of the leaf nonces
+    ///@param ships Ships packed 10 per word, 24 bits each: start cell, length, vertical
+    function reveal_board(bytes32 id, uint256[] calldata bitmap, bytes32 seed, uint256[] calldata ships)
+    public
+    {
+        Match storage g = games[id];
+        require((g.player_1 == msg.sender && g.ships_2 == 0) ||
+                (g.player_2 == msg.sender && g.ships_1 == 0),
+                "Match still not finished!");
+
+        uint cells = uint(g.size) * uint(g.size);
+        bool legit = bitmap.length == (cells + 255) >> 8 &&
+                     fleet_ok(bitmap, ships, g.size, g.fleet) &&
+                     bitmap_root(bitmap, seed, cells) == (msg.sender == g.player_1 ? g.board_1 : g.board_2);
+
+        if(legit){ //Legit Board
             emit match_ended(id, 1);
-            payable(msg.sender).transfer(games[id].reward);
+            payable(msg.sender).transfer(g.reward);
             remove_match(id);
         }
         else{ //Invalid board
             emit match_ended(id, -1);
-            if(games[id].turn == 1){
-                payable(games[id].player_1).transfer(games[id].reward);
+            if(g.turn == 1){
+                payable(g.player_1).transfer(g.reward);
             }
             else{
-                payable(games[id].player_2).transfer(games[id].reward);
+                payable(g.player_2).transfer(g.reward);
             }
             remove_match(id);
         }
-        return;
     }
 
     ///@notice Function for bet placement; refunds in case of mismatch
@@ -286,28 +761,32 @@ contract Battleships{
     function bet(bytes32 id)
     public
     payable{
-        require(msg.sender == games[id].player_1 || msg.sender == games[id].player_2, "User not allowed");
-        if(games[id].reward == 0){
-            games[id].reward = msg.value;
+        Match storage g = games[id];
+        address payable player_1 = g.player_1;
+        address payable player_2 = g.player_2;
+        require(msg.sender == player_1 || msg.sender == player_2, "User not allowed");
+        uint reward = g.reward;
+        if(reward == 0){
+            g.reward = msg.value;
             emit bid_placed(id, 1);
         }
         else{
             uint256 bid = msg.value;
-            if(bid == games[id].reward){
-                games[id].reward += bid;
+            if(bid == reward){
+                g.reward = reward + bid;
                 emit bid_placed(id, 2);
                 emit your_turn(id); 
             }
             else{
                 //Player_1 wrong bid - Game over
-                if(msg.sender == games[id].player_1){                            
-                    payable(games[id].player_1).transfer(bid);
-                    payable(games[id].player_2).transfer(games[id].reward);
+                if(msg.sender == player_1){                            
+                    player_1.transfer(bid);
+                    player_2.transfer(reward);
                 }
                 //Player_2 wrong bid - Game over
                 else{                                                           
-                    payable(games[id].player_2).transfer(bid);
-                    payable(games[id].player_1).transfer(games[id].reward);
+                    player_2.transfer(bid);
+                    player_1.transfer(reward);
                 }
                 emit match_ended(id, -1);
                 remove_match(id);
@@ -324,9 +803,9 @@ contract Battleships{
                 "You cannot accuse yourself");
         require(games[id].accuse == false, "Accuse already done!");
         games[id].accuse = true;
-        games[id].curr_block_num = block.number;
+        games[id].curr_block_num = uint64(block.number);
         games[id].accuser = payable(msg.sender);
-        emit accuse(id, games[id].curr_block_num);
+        emit accuse(id, msg.sender, block.number);
     }
 
     ///@notice Function for reward withdraw in case of victory due inactivity
@@ -0,0 +1,645 @@
+#Author: Alessandro Mazzarella
+#Title: benchmark
+#notice: Benchmarks for the Battleships front-end hot paths
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import secrets
+import subprocess
+import sys
+import tempfile
+import time
+from eth_abi import encode
+from eth_utils import event_abi_to_log_topic
+from web3 import Web3
+from web3.logs import DISCARD
+import web3
+from board import merkle_tree, get_proof, MerkleTree, SeedNonces, hash_leaves, random_fleet, fleet, total_ships, pack_fleet, create_board, readContractData
+from deployment import cache_path, find_deployment, load_artifact
+
+
+SIZES = [2, 4, 8, 16]
+MENU_BUDGET = 0.5 #Seconds from launching board.py to its first menu
+
+
+#--------------------------|Random board with its nonces
+#args: n (Int) board size
+
+#returns: board_array (Int[])
+#         board_nonces (Int[])
+def random_board(n):
+    board_array = [secrets.randbits(1) for _ in range(n*n)]
+    board_nonces = [secrets.randbits(32) for _ in range(n*n)]
+    return board_array, board_nonces
+
+
+#--------------------------|Root computed one Web3.solidity_keccak call per node
+#Reference for the bulk hashing path: roots must stay byte-identical
+def reference_root(board_array, board_nonces):
+    level = [Web3.solidity_keccak(['uint256','uint256'], [board_array[i], board_nonces[i]]) for i in range(len(board_array))]
+    while(len(level) > 1):
+        level = [Web3.solidity_keccak(['bytes32','bytes32'], [level[i], level[i+1]]) for i in range(0, len(level), 2)]
+    return bytes(level[0])
+
+
+#--------------------------|Average seconds per call of fn over repeat runs
+def timeit(fn, repeat):
+    t1 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t1) / repeat
+
+
+#--------------------------|merkle_tree/get_proof pair against MerkleTree
+#One proof per cell, as in a full match where every cell gets shot
+def bench_merkle(repeat=3):
+    print("\n|----- Merkle proofs (all cells) -----|")
+    print("%-6s %14s %14s %14s %10s" % ("size", "get_proof", "tree build", "tree proofs", "speedup"))
+    for n in SIZES:
+        board_array, board_nonces = random_board(n)
+        cells = range(n*n)
+        tree = MerkleTree(board_array, board_nonces)
+        assert tree.root == merkle_tree(board_array, board_nonces)
+        for k in cells:
+            assert tree.get_proof(k) == get_proof(board_array, k, [], board_nonces)
+
+        old = timeit(lambda: [get_proof(board_array, k, [], board_nonces) for k in cells], repeat)
+        build = timeit(lambda: MerkleTree(board_array, board_nonces), repeat)
+        lookup = timeit(lambda: [tree.get_proof(k) for k in cells], repeat)
+        print("%-6s %12.2fms %12.2fms %12.2fms %9.1fx" % ("%dx%d" % (n, n), old*1e3, build*1e3, lookup*1e3, old/(build+lookup)))
+
+
+#--------------------------|Per-node solidity_keccak against the bulk hashing path
+def bench_hashing(repeat=20):
+    print("\n|----- Root hashing -----|")
+    print("%-6s %14s %14s %14s %10s" % ("size", "solidity_keccak", "leaves", "bulk root", "speedup"))
+    for n in SIZES:
+        board_array, board_nonces = random_board(n)
+        assert merkle_tree(board_array, board_nonces) == reference_root(board_array, board_nonces)
+
+        old = timeit(lambda: reference_root(board_array, board_nonces), repeat)
+        leaves = timeit(lambda: hash_leaves(board_array, board_nonces), repeat)
+        bulk = timeit(lambda: merkle_tree(board_array, board_nonces), repeat)
+        print("%-6s %13.2fms %12.2fms %12.2fms %9.1fx" % ("%dx%d" % (n, n), old*1e3, leaves*1e3, bulk*1e3, old/bulk))
+
+
+#--------------------------|Random fleets per second for every board size
+def bench_placement(sizes=SIZES + [32, 64, 128]):
+    print("\n|----- Random fleet placement -----|")
+    print("%-8s %10s %12s" % ("size", "ms/fleet", "fleets/s"))
+    rng = random.Random(0)
+    for n in sizes:
+        ships = fleet(n)
+        repeat = max(3, 20000 // (n*n))
+        t = timeit(lambda: random_fleet(n, ships, rng), repeat)
+        assert int(random_fleet(n, ships, rng).cells.sum()) == total_ships(ships)
+        print("%-8s %10.3f %12.0f" % ("%dx%d" % (n, n), t*1e3, 1/t))
+
+
+#--------------------------|turn_played before and after indexing the match id
+def turn_played_abi(indexed):
+    return {'type': 'event', 'name': 'turn_played', 'anonymous': False, 'inputs': [
+        {'name': 'id', 'type': 'bytes32', 'indexed': indexed},
+        {'name': 'row', 'type': 'uint256', 'indexed': False},
+        {'name': 'col', 'type': 'uint256', 'indexed': False}]}
+
+
+#--------------------------|Raw turn_played logs of many concurrent matches, as returned by eth_getLogs
+#args: matches (Int) concurrent matches
+#      turns   (Int) turns played in each match
+#      indexed (Bool) match id in topics[1] instead of the data
+
+#returns: logs (Dictionary[])
+def match_logs(matches, turns, indexed):
+    topic = event_abi_to_log_topic(turn_played_abi(indexed))
+    logs = []
+    for m in range(matches):
+        id = m.to_bytes(32, 'big')
+        for t in range(turns):
+            data = encode(['uint256','uint256'], [t // 16, t % 16])
+            logs.append({'address': '0x' + '00'*20, 'blockHash': b'\0'*32, 'blockNumber': t, 'transactionHash': b'\0'*32,
+                         'transactionIndex': 0, 'logIndex': m, 'removed': False,
+                         'topics': [topic, id] if indexed else [topic],
+                         'data': data if indexed else id + data})
+    return logs
+
+
+#--------------------------|Logs, bytes and client time for one client of a crowded contract
+#Before: the filter matches the whole contract, the client downloads every match and either
+#decodes all the logs to compare the id (per-event filters) or routes on the raw data first
+#(log pump). After: the node filters on the indexed id and returns only our match.
+def bench_events(matches=[1, 10, 100, 1000], turns=64, repeat=1):
+    print("\n|----- Match events for one client (%d turns per match) -----|" % turns)
+    print("%-8s %8s %10s %12s %12s | %8s %10s %12s" % ("matches", "logs", "KiB", "decode all", "route", "logs idx", "KiB idx", "decode idx"))
+    w3 = Web3()
+    mine = (0).to_bytes(32, 'big')
+    for m in matches:
+        decoder = w3.eth.contract(abi=[turn_played_abi(False)]).events.turn_played()
+        logs = match_logs(m, turns, False)
+        size = sum(len(log['data']) + 32*len(log['topics']) for log in logs)
+        decode_all = timeit(lambda: [ev for ev in map(decoder.process_log, logs) if ev['args']['id'] == mine], repeat)
+        route = timeit(lambda: [decoder.process_log(log) for log in logs if log['data'][:32] == mine], repeat)
+
+        decoder = w3.eth.contract(abi=[turn_played_abi(True)]).events.turn_played()
+        own = [log for log in match_logs(m, turns, True) if log['topics'][1] == mine] #node side
+        own_size = sum(len(log['data']) + 32*len(log['topics']) for log in own)
+        indexed = timeit(lambda: [decoder.process_log(log) for log in own if log['topics'][1] == mine], repeat)
+        print("%-8d %8d %10.1f %10.2fms %10.2fms | %8d %10.1f %10.2fms" % (m, len(logs), size/1024, decode_all*1e3, route*1e3, len(own), own_size/1024, indexed*1e3))
+
+
+#--------------------------|Seconds from launching the front-end to its first menu, best of repeat runs
+#Every run is a new interpreter paying all its imports; stdin is closed, so the
+#front-end stops at the first input() and is killed
+def time_to_menu(repeat=5):
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, "board.py"], cwd=here, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, env=dict(os.environ, PYTHONUNBUFFERED="1"))
+        for line in proc.stdout:
+            if(b"New Game" in line):
+                samples.append(time.perf_counter() - t)
+                break
+        proc.kill()
+        proc.wait()
+    if(not samples):
+        raise RuntimeError("board.py never showed its menu")
+    return min(samples)
+
+
+def bench_startup():
+    print("\n|----- Startup -----|")
+    t = time_to_menu()
+    print("time to menu %.0fms (budget %.0fms)%s" % (t*1e3, MENU_BUDGET*1e3, "" if t <= MENU_BUDGET else " OVER BUDGET"))
+
+
+# ----------------------------------| OFFLINE SUITE |----------------------------------
+#Same measurements on every run, written as JSON and diffed against a previous run.
+#The contract runs on an in-process eth-tester/py-evm chain, no Ganache needed.
+
+
+#--------------------------|Python hot paths at every board size
+#returns: {size: {measure: value}} times in ms (tree_proof in us)
+def suite_python(sizes=SIZES + [32, 64, 128], repeat=5):
+    results = {}
+    for n in sizes:
+        board_array, board_nonces = random_board(n)
+        tree = MerkleTree(board_array, board_nonces)
+        board, _ = create_board(n, auto=True)
+        cells = n*n
+        seed = secrets.token_bytes(32)
+        row = {
+            'seed_nonces_ms': timeit(lambda: SeedNonces(seed, cells).packed(), repeat) * 1e3,
+            'merkle_tree_ms': timeit(lambda: merkle_tree(board_array, board_nonces), repeat) * 1e3,
+            'tree_build_ms': timeit(lambda: MerkleTree(board_array, board_nonces), repeat) * 1e3,
+            'tree_proof_us': timeit(lambda: [tree.get_proof(k) for k in range(cells)], repeat) / cells * 1e6,
+            'to_array_ms': timeit(board.to_array, repeat) * 1e3,
+            'create_board_auto_ms': timeit(lambda: create_board(n, auto=True), repeat) * 1e3,
+        }
+        if(cells & (cells - 1) == 0): #the per-proof rebuild only handles power-of-two boards
+            k = cells - 1
+            row['get_proof_ms'] = timeit(lambda: get_proof(board_array, k, [], board_nonces), repeat) * 1e3
+        results[str(n)] = row
+    return results
+
+
+#--------------------------|ABI and bytecode of Battleships
+#The truffle artifact when present, otherwise Battleships.sol compiled with py-solc-x
+#args: path   (String) compiled contract json
+#      source (String) contract source
+
+#returns: abi (Dictionary[]), bytecode (String)
+def load_contract(path="build/contracts/Battleships.json", source="Battleships.sol"):
+    if(path.endswith(".sol")): #A source in place of the build: compiled as a missing build
+        source = path
+    elif(os.path.exists(path)):
+        return readContractData(path)
+    import solcx
+    compiled = solcx.compile_files([source], output_values=['abi', 'bin'])
+    contract = compiled[source + ':Battleships']
+    return contract['abi'], contract['bin']
+
+
+#--------------------------|Battleships deployed on an in-process chain, recording gas and time per call
+#args: abi      (Dictionary[])
+#      bytecode (String)
+class Chain:
+    def __init__(self, abi, bytecode):
+        from web3 import EthereumTesterProvider
+        self.w3 = Web3(EthereumTesterProvider())
+        self.accounts = self.w3.eth.accounts
+        factory = self.w3.eth.contract(abi=abi, bytecode=bytecode)
+        receipt = self.w3.eth.wait_for_transaction_receipt(factory.constructor().transact({'from': self.accounts[0]}))
+        self.contract = self.w3.eth.contract(abi=abi, address=receipt.contractAddress)
+        self.calls = [] #(function, gas, seconds)
+
+    #--------------------------|Sends a transaction and waits for it to be mined
+    #args: sender (Bytes)
+    #      name   (String) contract function
+    #      args   function arguments
+    #      value  (Int) wei
+
+    #returns: receipt (AttributeDict)
+    def send(self, sender, name, *args, value=0):
+        fn = self.contract.functions[name](*args)
+        t = time.perf_counter()
+        tx_hash = fn.transact({'from': sender, 'value': value})
+        receipt = self.w3.eth.wait_for_transaction_receipt(tx_hash)
+        dt = time.perf_counter() - t
+        if(receipt.status != 1):
+            raise RuntimeError(name + " reverted")
+        self.calls.append((fn.abi_element_identifier if name == 'join_match' else name, receipt.gasUsed, dt))
+        return receipt
+
+    #--------------------------|Decoded events of a receipt
+    def events(self, receipt, name):
+        return self.contract.events[name]().process_receipt(receipt, errors=DISCARD)
+
+    def mine(self, blocks):
+        self.w3.testing.mine(blocks)
+
+
+#--------------------------|Contract discovery of connect(), scanning the logs (cold) and from the deployment cache (warm)
+#returns: {'cold_ms', 'warm_ms'}
+async def discovery(abi, bytecode, repeat=5):
+    from web3 import AsyncWeb3, AsyncEthereumTesterProvider
+    w3 = AsyncWeb3(AsyncEthereumTesterProvider())
+    accounts = await w3.eth.accounts
+    await w3.eth.wait_for_transaction_receipt(await w3.eth.contract(abi=abi, bytecode=bytecode).constructor().transact({'from': accounts[0]}))
+    contract = w3.eth.contract(abi=abi)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "Battleships.json")
+        with open(path, 'w') as f:
+            json.dump({'abi': abi, 'bytecode': bytecode}, f)
+        for kind in ('cold', 'warm'):
+            t = time.perf_counter()
+            for _ in range(repeat):
+                if(kind == 'cold' and os.path.exists(cache_path(path))):
+                    os.remove(cache_path(path))
+                await find_deployment(w3, path, load_artifact(path), contract)
+            results[kind + '_ms'] = (time.perf_counter() - t) / repeat * 1e3
+    return results
+
+
+#--------------------------|Time to menu and contract discovery
+def suite_startup(abi, bytecode):
+    return {'time_to_menu_ms': time_to_menu() * 1e3, 'discovery': asyncio.run(discovery(abi, bytecode))}
+
+
+#--------------------------|Board and tree of a scripted player, with seeded ships and nonces
+def scripted_board(n, rng):
+    board = random_fleet(n, fleet(n), rng)
+    return board, MerkleTree(board.to_array(), SeedNonces(rng.randbytes(32), n*n))
+
+
+#--------------------------|Full match between two scripted players, shots in a seeded random order
+#With combined the match is created and joined with the bets attached (create_and_bet, join_and_bet)
+#and every answer carries the next shot of the answering player (answer_and_play, answer_salvo_and_play);
+#the seed gives both flows the same boards and shots, so the two are compared on the same match
+#args: chain    (Chain)
+#      n        (Int) board size
+#      salvo    (Int) shots per turn
+#      seed     (Int)
+#      combined (Bool) combined entry points instead of one call per step
+
+#returns: {'transactions', 'gas', 'turns', 'seconds', 'reveal'}
+def scripted_match(chain, n, salvo=1, seed=0, combined=False):
+    rng = random.Random(seed)
+    p1, p2 = chain.accounts[0], chain.accounts[1]
+    first = len(chain.calls)
+    t = time.perf_counter()
+    boards = {p1: scripted_board(n, rng), p2: scripted_board(n, rng)}
+    orders = {p: rng.sample(range(n*n), n*n) for p in (p1, p2)}
+
+    if(combined):
+        receipt = chain.send(p1, 'create_and_bet', boards[p1][1].root, n, pack_fleet(fleet(n)), value=1)
+        id = chain.events(receipt, 'newMatch')[0]['args']['id']
+        chain.send(p2, 'join_and_bet', bytes(32), n, pack_fleet(fleet(n)), boards[p2][1].root, value=1)
+    else:
+        receipt = chain.send(p1, 'create_match', boards[p1][1].root, n, pack_fleet(fleet(n)))
+        id = chain.events(receipt, 'newMatch')[0]['args']['id']
+        chain.send(p2, 'join_match', n)
+        chain.send(p2, 'upload_board', id, boards[p2][1].root)
+        chain.send(p1, 'bet', id, value=1)
+        chain.send(p2, 'bet', id, value=1)
+
+    def shots(player):
+        keys = sorted(orders[player][:salvo])
+        del orders[player][:salvo]
+        return keys, [k // n for k in keys], [k % n for k in keys]
+
+    shooter, answerer = p2, p1 #player_2 opens
+    keys, rows, cols = shots(shooter)
+    turns = 0
+    while True:
+        if(salvo == 1 and (turns == 0 or not combined)): #Combined: the shot went out with the last answer
+            chain.send(shooter, 'play_turn', id, rows[0], cols[0])
+        elif(turns == 0 or not combined):
+            chain.send(shooter, 'play_salvo', id, rows, cols)
+        board, tree = boards[answerer]
+        values = [int(board.cells[k]) for k in keys]
+        k = keys[0]
+        shot = shots(answerer) if combined else None #Sent with the answer, skipped by the contract if the match ends
+        if(salvo == 1 and combined):
+            receipt = chain.send(answerer, 'answer_and_play', id, values[0], k, tree.nonces[k], tree.get_proof(k), shot[1][0], shot[2][0])
+        elif(salvo == 1):
+            receipt = chain.send(answerer, 'check_move', id, values[0], k, tree.nonces[k], tree.get_proof(k))
+        elif(combined):
+            receipt = chain.send(answerer, 'answer_salvo_and_play', id, values, keys, [tree.nonces[k] for k in keys], tree.get_multiproof(keys), shot[1], shot[2])
+        else:
+            receipt = chain.send(answerer, 'check_salvo', id, values, keys, [tree.nonces[k] for k in keys], tree.get_multiproof(keys))
+        turns += 1
+        if(chain.events(receipt, 'match_ended')):
+            board, tree = boards[shooter]
+            args = [id, board.to_bitmap(), tree.nonces.seed, board.layout()]
+            reveal = {'cells_calldata_bytes': 4 + len(encode(['bytes32', 'uint64[]'], [id, board.to_array()])), #One word per cell, as the removed check_board
+                      'calldata_bytes': (len(chain.contract.encode_abi('reveal_board', args)) - 2) // 2,
+                      'gas': chain.contract.functions.reveal_board(*args).estimate_gas({'from': shooter})}
+            receipt = chain.send(shooter, 'reveal_board', id, board.to_bitmap(), tree.nonces.seed, board.layout())
+            if(chain.events(receipt, 'match_ended')[0]['args']['outcome'] != 1):
+                raise RuntimeError("board reveal rejected")
+            break
+        shooter, answerer = answerer, shooter
+        keys, rows, cols = shot if combined else shots(shooter)
+
+    calls = chain.calls[first:]
+    return {'transactions': len(calls), 'gas': sum(c[1] for c in calls), 'turns': turns, 'seconds': time.perf_counter() - t, 'reveal': reveal}
+
+
+#--------------------------|Match ended by inactivity: covers join_match(), join_match_id and the accuse functions
+def scripted_inactivity(chain, n=4, seed=0):
+    rng = random.Random(seed)
+    p1, p2 = chain.accounts[2], chain.accounts[3]
+    tree_1 = scripted_board(n, rng)[1]
+    tree_2 = scripted_board(n, rng)[1]
+    receipt = chain.send(p1, 'create_match', tree_1.root, n, pack_fleet(fleet(n)))
+    id = chain.events(receipt, 'newMatch')[0]['args']['id']
+    chain.send(p2, 'join_match')
+    chain.send(p2, 'join_match_id', id)
+    chain.send(p2, 'upload_board', id, tree_2.root)
+    chain.send(p1, 'bet', id, value=1)
+    chain.send(p2, 'bet', id, value=1)
+    #player_2 never shoots
+    chain.send(p1, 'accuse_player', id)
+    chain.send(p2, 'accuse_res', id)
+    chain.send(p1, 'accuse_player', id)
+    chain.mine(5)
+    chain.send(p1, 'withdraw', id)
+
+
+#--------------------------|Mean gas of the hot functions on one build of the contract: creation, join, bets and a few turns
+#Only calls every version of the contract has, so that an older build is measured the same way
+#args: abi      (Dictionary[])
+#      bytecode (String)
+#      n        (Int) board size, a power of two for the first versions of the contract
+#      turns    (Int) shots fired and answered
+
+#returns: {function: mean gas}
+def hot_path_gas(abi, bytecode, n=8, turns=8, seed=0):
+    chain = Chain(abi, bytecode)
+    rng = random.Random(seed)
+    p1, p2 = chain.accounts[0], chain.accounts[1]
+    boards = {p1: scripted_board(n, rng), p2: scripted_board(n, rng)}
+    create = next(f for f in abi if f.get('name') == 'create_match')
+    ships = pack_fleet(fleet(n)) if create['inputs'][2]['name'] == 'fleet' else total_ships(fleet(n)) #Older builds take the ship cells
+    receipt = chain.send(p1, 'create_match', boards[p1][1].root, n, ships)
+    id = chain.events(receipt, 'newMatch')[0]['args']['id']
+    chain.send(p2, 'join_match_id', id)
+    chain.send(p2, 'upload_board', id, boards[p2][1].root)
+    chain.send(p1, 'bet', id, value=1)
+    chain.send(p2, 'bet', id, value=1)
+    shooter, answerer = p2, p1 #player_2 opens
+    for k in rng.sample(range(n*n), turns):
+        board, tree = boards[answerer]
+        chain.send(shooter, 'play_turn', id, k // n, k % n)
+        chain.send(answerer, 'check_move', id, int(board.cells[k]), k, tree.nonces[k], tree.get_proof(k))
+        shooter, answerer = answerer, shooter
+    gas = {}
+    for name, g, _ in chain.calls:
+        gas.setdefault(name, []).append(g)
+    return {name: sum(g) / len(g) for name, g in gas.items()}
+
+
+#--------------------------|Gas of the hot functions before and after a change of the contract
+#args: baseline (String) older build: compiled json, or .sol source compiled with py-solc-x
+#      contract (String) current build, compiled from source if missing
+#      n        (Int) board size
+
+#returns: (before, after) ({function: mean gas})
+def gas_report(baseline, contract="build/contracts/Battleships.json", n=8):
+    before = hot_path_gas(*load_contract(baseline), n)
+    after = hot_path_gas(*load_contract(contract), n)
+    print("\n|----- Gas of the hot functions (%dx%d) -----|" % (n, n))
+    print("%-16s %10s %10s %9s" % ("function", "before", "after", "change"))
+    for name, gas in before.items():
+        print("%-16s %10.0f %10.0f %+8.1f%%" % (name, gas, after[name], (after[name] / gas - 1) * 100))
+    return before, after
+
+
+#--------------------------|Gas and time of every contract function, plus full matches per board size
+#Every match is played twice, one call per step and with the combined entry points
+#returns: {'functions': {function: stats}, 'matches': {size: stats}, 'salvo_matches': {size: stats},
+#          'combined_matches': {size: stats}, 'combined_salvo_matches': {size: stats}}
+def suite_contract(abi, bytecode, sizes=SIZES, salvo=4):
+    chain = Chain(abi, bytecode)
+    matches = {str(n): scripted_match(chain, n) for n in sizes}
+    salvo_matches = {str(n): scripted_match(chain, n, salvo) for n in sizes if n*n > salvo}
+    combined_matches = {str(n): scripted_match(chain, n, combined=True) for n in sizes}
+    combined_salvo_matches = {str(n): scripted_match(chain, n, salvo, combined=True) for n in sizes if n*n > salvo}
+    scripted_inactivity(chain)
+
+    functions = {}
+    for name, gas, dt in chain.calls:
+        functions.setdefault(name, []).append((gas, dt))
+    stats = {}
+    for name, samples in sorted(functions.items()):
+        gas = [g for g, _ in samples]
+        stats[name] = {'calls': len(samples), 'gas_mean': sum(gas) / len(gas), 'gas_min': min(gas), 'gas_max': max(gas),
+                       'ms_mean': sum(dt for _, dt in samples) / len(samples) * 1e3}
+    return {'functions': stats, 'matches': matches, 'salvo_matches': salvo_matches,
+            'combined_matches': combined_matches, 'combined_salvo_matches': combined_salvo_matches}
+
+
+#--------------------------|One bot match on the stand-in node, each player with its own connections and pump (as two processes)
+#args: url       (String) stand-in node
+#      abi       (Dictionary[])
+#      address   (String) deployed Battleships
+#      transport (String) 'poll' (EventPump) or 'push' (SocketPump)
+#      size      (Int) board size
+#      drop      (Async callable) cuts the subscriptions, called every second during the match (None: never)
+
+#returns: {'seconds', 'shot_ms_p50', 'shot_ms_max', 'answer_ms_p50'}
+async def transport_match(url, abi, address, transport, size, drop=None):
+    from web3 import AsyncWeb3, WebSocketProvider
+    from board import HuntTargetPlayer
+    from events import EventPump, SocketPump
+    from session import MatchManager, summary
+    managers = []
+    for _ in range(2):
+        w3 = AsyncWeb3(WebSocketProvider(url))
+        await w3.provider.connect()
+        contract = w3.eth.contract(abi=abi, address=address)
+        block = await w3.eth.block_number
+        pump = EventPump(w3, contract, block) if transport == 'poll' else SocketPump(w3, contract, url, block)
+        managers.append(MatchManager(w3, contract, await w3.eth.accounts, pump))
+    accounts = list(managers[0].accounts.active)
+    creator = managers[0].session(accounts[0], player=HuntTargetPlayer(size), verbose=False)
+    joiner = managers[1].session(accounts[1], player=HuntTargetPlayer(size), verbose=False)
+    id = await creator.create(size, auto=True, amount=1 if creator.combined else None)
+    async def cut():
+        while True:
+            await asyncio.sleep(1)
+            await drop()
+    cutter = asyncio.ensure_future(cut()) if drop is not None else None
+    t = time.perf_counter()
+    try:
+        await asyncio.gather(managers[0].run(creator.run()), managers[1].run(joiner.run(match_id=id)))
+    finally:
+        if(cutter is not None):
+            cutter.cancel()
+    seconds = time.perf_counter() - t
+    for m in managers:
+        await m.w3.provider.disconnect()
+    shot = summary(creator.latency['shot'] + joiner.latency['shot'])
+    answer = summary(creator.latency['answer'] + joiner.latency['answer'])
+    return {'seconds': seconds, 'shot_ms_p50': shot[2]*1e3, 'shot_ms_max': shot[4]*1e3, 'answer_ms_p50': answer[2]*1e3}
+
+
+#--------------------------|Event delivery: polling against eth_subscribe pushes, on the stand-in WebSocket node
+#The push match is played a second time with the subscriptions cut every second, so the
+#reconnection and the backfill of the SocketPump are exercised on every run
+def suite_events(abi, bytecode, size=4):
+    from testnode import TestNode
+    async def run():
+        node = TestNode()
+        url = await node.start()
+        w3 = node.w3
+        receipt = w3.eth.wait_for_transaction_receipt(w3.eth.contract(abi=abi, bytecode=bytecode).constructor().transact({'from': w3.eth.accounts[0]}))
+        results = {}
+        for name, transport, drop in (('poll', 'poll', None), ('push', 'push', None), ('push_reconnect', 'push', node.drop)):
+            results[name] = await transport_match(url, abi, receipt.contractAddress, transport, size, drop)
+        await node.stop()
+        return results
+    return asyncio.run(run())
+
+
+#--------------------------|Versions and revision the results belong to
+def suite_meta():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(), 'web3': web3.__version__}
+
+
+#--------------------------|Flattens nested results into {'a/b/c': value}
+def flatten(results, prefix=''):
+    flat = {}
+    for key, value in results.items():
+        if(isinstance(value, dict)):
+            flat.update(flatten(value, prefix + key + '/'))
+        elif(isinstance(value, (int, float)) and not isinstance(value, bool)):
+            flat[prefix + key] = value
+    return flat
+
+
+#--------------------------|Regressions of new results against old ones
+#Gas and transaction counts are deterministic: any increase is reported.
+#Timings are noisy: only increases above tolerance are reported.
+#args: old, new   (Dictionary) suite results
+#      tolerance (Float) relative slowdown allowed on timings
+
+#returns: regressions (List of (measure, old, new))
+def compare(old, new, tolerance=0.25):
+    old, new = flatten(old), flatten(new)
+    regressions = []
+    for key in sorted(old.keys() & new.keys()):
+        if(key.startswith('meta/') or key.endswith('/calls') or key.endswith('/turns')):
+            continue
+        exact = 'gas' in key or 'calldata' in key or key.endswith('transactions')
+        limit = old[key] if exact else old[key] * (1 + tolerance)
+        if(new[key] > limit):
+            regressions.append((key, old[key], new[key]))
+    return regressions
+
+
+#--------------------------|Runs the offline suite
+#args: out       (String) JSON results path
+#      baseline  (String) previous JSON results to compare with
+#      contract  (String) compiled contract json (compiled from source if missing)
+
+#returns: number of regressions (Int)
+def suite(out, baseline=None, contract="build/contracts/Battleships.json", sizes=SIZES):
+    results = {'meta': suite_meta(), 'python': suite_python(sizes + [n for n in (32, 64, 128) if n not in sizes])}
+    abi, bytecode = load_contract(contract)
+    results.update(suite_contract(abi, bytecode, sizes))
+    results['startup'] = suite_startup(abi, bytecode)
+    results['events'] = suite_events(abi, bytecode)
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=1)
+
+    startup = results['startup']
+    print("\n|----- Startup -----|")
+    print("time to menu %.0fms (budget %.0fms), contract discovery %.1fms cold / %.1fms cached" % (startup['time_to_menu_ms'], MENU_BUDGET*1e3, startup['discovery']['cold_ms'], startup['discovery']['warm_ms']))
+    over = startup['time_to_menu_ms'] > MENU_BUDGET*1e3
+    if(over):
+        print("REGRESSION time to menu over budget")
+
+    print("\n|----- Contract functions -----|")
+    print("%-24s %6s %10s %10s %10s" % ("function", "calls", "gas mean", "gas max", "ms mean"))
+    for name, row in results['functions'].items():
+        print("%-24s %6d %10.0f %10d %10.2f" % (name, row['calls'], row['gas_mean'], row['gas_max'], row['ms_mean']))
+    print("\n|----- Full matches: one call per step against combined calls -----|")
+    print("%-8s %8s %8s %12s %8s %12s %8s %12s %8s %12s" % ("size", "turns", "txs", "gas", "comb tx", "comb gas",
+                                                           "salvo tx", "salvo gas", "comb tx", "comb gas"))
+    empty = {'transactions': 0, 'gas': 0}
+    for n, row in results['matches'].items():
+        combined = results['combined_matches'][n]
+        salvo = results['salvo_matches'].get(n, empty)
+        combined_salvo = results['combined_salvo_matches'].get(n, empty)
+        print("%-8s %8d %8d %12d %8d %12d %8d %12d %8d %12d" % (n + "x" + n, row['turns'], row['transactions'], row['gas'],
+              combined['transactions'], combined['gas'], salvo['transactions'], salvo['gas'], combined_salvo['transactions'], combined_salvo['gas']))
+    print("\n|----- End of match board check -----|")
+    print("%-8s %14s %14s %12s" % ("size", "cells calldata", "reveal calldata", "reveal gas"))
+    for n, row in results['matches'].items():
+        reveal = row['reveal']
+        print("%-8s %14d %14d %12d" % (n + "x" + n, reveal['cells_calldata_bytes'], reveal['calldata_bytes'], reveal['gas']))
+    print("\n|----- Event delivery (4x4 bot match, stand-in WebSocket node) -----|")
+    print("%-16s %10s %12s %12s %14s" % ("transport", "match s", "shot p50 ms", "shot max ms", "answer p50 ms"))
+    for name, row in results['events'].items():
+        print("%-16s %10.1f %12.1f %12.1f %14.1f" % (name, row['seconds'], row['shot_ms_p50'], row['shot_ms_max'], row['answer_ms_p50']))
+    print("\nResults written to " + out)
+
+    if(baseline is None):
+        return int(over)
+    with open(baseline) as f:
+        regressions = compare(json.load(f), results)
+    for key, old, new in regressions:
+        print("REGRESSION %-48s %14.3f -> %14.3f" % (key, old, new))
+    print("%d regressions against %s" % (len(regressions), baseline))
+    return len(regressions) + int(over)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Battleships benchmarks: tables by default, the offline JSON suite with --json")
+    parser.add_argument("--json", metavar="OUT", help="run the offline suite and write its results to OUT")
+    parser.add_argument("--compare", metavar="BASELINE", help="previous --json results; exits with 1 on regressions")
+    parser.add_argument("--contract", default="build/contracts/Battleships.json", help="compiled contract json")
+    parser.add_argument("--gas", metavar="BASELINE", help="gas of the hot functions against an older build (compiled json or .sol source)")
+    args = parser.parse_args()
+    if(args.gas):
+        gas_report(args.gas, args.contract)
+        sys.exit(0)
+    if(args.json):
+        sys.exit(1 if suite(args.json, args.compare, args.contract) else 0)
+    bench_hashing()
+    bench_merkle()
+    bench_placement()
+    bench_events()
+    bench_startup()
@@ -4,27 +4,190 @@
 
 import math
 import secrets
-import time
-import pandas as pd
+import random
+import functools
 import numpy as np
 import asyncio
-import warnings
-from web3 import Web3
+import argparse
+import importlib
+import time
+from eth_hash.auto import keccak
 import json
+import re
+
+
+
+#Cell codes of a Board
+EMPTY = 0
+SHIP = 1
+HIT = 2
+MISS = 3
+MARKERS = {EMPTY: "0", SHIP: "1", HIT: "H", MISS: "M"}
+
+
+#--------------------------|Square board backed by a NumPy uint8 grid
+#args: n (Int) board size
+class Board:
+    __slots__ = ("n", "grid", "cells", "ships")
+
+    def __init__(self, n):
+        self.n = n
+        self.grid = np.zeros((n, n), dtype=np.uint8)
+        self.cells = self.grid.reshape(-1) #Flat view in leaf order, shares memory with grid
+        self.ships = [] #Placed ships as (start cell, length, vertical), empty when only the cells are known
+
+    def __len__(self):
+        return self.n
+
+    def __str__(self):
+        return format_board(self)
+
+    #--------------------------|View on the straight segment between two cells (inclusive)
+    def segment(self, r1, c1, r2, c2):
+        return self.grid[min(r1,r2) : max(r1,r2)+1, min(c1,c2) : max(c1,c2)+1]
+
+    #--------------------------|No ship on the segment between two cells
+    def is_free(self, r1, c1, r2, c2):
+        return not self.segment(r1, c1, r2, c2).any()
+
+    #--------------------------|Room for a ship of the given length starting at (row, col), in any direction
+    def has_room(self, row, col, length):
+        n = self.n
+        return ((row + length <= n and not self.grid[row : row+length, col].any()) or
+                (row - length >= -1 and not self.grid[row-length+1 : row+1, col].any()) or
+                (col + length <= n and not self.grid[row, col : col+length].any()) or
+                (col - length >= -1 and not self.grid[row, col-length+1 : col+1].any()))
+
+    #--------------------------|Marks the segment between two cells with a cell code
+    def place(self, r1, c1, r2, c2, value=SHIP):
+        self.segment(r1, c1, r2, c2)[...] = value
+        if(value == SHIP):
+            self.ships.append((min(r1,r2)*self.n + min(c1,c2), max(abs(r1-r2), abs(c1-c2)) + 1, r1 != r2))
+
+    #returns: board_array (Int[])
+    def to_array(self):
+        return self.cells.tolist()
+
+    #--------------------------|Ship cells packed 256 per uint256 word, as reveal_board takes them
+    #Cell i is bit (i % 256) of word i // 256
+    #returns: bitmap (Int[])
+    def to_bitmap(self):
+        bits = np.packbits(self.cells == SHIP, bitorder='little').tobytes()
+        return [int.from_bytes(bits[i:i+32], 'little') for i in range(0, len(bits), 32)]
+
+    #--------------------------|Placed ships packed as reveal_board takes them
+    #returns: layout (Int[])
+    def layout(self):
+        return pack_ships(self.ships)
+
+
+#--------------------------|Board printing, one row per line with labels
+#args: board (Board)
+
+#returns: String
+def format_board(board):
+    n = len(board)
+    label = len(row_label(n-1))
+    width = max(len(str(n-1)), 1)
+    lines = [" "*label + "".join(" " + str(j).rjust(width) for j in range(n))]
+    for i in range(n):
+        lines.append(row_label(i).ljust(label) + "".join(" " + MARKERS[v].rjust(width) for v in board.grid[i].tolist()))
+    return "\n".join(lines)
+
+
+#Ships available for each standard board size <length -> number>, lengths 1 to 16: the fleet is stored
+#with each match (create_match), so the joiner places and the winner reveals the same one
+FLEETS = {
+    2: {'2': 1},
+    4: {'2': 2,'3': 1},
+    8: {'2': 1,'3': 2,'4': 1,'5': 1},
+    16: {'2': 3,'3': 4,'4': 2,'5': 3},
+}
+MAX_SIZE = 128
+
+#Node, compiled contract and directory of the match checkpoints (board, nonces and state of the running matches)
+NODE_URL = "HTTP://127.0.0.1:7545"
+EVENTS_URL = "ws://127.0.0.1:7545" #Ganache serves WebSocket on the HTTP port; polling if refused
+CONTRACT_PATH = "build/contracts/Battleships.json"
+CHECKPOINTS = "checkpoints"
+
+
+#--------------------------|Fleet for a board size
+#Non-standard sizes scale the fleet of the largest standard size that fits
+#args: n (Int) board size
+
+#returns: ships (Dictionary <ship -> number_available>)
+def fleet(n):
+    if(n in FLEETS):
+        return dict(FLEETS[n])
+    base = max(k for k in FLEETS if k <= n)
+    scale = (n*n) // (base*base)
+    return {k: v*scale for k,v in FLEETS[base].items()}
+
 
+#--------------------------|Total number of ship cells of a fleet
+#args: ships (Dictionary <ship -> number_available>)
 
+#returns: n_ships (Int)
+def total_ships(ships):
+    return sum(int(k)*v for k,v in ships.items())
 
-#--------------------------|Convert DataFrame to Array
-#args: board (DataFrame)
 
-#returns: board_array (Int[])
-def df_toArray(board): 
-    board_array = []
-    size = len(board)
-    for i in range(size):
-        for j in range(size):
-            board_array.append(board.iat[i,j].item())
-    return board_array
+#--------------------------|Fleet packed as create_match takes it: 16 bits per length, length l at bit 16*(l-1)
+#args: ships (Dictionary <ship -> number_available>)
+
+#returns: fleet (Int)
+#raises: ValueError for a length outside 1..16 or a count over 16 bits
+def pack_fleet(ships):
+    word = 0
+    for k, v in ships.items():
+        if(not 1 <= int(k) <= 16 or not 0 <= v < 1 << 16):
+            raise ValueError("Fleet not supported by the contract: " + str(k) + " x " + str(v))
+        word |= v << (16 * (int(k) - 1))
+    return word
+
+
+#--------------------------|Fleet of a match read from the contract (match_fleet)
+#args: word (Int) fleet packed as by pack_fleet
+
+#returns: ships (Dictionary <ship -> number_available>)
+def unpack_fleet(word):
+    counts = ((length, (word >> (16 * (length - 1))) & 0xffff) for length in range(1, 17))
+    return {str(length): v for length, v in counts if v > 0}
+
+
+#--------------------------|Row label: A..Z, AA..AZ, BA.. (same scheme as spreadsheet columns)
+#args: i (Int) row index
+
+#returns: label (String)
+def row_label(i):
+    label = ""
+    i += 1
+    while(i > 0):
+        i, r = divmod(i-1, 26)
+        label = chr(r+65) + label
+    return label
+
+
+COORD = re.compile(r"([A-Z]+)(\d+)")
+
+#--------------------------|Parses a coordinate such as "B7" or "AC112"
+#args: coord (String) upper case
+#      n     (Int) board size
+
+#returns: row, col (Int, Int) - (-1, -1) if invalid
+def parse_coord(coord, n):
+    m = COORD.fullmatch(coord.strip())
+    if(m is None):
+        return -1, -1
+    row = 0
+    for c in m.group(1):
+        row = row*26 + ord(c)-64
+    row -= 1
+    col = int(m.group(2))
+    if(row > n-1 or col > n-1):
+        return -1, -1
+    return row, col
 
 
 #--------------------------|Read contract json
@@ -48,9 +211,10 @@ def print_available(d):
 
 
 #--------------------------|Fills the board with all the positioning checks
-#args: ships (Dictionary)
-#      board (DataFrame)
-def fill_board(ships, board): 
+#args: ships  (Dictionary)
+#      board  (Board)
+#      screen (Screen) renderer of the board, only the placed ship cells are redrawn
+def fill_board(ships, board, screen):
     lenght = len(board)
     while(ships):
         print_available(ships)
@@ -60,7 +224,7 @@ def fill_board(ships, board):
             print_available(ships)
             ship = str(input("\nSelect the length of the ship to place: "))
         print("Select coordinates for placement\n")
-        print(board)
+        screen.show(("YOUR BOARD", board.grid))
         ship_int = int(ship)
         
         #--------------------------------1st coordinate
@@ -68,61 +232,19 @@ def fill_board(ships, board):
         first_col = -1
         while(first_row < 0 or first_row > lenght-1 or first_col < 0 or first_col > lenght-1):
             first = str(input("\nStarting point:\n").upper())
-            if(len(first)<2):
+            first_row, first_col = parse_coord(first, lenght)
+            if(first_row < 0 or first_col < 0):
                 print("Invalid placement - Select a correct cordinate!\n")
-            else:
-                first_row = ord(first[0])-65
-                try:
-                    first_col = int(first[1:])
-                except ValueError:
-                    first_col = -1
-                    first_row = -1
-                if(first_row < 0 or first_row > lenght-1 or first_col < 0 or first_col > lenght-1):
-                    print("Invalid placement - Select a correct cordinate!\n")
-                    first_col = -1
-                    first_row = -1
-                elif(board.iat[first_row, first_col] != 0):
-                    print("Invalid placement - Select a correct cordinate!\n")
-                    first_col = -1
-                    first_row = -1
+            elif(board.grid[first_row, first_col] != EMPTY):
+                print("Invalid placement - Select a correct cordinate!\n")
+                first_col = -1
+                first_row = -1
 
-                #Check wether there's room for the selected ship
-                else:
-                    
-                    #top -> down
-                    if(first_row + (ship_int - 1) < lenght):
-                        sum = 0
-                        for i in range (first_row, first_row + ship_int):
-                            sum += board.iat[i, first_col]
-                        if(sum == 0):
-                            break
-                    
-                    #bottom -> up
-                    elif(first_row - (ship_int - 1) >= 0):
-                        sum = 0
-                        for i in range(first_row, first_row - ship_int):
-                            sum += board.iat[i, first_col]
-                        if(sum == 0):
-                            break
-
-                    #left -> right  
-                    elif(first_col + (ship_int - 1) < lenght):
-                        sum = 0
-                        for i in range(first_col, first_col + ship_int):
-                            sum += board.iat[first_row, i]
-                        if(sum == 0):
-                            break
-                    
-                    #right -> left
-                    elif(first_col - (ship_int - 1) >= 0):
-                        sum = 0
-                        for i in range(first_col, first_col - ship_int):
-                            sum += board.iat[first_row, i]
-                        if(sum == 0):
-                            break
-                    print("Invalid Placement - Not enough space")
-                    first_col = -1
-                    first_row = -1
+            #Check wether there's room for the selected ship
+            elif(not board.has_room(first_row, first_col, ship_int)):
+                print("Invalid Placement - Not enough space")
+                first_col = -1
+                first_row = -1
 
         #-----------------------------------2nd coordinate
         second_row = -1
@@ -130,12 +252,7 @@ def fill_board(ships, board):
         while(second_row < 0 or second_row > lenght-1 or second_col < 0 or second_col > lenght-1):
             print("\nEnding point:", first,"- ", end='')
             second = str(input().upper())
-            second_row = ord(second[0])-65
-            try:
-                second_col = int(second[1:])
-            except ValueError:
-                second_col = -1
-                second_row = -1
+            second_row, second_col = parse_coord(second, lenght)
             if(second_row < 0 or second_row > lenght-1 or second_col < 0 or second_col > lenght-1 or
                (first_col != second_col and first_row != second_row) or 
                (first_col == second_col and abs(first_row-second_row) != ship_int-1) or 
@@ -146,137 +263,418 @@ def fill_board(ships, board):
             else:
 
                 #Check intersection with other ships
-                sum = 0
-                if(first_col == second_col and abs(first_row-second_row) == ship_int-1):
-                    #top -> down
-                    if(first_row < second_row):
-                        for i in range(first_row, second_row+1):
-                            sum += board.iat[i,first_col]
-                    #bottom -> up
-                    else:
-                        for i in range(second_row, first_row+1):
-                            sum += board.iat[i,first_col]
-                elif(first_row == second_row and abs(first_col-second_col) == ship_int-1):
-                    #left -> right
-                    if(first_col < second_col):
-                        for i in range(first_col, second_col+1):
-                            sum += board.iat[first_row, i]
-                    #right -> left
-                    else:
-                        for i in range(second_col, first_col+1):
-                            sum += board.iat[first_row, i]
-                if(sum!=0):
+                if(not board.is_free(first_row, first_col, second_row, second_col)):
                     print("Invalid placement - Select a correct cordinate!\n")
                     second_row = -1
                     second_col = -1
                 #Placement
                 else:
-                    if(first_row == second_row):
-                        #left -> right
-                        if(first_col < second_col):
-                            for i in range (first_col, second_col+1):
-                                board.iat[first_row,i] = 1
-                        #right -> left
-                        else:
-                            for i in range (second_col, first_col+1):
-                                board.iat[first_row, i] = 1
-                    elif(first_col == second_col):
-                        #top -> down
-                        if(first_row < second_row):
-                            for j in range (first_row, second_row+1):
-                                board.iat[j, first_col] = 1
-                        #bottom -> up
-                        else:
-                            for j in range (second_row, first_row+1):
-                                board.iat[j, first_col] = 1
+                    board.place(first_row, first_col, second_row, second_col)
                     if(ships[ship] > 1):
                         ships[ship] -= 1
                     else:
                         ships.pop(ship)
-            print(board)
+            screen.show(("YOUR BOARD", board.grid))
+
+
+#--------------------------|Legal-placement masks of a ship on an empty board
+#Bit (row*n + col) of a mask is set when a ship can start at (row, col)
+#args: n      (Int) board size
+#      length (Int) ship length
+
+#returns: (horizontal starts, vertical starts, horizontal shape, vertical shape) (Int bitboards)
+@functools.lru_cache(maxsize=None)
+def placement_masks(n, length):
+    h_starts = 0
+    v_starts = 0
+    for row in range(n):
+        for col in range(n):
+            if(col + length <= n):
+                h_starts |= 1 << (row*n + col)
+            if(row + length <= n):
+                v_starts |= 1 << (row*n + col)
+    h_shape = (1 << length) - 1
+    v_shape = sum(1 << (t*n) for t in range(length))
+    return h_starts, v_starts, h_shape, v_shape
+
+
+#--------------------------|Starts whose ship of the given length would cover a cell of a placed ship
+#The footprint of the placed shape is cached, so the update is one shift pair per mask
+#args: shape  (Int) bitboard of the placed ship at position 0
+#      start  (Int) bit where the placed ship starts
+#      length (Int) length of the ships whose starts are blocked
+#      step   (Int) 1 for horizontal ships, n for vertical ones
+def blocked_starts(shape, start, length, step):
+    offset = (length-1)*step
+    return (ship_footprint(shape, length, step) << start) >> offset
+
+@functools.lru_cache(maxsize=None)
+def ship_footprint(shape, length, step):
+    footprint = 0
+    for t in range(length):
+        footprint |= shape << ((length-1-t)*step)
+    return footprint
+
+
+#--------------------------|Position of the k-th set bit (from 0) of a bitboard
+#Binary search on the popcount of the low bits: O(log cells) big-int operations
+def nth_bit(x, k):
+    lo, hi = 0, x.bit_length()
+    while(hi - lo > 1):
+        mid = (lo + hi) // 2
+        if((x & ((1 << mid) - 1)).bit_count() > k):
+            hi = mid
+        else:
+            lo = mid
+    return lo
+
+
+#--------------------------|Ships packed 24 bits each, 10 per uint256 word, as reveal_board takes them
+#Ship k is bits 24*(k % 10) of word k // 10: start cell (16 bits), length (7 bits), vertical (1 bit)
+#args: placed ((start cell, length, vertical)[])
+
+#returns: layout (Int[])
+def pack_ships(placed):
+    words = [0] * ((len(placed) + 9) // 10)
+    for k, (start, length, vertical) in enumerate(placed):
+        words[k // 10] |= (start | length << 16 | int(vertical) << 23) << (24 * (k % 10))
+    return words
+
+
+#--------------------------|Check of reveal_board on the fleet composition of a revealed board
+#Every ship lies inside the board on ship cells no other ship covers, the ships cover
+#all the ship cells, and there are as many ships of each length as in the fleet of the match
+#args: n      (Int) board size
+#      bitmap (Int[]) ship cells packed as by Board.to_bitmap
+#      layout (Int[]) ships packed as by pack_ships
+#      ships  (Dictionary <ship -> number_available>) fleet of the match
+
+#returns: legit (Bool)
+def layout_ok(n, bitmap, layout, ships):
+    left = 0
+    for w, word in enumerate(bitmap):
+        left |= word << (256 * w)
+    if(left >> (n*n)):
+        return False
+    counts = {}
+    for word in layout:
+        for k in range(10):
+            ship = (word >> (24 * k)) & 0xffffff
+            if(ship == 0): #padding
+                continue
+            start, length, vertical = ship & 0xffff, (ship >> 16) & 127, ship >> 23
+            row, col = divmod(start, n)
+            if(not 1 <= length <= 16 or start >= n*n or (row if vertical else col) + length > n):
+                return False
+            h_starts, v_starts, h_shape, v_shape = placement_masks(n, length)
+            mask = (v_shape if vertical else h_shape) << start
+            if(left & mask != mask):
+                return False
+            left &= ~mask
+            counts[length] = counts.get(length, 0) + 1
+    return left == 0 and counts == {int(k): v for k,v in ships.items() if v > 0}
+
+
+#--------------------------|Random fleet placement with the rules fill_board enforces:
+#straight ships, inside the board, no intersections
+#Keeps, for each ship length, the bitmask of the legal starts in both orientations and
+#updates it after every ship; restarts from an empty board on a dead end
+#args: n     (Int) board size
+#      ships (Dictionary <ship -> number_available>), defaults to fleet(n)
+#      rng   (random.Random), defaults to secrets.SystemRandom()
+
+#returns: board (Board)
+def random_fleet(n, ships=None, rng=None):
+    if(ships is None):
+        ships = fleet(n)
+    if(rng is None):
+        rng = secrets.SystemRandom()
+    lengths = sorted((int(k) for k,v in ships.items() for _ in range(v)), reverse=True)
+    while True:
+        legal = {}
+        for length in set(lengths):
+            h_starts, v_starts, _, _ = placement_masks(n, length)
+            legal[length] = [h_starts, v_starts]
+        occ = 0
+        placed = []
+        for length in lengths:
+            h_legal, v_legal = legal[length]
+            count = h_legal.bit_count() + v_legal.bit_count()
+            if(count == 0):
+                break
+            k = rng.randrange(count)
+            _, _, h_shape, v_shape = placement_masks(n, length)
+            if(k < h_legal.bit_count()):
+                shape, start = h_shape, nth_bit(h_legal, k)
+            else:
+                shape, start = v_shape, nth_bit(v_legal, k - h_legal.bit_count())
+            occ |= shape << start
+            placed.append((start, length, shape == v_shape and length > 1))
+            for l, masks in legal.items():
+                masks[0] &= ~blocked_starts(shape, start, l, 1)
+                masks[1] &= ~blocked_starts(shape, start, l, n)
+        else:
+            board = Board(n)
+            bits = np.frombuffer(occ.to_bytes((n*n + 7) // 8, 'little'), dtype=np.uint8)
+            board.cells[:] = np.unpackbits(bits, bitorder='little')[:n*n]
+            board.ships = placed
+            return board
 
 
 #--------------------------|Create and fill a board, and computes merkle root
 # args: size            Board size (Int)
+#       ships           Fleet to place, defaults to fleet(size) (Dictionary)
+#       auto            Random placement instead of fill_board (Bool)
+#       rng             Random source for auto placement (random.Random)
+#       screen          Renderer of the manual placement, defaults to make_screen() (Screen)
 
-#returns: board (DataFrame)
-#         merkle_root (Bytes)
-#         board_nonces (Int[])
-def create_board(n):
-    size = n*n
-    tmp_board = np.array([0]*size).reshape(n,n)
-    board = pd.DataFrame(tmp_board, columns = [str(x) for x in range(len(tmp_board))], index=[chr(i+65) for i in range(len(tmp_board))])
-    print(board)
-    match n:
-        case 2:
-            ships = {'2': 1}
-            fill_board(ships, board)
-        case 4:
-            ships = {'2': 2,'3': 1}
-            fill_board(ships,board)
-        case 8:
-            ships = {'2': 1,'3': 2,'4': 1,'5': 1}
-            fill_board(ships,board)
-        case 16:
-            ships = {'2': 3,'3': 4,'4': 2,'5': 3}
-            fill_board(ships,board)
+#returns: board (Board)
+#         tree (MerkleTree)
+def create_board(n, ships=None, auto=False, rng=None, screen=None):
+    if(ships is None):
+        ships = fleet(n)
+    if(auto):
+        board = random_fleet(n, ships, rng)
+    else:
+        if(screen is None):
+            screen = make_screen("auto")
+        board = Board(n)
+        screen.show(("YOUR BOARD", board.grid))
+        fill_board(dict(ships), board, screen)
     
-    arr = []
-    board_nonces = []
-
-    for ind in range(n):
-            for cl in range(n):
-                arr.append(board.iat[ind, cl].item()) #DataFrame -> Int[]
-                nonce = secrets.randbits(32)
-                board_nonces.append(nonce)
+    arr = board.to_array()
+    board_nonces = SeedNonces(secrets.token_bytes(32), n*n)
                
-    r = merkle_tree(arr, board_nonces)
+    tree = MerkleTree(arr, board_nonces)
     
-    return board, r, board_nonces
+    return board, tree
 
 
 #--------------------------|Calls Solidity function to start a new match
-#args: gan                      Blockchain instance (Web3.HTTP_Provider)
+#args: txs                      Transaction pipeline (TxPipeline)
 #      merkle_root              Root hash of the board (Bytes)
 #      contract_battleship      Contract instance (Web3.eth.contract)
 #      usr_addr                 User address (Bytes)
 #      size                     Board size (Int)
+#      ships                    Fleet the board was placed with, defaults to fleet(size) (Dictionary)
+#      amount                   Bet in Ether placed with the creation (create_and_bet), None for no bet (Int)
 
 #returns: match_id (Bytes)
-def new_match(gan ,root, contract_battleships, usr_addr, size):
-    match size:
-        case 2:
-            n_ships = 2
-        case 4:
-            n_ships = 7
-        case 8:
-            n_ships = 17
-        case 16:
-            n_ships = 41
-
-    tx_hash = contract_battleships.functions.create_match(root, size, n_ships).transact({'from': usr_addr})
-    tx_receipt = gan.eth.wait_for_transaction_receipt(tx_hash)
+async def new_match(txs ,root, contract_battleships, usr_addr, size, ships=None, amount=None):
+    word = pack_fleet(fleet(size) if ships is None else ships)
+
+    fns = contract_battleships.functions
+    if(amount is None):
+        pending = await txs.transact(fns.create_match(root, size, word), {'from': usr_addr}, size)
+    else:
+        pending = await txs.transact(fns.create_and_bet(root, size, word), {'from': usr_addr, 'value': convert_to_wei(amount)}, size)
+    tx_receipt = await pending.receipt()
     logs = contract_battleships.events.newMatch().process_receipt(tx_receipt)
     match_id = logs[0]['args']['id']
     return(match_id)
 
 
+#--------------------------|Leaf nonces derived from one secret seed
+#The nonce of cell i is keccak(seed || uint256(i)): a 256-bit salt, so a published leaf
+#cannot be brute-forced back to its cell, and the only secret of a board is its 32-byte
+#seed. Single nonces are computed on demand (nonces[k]), packed() derives the whole board.
+#args: seed  (Bytes) 32 random bytes
+#      cells (Int) board cells
+class SeedNonces:
+    __slots__ = ("seed", "cells")
+
+    def __init__(self, seed, cells):
+        self.seed = seed
+        self.cells = cells
+
+    def __len__(self):
+        return self.cells
+
+    #returns: nonce (Int) uint256 of cell k
+    def __getitem__(self, k):
+        if(k < 0 or k >= self.cells):
+            raise IndexError(k)
+        return int.from_bytes(keccak(self.seed + k.to_bytes(32, 'big')), 'big')
+
+    #--------------------------|Nonces of every cell, as 32-byte big endian words
+    #seed || uint256(i) of all the cells are laid out in one buffer, then hashed chunk by chunk
+    #returns: nonces (Bytes)
+    def packed(self):
+        buf = np.zeros((self.cells, 64), dtype=np.uint8)
+        buf[:, :32] = np.frombuffer(self.seed, dtype=np.uint8)
+        buf[:, 56:] = np.arange(self.cells, dtype='>u8').view(np.uint8).reshape(self.cells, 8)
+        buf = buf.tobytes()
+        return b''.join([keccak(buf[i:i+64]) for i in range(0, len(buf), 64)])
+
+
+#--------------------------|Hashes all the leaves of a board in one pass
+#(cell, nonce) pairs are packed into one contiguous uint256 buffer, so every
+#leaf is keccak(cell || nonce): same bytes as Web3.solidity_keccak and abi.encode
+#args: board_array (Int[])
+#      board_nonces (Int[] or SeedNonces)
+
+#Boards whose cell count is not a power of two are padded with zero leaves:
+#bytes32(0) has no known preimage, so a padding leaf can never be opened
+#returns: leaves (Bytes) 32 bytes per leaf
+def hash_leaves(board_array, board_nonces):
+    cells = len(board_array)
+    buf = np.zeros((cells, 64), dtype=np.uint8)
+    buf[:, 31] = board_array #cells are 0/1: only the last byte of the uint256 is set
+    if(isinstance(board_nonces, SeedNonces)):
+        packed = board_nonces.packed()
+    else:
+        packed = b''.join([x.to_bytes(32, 'big') for x in board_nonces])
+    buf[:, 32:] = np.frombuffer(packed, dtype=np.uint8).reshape(cells, 32)
+    buf = buf.tobytes()
+    padding = bytes(32 * (tree_width(len(board_array)) - len(board_array)))
+    return b''.join([keccak(buf[i:i+64]) for i in range(0, len(buf), 64)]) + padding
+
+
+#--------------------------|Number of leaves of the padded tree
+#args: cells (Int)
+
+#returns: width (Int) smallest power of two >= cells (at least 2)
+def tree_width(cells):
+    return max(2, 1 << (cells-1).bit_length())
+
+
+#--------------------------|Combines a level of the tree pairwise
+#args: level (Bytes) 32 bytes per node
+
+#returns: parent level (Bytes)
+def hash_level(level):
+    return b''.join([keccak(level[i:i+64]) for i in range(0, len(level), 64)])
+
+
 #--------------------------|Creates a merkle tree from an array
 #args: board_array (Int[])
 #      board_nonce (Int[])
 
 #returns: merkle_root (Bytes)
 def merkle_tree(board_array, board_nonces):
-    size = int(len(board_array))
-    if(size == 2):
-        a = Web3.solidity_keccak(['uint256','uint256'], [board_array[0],board_nonces[0]])
-        b = Web3.solidity_keccak(['uint256','uint256'], [board_array[1],board_nonces[1]])
-        root = Web3.solidity_keccak(['bytes32','bytes32'], [a,b])
-        return root
-    sx = merkle_tree(board_array[0:int(size/2)], board_nonces[0:int(size/2)])
-    dx = merkle_tree(board_array[int(size/2):size], board_nonces[int(size/2):size])
-    root = Web3.solidity_keccak(['bytes32','bytes32'], [sx,dx])
-    return root
+    level = hash_leaves(board_array, board_nonces)
+    while(len(level) > 32):
+        level = hash_level(level)
+    return level
+
+
+#--------------------------|Merkle tree keeping every level in memory
+#Built once per board: proofs are index lookups on the stored levels, no rehashing
+#levels[0] are the leaves, levels[-1] the root; each level is a flat buffer of 32-byte nodes
+#args: board_array (Int[])
+#      board_nonces (Int[] or SeedNonces)
+class MerkleTree:
+    def __init__(self, board_array, board_nonces):
+        self.nonces = board_nonces
+        level = hash_leaves(board_array, board_nonces)
+        self.levels = [level]
+        while(len(level) > 32):
+            level = hash_level(level)
+            self.levels.append(level)
+
+    #returns: merkle_root (Bytes)
+    @property
+    def root(self):
+        return self.levels[-1]
+
+    #--------------------------|Merkle proof for a specific key, leaf sibling first
+    #args: k (Int)
+
+    #returns: proof[] (Bytes[])
+    def get_proof(self, k):
+        proof = []
+        for level in self.levels[:-1]:
+            sibling = (k ^ 1) * 32
+            proof.append(level[sibling : sibling+32])
+            k >>= 1
+        return proof
+
+    #--------------------------|Single proof for several keys, sharing sibling nodes
+    #Level by level, a node whose sibling is also known (a key or a node
+    #rebuilt from the keys) needs nothing; otherwise its sibling goes in the proof
+    #args: keys (Int[]) strictly increasing
+
+    #returns: proof[] (Bytes[]) in the order verify_multiproof consumes them
+    def get_multiproof(self, keys):
+        proof = []
+        for level in self.levels[:-1]:
+            parents = []
+            i = 0
+            while(i < len(keys)):
+                k = keys[i]
+                if(i+1 < len(keys) and keys[i+1] == k ^ 1):
+                    i += 2
+                else:
+                    sibling = (k ^ 1) * 32
+                    proof.append(level[sibling : sibling+32])
+                    i += 1
+                parents.append(k >> 1)
+            keys = parents
+        return proof
+
+
+#--------------------------|Verifies a multiproof (mirrors check_salvo in Battleships.sol)
+#args: root    (Bytes)
+#      cells   (Int) number of cells of the board
+#      keys    (Int[]) strictly increasing
+#      values  (Int[]) Hit(1) / Miss(0) for each key
+#      nonces  (Int[]) leaf nonce for each key
+#      proof   (Bytes[])
+
+#returns: Bool
+def verify_multiproof(root, cells, keys, values, nonces, proof):
+    keys = list(keys)
+    hashes = [keccak(values[i].to_bytes(32, 'big') + nonces[i].to_bytes(32, 'big')) for i in range(len(keys))]
+    depth = (tree_width(cells) - 1).bit_length()
+    m = len(keys)
+    p = 0
+    for _ in range(depth):
+        n = 0
+        i = 0
+        while(i < m):
+            k = keys[i]
+            if(i+1 < m and keys[i+1] == k ^ 1):
+                h = keccak(hashes[i] + hashes[i+1])
+                i += 2
+            else:
+                if(p == len(proof)):
+                    return False
+                if(k % 2 == 0):
+                    h = keccak(hashes[i] + proof[p])
+                else:
+                    h = keccak(proof[p] + hashes[i])
+                p += 1
+                i += 1
+            keys[n] = k >> 1
+            hashes[n] = h
+            n += 1
+        m = n
+    return m == 1 and p == len(proof) and hashes[0] == root
+
+
+#--------------------------|Verifies a single proof (mirrors check_move in Battleships.sol: the proof is folded as given, whatever its length)
+#args: root  (Bytes)
+#      value (Int) Hit(1) / Miss(0)
+#      k     (Int) cell index
+#      nonce (Int) leaf nonce
+#      proof (Bytes[]) leaf sibling first
+
+#returns: Bool
+def verify_proof(root, value, k, nonce, proof):
+    h = leaf_hash(value, nonce)
+    for node in proof:
+        h = keccak(h + node) if k % 2 == 0 else keccak(node + h)
+        k >>= 1
+    return h == root
+
+
+#--------------------------|Hash of one leaf: keccak(cell || nonce), the bytes of Web3.solidity_keccak(['uint256','uint256'], ...)
+#args: value (Int) cell
+#      nonce (Int)
+
+#returns: leaf (Bytes)
+def leaf_hash(value, nonce):
+    return keccak(int(value).to_bytes(32, 'big') + nonce.to_bytes(32, 'big'))
 
 
 #--------------------------|Creates a merkle proof for a specific key
@@ -293,9 +691,9 @@ def get_proof(board_array, k, proof, board_nonces):
         proof.insert(0, bytes(root))
         if(depth == 2):
             if(k % 2 == 0):
-                el = Web3.solidity_keccak(['uint256','uint256'], [board_array[abs(1-k)+int(size/2)], board_nonces[abs(1-k)+int(size/2)]])
+                el = leaf_hash(board_array[abs(1-k)+int(size/2)], board_nonces[abs(1-k)+int(size/2)])
             else:
-                el = Web3.solidity_keccak(['uint256', 'uint256'], [board_array[abs(1-k)], board_nonces[abs(1-k)]])
+                el = leaf_hash(board_array[abs(1-k)], board_nonces[abs(1-k)])
             proof.insert(0, bytes(el))
             return proof
         else:
@@ -306,7 +704,7 @@ def get_proof(board_array, k, proof, board_nonces):
         root = merkle_tree(board_array[int(size/2):size], board_nonces[int(size/2):size])
         proof.insert(0, bytes(root))
         if(depth == 2):
-            el = Web3.solidity_keccak(['uint256', 'uint256'], [board_array[abs(1-k)], board_nonces[abs(1-k)]])
+            el = leaf_hash(board_array[abs(1-k)], board_nonces[abs(1-k)])
             proof.insert(0, bytes(el))
             return proof
         else:
@@ -315,6 +713,189 @@ def get_proof(board_array, k, proof, board_nonces):
             return proof
 
 
+#--------------------------|Player strategies driving MatchSession.play
+#A strategy picks the shots of our turns and learns the opponent's responses; Hit/Miss
+#answers to the opponent always come from the committed board
+class Player:
+
+    #--------------------------|Coordinates of the next shots
+    #args: board_2 (Board) opponent's board
+    #      count   (Int) shots to fire (1 for classic turns)
+
+    #returns: shots (Int[][2]) sorted by cell index, as play_salvo requires
+    def choose_shots(self, board_2, count):
+        raise NotImplementedError
+
+    #--------------------------|Response to one of our shots
+    #args: row, col (Int)
+    #      res      (Int) Hit(1) or Miss(0)
+    def on_response(self, row, col, res):
+        pass
+
+    #--------------------------|Whether to accuse a silent opponent of inactivity
+    #returns: Bool
+    def confirm_accuse(self):
+        return True
+
+
+#--------------------------|Terminal player: shots and inactivity checks come from input()
+class HumanPlayer(Player):
+
+    def choose_shots(self, board_2, count):
+        lenght = len(board_2)
+        free = int((board_2.grid == EMPTY).sum())
+        count = min(count, free)
+        shots = set()
+        while(len(shots) < count):
+            if(count == 1):
+                coord = str(input("Fire Torpedo - Select coordinates: ").upper())
+            else:
+                coord = str(input("Fire Torpedo " + str(len(shots)+1) + "/" + str(count) + " - Select coordinates: ").upper())
+            row, col = parse_coord(coord, lenght)
+            if(row < 0 or col < 0):
+                print("Invalid placement - Select a correct cordinate!\n")
+            elif(board_2.grid[row,col] != EMPTY or (row, col) in shots):
+                print("Invalid placement - Coordinate already hit!\n")
+            else:
+                shots.add((row, col))
+        return sorted(shots)
+
+    def confirm_accuse(self):
+        print("Do you want to check if opponent is still online? Y - N")
+        check = str(input()).upper()
+        while(check != "Y" and check != "N"):
+            print("Invalid response - Select Y - N!")
+            check = str(input()).upper()
+        return check == "Y"
+
+
+#--------------------------|Bot firing at random free cells
+#args: rng (random.Random)
+class RandomPlayer(Player):
+
+    def __init__(self, rng=None):
+        self.rng = rng if rng is not None else random.Random()
+
+    def choose_shots(self, board_2, count):
+        n = len(board_2)
+        free = np.flatnonzero(board_2.cells == EMPTY).tolist()
+        keys = self.rng.sample(free, min(count, len(free)))
+        return [(k // n, k % n) for k in sorted(keys)]
+
+
+#--------------------------|Hunt/target bot on a probability-density heatmap
+#density[r,c] counts the placements of the opponent's fleet covering (r,c) that do not
+#cross a miss. Each miss only removes the placements through that cell (incremental
+#update, O(length^2) per ship length); hits leave placements valid and switch the bot
+#to target mode on the unknown cells next to them.
+#args: n     (Int) board size
+#      ships (Dictionary <ship -> number_available>), defaults to fleet(n)
+class HuntTargetPlayer(Player):
+
+    def __init__(self, n, ships=None):
+        if(ships is None):
+            ships = fleet(n)
+        self.n = n
+        self.ships = {int(k): v for k,v in ships.items()}
+        self.known = np.zeros((n, n), dtype=np.uint8) #EMPTY / HIT / MISS
+        self.density = np.zeros((n, n), dtype=np.int32)
+        self.valid = {}
+        for length, count in self.ships.items():
+            h = np.ones((n, n-length+1), dtype=bool)
+            v = np.ones((n-length+1, n), dtype=bool)
+            self.valid[length] = (h, v)
+            for t in range(length):
+                self.density[:, t : t+n-length+1] += count * h
+                self.density[t : t+n-length+1, :] += count * v
+        self.parity = (np.add.outer(np.arange(n), np.arange(n)) % min(self.ships)) == 0
+
+    def on_response(self, row, col, res):
+        self.known[row, col] = HIT if res == 1 else MISS
+        if(res == 1):
+            return
+        n = self.n
+        for length, count in self.ships.items():
+            h, v = self.valid[length]
+            for s in range(max(0, col-length+1), min(col, n-length)+1):
+                if(h[row, s]):
+                    h[row, s] = False
+                    self.density[row, s : s+length] -= count
+            for s in range(max(0, row-length+1), min(row, n-length)+1):
+                if(v[s, col]):
+                    v[s, col] = False
+                    self.density[s : s+length, col] -= count
+
+    #--------------------------|Score of every cell: density in hunt mode, density next to hits in target mode
+    def scores(self):
+        unknown = self.known == EMPTY
+        hits = self.known == HIT
+        near = np.zeros((self.n, self.n), dtype=np.int32)
+        near[1:, :] += hits[:-1, :]
+        near[:-1, :] += hits[1:, :]
+        near[:, 1:] += hits[:, :-1]
+        near[:, :-1] += hits[:, 1:]
+        #Continuing a line of two hits
+        line = np.zeros((self.n, self.n), dtype=np.int32)
+        line[2:, :] += hits[:-2, :] & hits[1:-1, :]
+        line[:-2, :] += hits[2:, :] & hits[1:-1, :]
+        line[:, 2:] += hits[:, :-2] & hits[:, 1:-1]
+        line[:, :-2] += hits[:, 2:] & hits[:, 1:-1]
+        target = unknown & (near > 0)
+        if(target.any()):
+            return np.where(target, (self.density + 1) * (1 + near + 2*line), -1)
+        hunt = unknown & self.parity
+        if(not hunt.any()):
+            hunt = unknown
+        return np.where(hunt, self.density, -1)
+
+    def choose_shots(self, board_2, count):
+        scores = self.scores().reshape(-1)
+        scores[board_2.cells != EMPTY] = -1
+        free = int((scores >= 0).sum())
+        keys = np.argsort(scores, kind='stable')[::-1][:min(count, free)]
+        return [(k // self.n, k % self.n) for k in sorted(keys.tolist())]
+
+
+#--------------------------|Asks whether the ships should be placed randomly
+#returns: Bool
+def select_placement():
+    print("Random ship placement? Y - N")
+    check = str(input()).upper()
+    while(check != "Y" and check != "N"):
+        print("Invalid response - Select Y - N!")
+        check = str(input()).upper()
+    return check == "Y"
+
+
+#--------------------------|Asks the board size from menu 2
+#returns: size (Int)
+def select_size():
+    print_menu_2()
+    opt_2 = -1
+    while(opt_2<1 or opt_2>5):
+        try:
+            opt_2 = int(input())
+        except TypeError:
+            print("Invalid size! Select one of the valid sizes:")
+            opt_2 = -1
+        except ValueError:
+            print("Invalid size! Select one of the valid sizes:")
+            opt_2 = -1
+    
+    if(opt_2 == 5):
+        size = -1
+        while(size < 2 or size > MAX_SIZE):
+            try:
+                size = int(input("Board size (2-" + str(MAX_SIZE) + "): "))
+            except ValueError:
+                size = -1
+            if(size < 2 or size > MAX_SIZE):
+                print("Invalid size! Select one of the valid sizes:")
+    else:
+        size = pow(2,opt_2)
+    return size
+
+
 #--------------------------|Front end menus
 def print_menu_1():
     print("\n\n|/\/\/\/\/\/\/\/\/\/\/\/\/|BATTLESHIPS|\/\/\/\/\/\/\/\/\/\/\/\/\|\n")
@@ -329,222 +910,82 @@ def print_menu_2():
     print("2) 4x4")
     print("3) 8x8")
     print("4) 16x16")
+    print("5) Custom (up to " + str(MAX_SIZE) + "x" + str(MAX_SIZE) + ")")
     print("|/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\//\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\|\n")
 
 def print_menu_3():
     print("\n\n|/\/\/\/\/\/\/\/\/\/\/\/\/|BATTLESHIPS|\/\/\/\/\/\/\/\/\/\/\/\/\|\n")
     print("1) I already have a MatchID")
-    print("2) Join random match")
+    print("2) Join random match (by board size)")
     print("|/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\//\/\/\/\/\/\/\/\/\/\/\/\/\/\/\/\|\n")
 
 
-#--------------------------|Loop waiting for other player to join our match
-async def log_loop(event_filter, poll_interval, id):
-    while True:
-        for ev in event_filter.get_new_entries():
-            if(ev['args']['id'] == id):
-                return
-        await asyncio.sleep(poll_interval)
+#--------------------------|Asks the shots per turn
+#returns: salvo (Int)
+def select_salvo():
+    salvo = -1
+    while(salvo < 1):
+        try:
+            salvo = int(input("Shots per turn (1 = classic): "))
+        except ValueError:
+            salvo = -1
+    return salvo
+
+
+#--------------------------|Asks the reward of the match
+#returns: reward (Int) Ether
+def select_reward():
+    b = -1
+    while (b < 0):
+        print("Insert reward: ")
+        try:
+            b = int(str(input()))
+        except ValueError:
+            print("Invalid reward - Must be a positive value!")
+            b = -1
+    return b
 
 
 #Convert the amount in wei
 def convert_to_wei(amount):
+    from web3 import Web3 #web3 is only loaded once the node is needed
     return Web3.to_wei(amount, 'Ether')
 
 
-#--------------------------|Loop waiting for betting phase
-#returns: -1 (Bets do not correspond - Refund)
-#          1 (Same bet - Match start)
-async def place_bet(filter_bid, filter_end, poll_interval, id):
-    while True:
-        for ev1 in filter_end.get_new_entries():
-            if(ev1['args']['id'] == id):
-                print("Match Ended")
-                return -1
-        for ev2 in filter_bid.get_new_entries():
-            if(ev2['args']['id'] == id):
-                if(ev2['args']['bid']==2):
-                    print("Match Start")
-                    return 1
-        await asyncio.sleep(poll_interval)
-
-
-#--------------------------|Match logic loop
-#args: filter_end       (match_ended event filter)
-#      filter_accuse    (accse event filter)
-#      filter_res       (turn_response event filter)
-#      filter_play      (turn_playes event filter)
-#      filter_turn      (your_turn event filter)
-#      poll_interval    (Int)
-#      turn             (Int) 1(your turn) / -1 (opponents' turn)
-#      board_1          (DataFrame)
-#      board_2          (DaraFrame)
-#      gan              (Web3.HTTP_Povider)
-#      contract         (Web3.eth.contract)
-#      id               (Bytes)
-#      usr_addr         (Bytes)
-async def play_game(filter_end, filter_accuse, filter_res, filter_play, filter_turn, poll_interval, turn, board_1, board_2, nonces, gan, contract, id, usr_addr):
-    lenght = len(board_1)
-    board_array = df_toArray(board_1)
-    live_check = 0 #Inactivity flag check
-    while True:
+#--------------------------|Imports session (and web3 with it, most of the startup time) in a thread
+#The menu is shown right away and the import goes on while the player reads it
+#returns: asyncio.Future resolving to the session module
+def load_session():
+    return asyncio.ensure_future(asyncio.to_thread(importlib.import_module, "session"))
 
-        # Event Match ended 
-        for ev1 in filter_end.get_new_entries():
-            if(ev1['args']['id'] == id):
-                if(ev1['args']['outcome'] == -1): #cheating
-                    if(turn == 1):
-                        print("The opponent tried to cheat - You WON!")
-                    else:
-                        print("No cheating allowed - You LOOSE!")
-                    return
-                
-                elif(ev1['args']['outcome'] == -2): #inactivity
-                    if(turn == 1):
-                        print("Inactivity penalty! - You LOOSE!")
-                    else:
-                        print("Opponent left the game - You WON!")
-                    return
 
-                elif(ev1['args']['outcome'] == 0): #legit match
-                    if(turn == 1):
-                        print("All enemy ships destroyed! - Verifying your board...")
-                        tx_hash = contract.functions.check_board(id, df_toArray(board_1)).transact({'from': usr_addr})
-                        tx_receipt = gan.eth.wait_for_transaction_receipt(tx_hash)
-                elif(ev1['args']['outcome'] == 1):
-                    if(turn == 1):
-                        print("\nCongratulations - You WON!")
-                    else:
-                        print("\nGame Over - You LOOSE...")
-                    return
-                
-        #Event Accuse
-        for ev2 in filter_accuse.get_new_entries():
-            if(ev2['args']['id'] == id):
-                live_check = 2
-                if(turn == -1):
-                    curr_block_num = ev2['args']['block_num']
-                if(turn == 1):
-                    tx_hash = contract.functions.accuse_res(id).transact({'from': usr_addr})
-                    tx_receipt = gan.eth.wait_for_transaction_receipt(tx_hash)
-                    live_check = 0
-                    curr_block_num = 0
-                    latest_block_num = 0
-
-        #Event Turn_Response
-        for ev3 in filter_res.get_new_entries():
-            if(ev3['args']['id'] == id):
-                if(turn == 1):
-                    res = ev3['args']['res']
-                    if(res == 1):
-                        print("\n|----- HIT! -----|")
-                        board_2.iat[row,col] = "H"
-                    else:
-                        print("\n|----- MISS -----|")
-                        board_2.iat[row,col] = "M"
-
-        #Event Your_turn
-        for ev4 in filter_turn.get_new_entries():
-            if(ev4['args']['id'] == id):
-                turn *= -1
-                if(turn == 1): #our turn
-                    print("YOUR BOARD")
-                    print(board_1)
-                    print("\nADVERSAY BOARD")
-                    print(board_2,"\n")
-                    row = -1
-                    col = -1
-                    while(row < 0 or row > lenght-1 or col < 0 or col > lenght-1):
-                        coord = str(input("Fire Torpedo - Select coordinates: ").upper())
-                        if(len(coord)<2):
-                            print("Invalid placement - Select a correct cordinate!\n")
-                        else:
-                            row = ord(coord[0])-65
-                            try:
-                                col = int(coord[1:])
-                            except ValueError:
-                                col = -1
-                                row = -1
-                            if(row < 0 or row > lenght-1 or col < 0 or col > lenght-1):
-                                print("Invalid placement - Select a correct cordinate!\n")
-                                row = -1
-                                col = -1
-                            elif(board_2.iat[row,col]!=0):
-                                print("Invalid placement - Coordinate already hit!\n")
-                                col = -1
-                                row = -1
-                    try:
-                        tx_hash = contract.functions.play_turn(id, row, col).transact({'from': usr_addr})
-                        tx_receipt = gan.eth.wait_for_transaction_receipt(tx_hash)
-                    except:
-                        pass
-                    
-                else:
-                    print("\nOpponent's turn...")
-                    t1 = time.time()
-                    live_check = 1
-
-        #Event Turn_played
-        for ev5 in filter_play.get_new_entries():
-            if(ev5['args']['id'] == id):
-                if(turn==-1): #Opponents made its move
-                    live_check = 0
-                    row = ev5['args']['row']
-                    col = ev5['args']['col']
-                    res = -1
-                    while(res > 1 or res < 0):
-                        print("The opponent shot at: " + str(chr(row+65))+str(col))
-                        print("\nYOUR BOARD")
-                        print(board_1,"\n")
-                        print("Hit(1) or Miss(0)?: ")
-                        try:
-                            res = int(input())
-                        except ValueError:
-                            print("invalid option - Select Hit(1) or Miss(0)")
-                            res = -1
-                    k = (row*lenght)+col
-                    proof = get_proof(board_array,k,[], nonces)
-                    tx_hash = contract.functions.check_move(id, res, k, nonces[k], proof).transact({'from': usr_addr})
-                    tx_receipt = gan.eth.wait_for_transaction_receipt(tx_hash)
-                else:
-                    print("Waiting for response...")
-                
-        await asyncio.sleep(poll_interval)
-        if(live_check == 1 and turn == -1):
-            t2 = time.time()
-            if(t2 - t1 > 10):
-                print("Do you want to check if opponent is still online? Y - N")
-                check = str(input()).upper()
-                while(check != "Y" and check != "N"):
-                    print("Invalid response - Select Y - N!")
-                    check = str(input()).upper()
-                if(check == "Y"):
-                    tx_hash = contract.functions.accuse_player(id).transact({'from': usr_addr})
-                    tx_receipt = gan.eth.wait_for_transaction_receipt(tx_hash)
-                else:
-                    t1 = time.time()
-                    t2 = t1
-        elif(live_check == 2 and turn == -1):
-            latest_block_num = gan.eth.block_number
-            if(latest_block_num - curr_block_num >= 5):
-                tx_hash = contract.functions.withdraw(id).transact({'from': usr_addr})
-                tx_receipt = gan.eth.wait_for_transaction_receipt(tx_hash)
+#--------------------------|Board renderer, imported with the session module (render builds on this module too)
+#args: display (String) 'auto', 'ansi' or 'plain'
+def make_screen(display):
+    from render import make_screen
+    return make_screen(display)
 
 
-def main():
-    warnings.filterwarnings("ignore","The log with transaction hash")
-    warnings.simplefilter(action='ignore', category=FutureWarning)
-    url = "HTTP://127.0.0.1"
-    port = 7545
-    gan = Web3(Web3.HTTPProvider(url + ":" + str(port)))
-    
-    #Create the contract instance
-    _abi, _bytecode = readContractData("build/contracts/Battleships.json")
-    contract_instance = gan.eth.contract(abi = _abi, bytecode = _bytecode)
-    filter = contract_instance.events.BattleshipsCreated.create_filter(fromBlock = 0, toBlock = 'latest')
-    evs = filter.get_all_entries()
-    _address = evs[0]['args']['addr']
-    contract_battleships = gan.eth.contract(abi = _abi, address = _address)
+#--------------------------|Connects once the session module is loaded
+#args: loading (asyncio.Future) load_session()
+
+#returns: MatchManager
+async def connect_node(loading):
+    session = await loading #session builds on the game primitives of this module
+    return await session.connect(NODE_URL, CONTRACT_PATH, CHECKPOINTS, EVENTS_URL)
+
+
+#--------------------------|Interactive match
+#args: resume_id (String) checkpointed match to go on with
+#      account   (String) account of the resumed match
+#      display   (String) board renderer: 'auto', 'ansi' or 'plain'
+#      combined  (Bool) create_and_bet, join_and_bet and answers carrying the next shot
+async def run(resume_id=None, account=None, display="auto", combined=True):
+    loading = load_session()
+    if(resume_id is not None):
+        manager = await connect_node(loading)
+        await resume(manager, bytes.fromhex(resume_id.removeprefix("0x")), account, make_screen(display), combined)
+        return
 
     print_menu_1()
     opt_1 = -1
@@ -557,46 +998,33 @@ def main():
         except ValueError:
             print("Invalid Operation! Select 1) or 2)")
             opt_1 = -1
+    manager = await connect_node(loading)
+    from transactions import TxRejected #Loaded with the session module
+    accounts = await manager.w3.eth.accounts
+    screen = make_screen(display)
         
     # ----------------------------------| NEW GAME |----------------------------------
     if(opt_1==1):
-        turn = 1
-        usr_addr = gan.eth.accounts[0]
-        print_menu_2()
-        opt_2 = -1
-        while(opt_2<1 or opt_2>4):
-            try:
-                opt_2 = int(input())
-            except TypeError:
-                print("Invalid size! Select one of the valid sizes:")
-                opt_2 = -1
-            except ValueError:
-                print("Invalid size! Select one of the valid sizes:")
-                opt_1 = -1
-        
-        size = pow(2,opt_2)
-        board, root, nonces = create_board(size)
-        match_id = new_match(gan, root, contract_battleships, usr_addr, size)
+        session = manager.session(accounts[0], screen=screen, combined=combined)
+        size = select_size()
+        auto = select_placement()
+        if(combined): #The bet goes out with the match (create_and_bet): no separate bet transaction
+            match_id = await session.create(size, auto=auto, amount=select_reward())
+        else:
+            match_id = await session.create(size, auto=auto)
         print("Your Match_ID: ", match_id.hex())
 
         #Waiting for opponent
-        event_filter = contract_battleships.events.match_ready.create_filter(fromBlock = 'latest')
-        loop = asyncio.new_event_loop()
-        loop = asyncio.get_event_loop()
-        try:
-            loop.run_until_complete(
-                asyncio.gather(
-                    log_loop(event_filter, 3, match_id)
-                )
-            )
-        except RuntimeError as re:
-            print(re)
+        if(not combined):
+            try:
+                await manager.pump.drive(session.wait_ready())
+            except RuntimeError as re:
+                print(re)
         
         
     # ----------------------------------| JOIN GAME |----------------------------------
     elif(opt_1==2):
-        turn = -1
-        usr_addr = gan.eth.accounts[1]
+        session = manager.session(accounts[1], screen=screen, combined=combined)
         print_menu_3()
         opt_3 = -1
         while(opt_3 < 1 or opt_3 > 2):
@@ -618,92 +1046,86 @@ def main():
                 while(ctrl == -1):
                     try:
                         match_id = bytes.fromhex(input())
-                        tx_hash = contract_battleships.functions.join_match_id(match_id).transact({'from': usr_addr})
-                        tx_receipt = gan.eth.wait_for_transaction_receipt(tx_hash)
+                        size = await (session.find_match(match_id) if combined else session.join(match_id))
                         ctrl = 1
                     except KeyboardInterrupt:
                         return
-                    except:
+                    except ValueError:
                         print("Invalid ID! - Insert a valid one: ")
                         ctrl = -1
+                    except TxRejected as e: #No such match, or already full
+                        print(e.reason + " - Insert a valid one: ")
+                        ctrl = -1
+
+            case 2: #Don't have Match_ID, join a random match of the chosen size
+                match_id = None
+                size = select_size()
+                size = await (session.find_match(size=size) if combined else session.join(size=size))
+                if(size is None):
+                    print("No available matches")
+                    return
+        auto = select_placement()
+        if(not combined):
+            await session.upload(size, auto=auto)
+        #Joins, uploads the board and bets in one transaction (join_and_bet)
+        elif(await session.join_and_bet(select_reward(), match_id, size, auto) is None):
+            print("No available matches")
+            return
+
+    session.show()
 
-                logs = contract_battleships.events.size_only().process_receipt(tx_receipt)
-                size = logs[0]['args']['size']
-
-            case 2: #Don't have Match_ID
-                tx_hash = contract_battleships.functions.join_match().transact({'from': usr_addr})
-                tx_receipt = gan.eth.wait_for_transaction_receipt(tx_hash)
-                logs = contract_battleships.events.size_ID().process_receipt(tx_receipt)
-                size = logs[0]['args']['size']
-                match_id = logs[0]['args']['id']
-        board, root, nonces = create_board(size)
-        tx_hash = contract_battleships.functions.upload_board(match_id, root).transact({'from': usr_addr})
-        tx_receipt = gan.eth.wait_for_transaction_receipt(tx_hash)
-
-    print("\nYOUR BOARD")
-    print(board)
-    tmp_board = np.array([0]*(size*size)).reshape(size,size)
-    board_2 = pd.DataFrame(tmp_board, columns = [str(x) for x in range(len(tmp_board))], index=[chr(i+65) for i in range(len(tmp_board))])
-    print("\nOPPONENT'S BOARD")
-    print(board_2)
-
-
-    filter_bet = contract_battleships.events.bid_placed.create_filter(fromBlock = 'latest')
-    filter_end = contract_battleships.events.match_ended.create_filter(fromBlock = 'latest')
-    filter_turn = contract_battleships.events.your_turn.create_filter(fromBlock = 'latest')
-    filter_res = contract_battleships.events.turn_response.create_filter(fromBlock = 'latest')
-    filter_play = contract_battleships.events.turn_played.create_filter(fromBlock = 'latest')
-    filter_accuse = contract_battleships.events.accuse.create_filter(fromBlock = 'latest')
+    #Shots per turn
+    session.salvo = select_salvo()
 
 # ----------------------------------| MATCH FULL |----------------------------------
 
-    #Reward selection
-    b = -1
-    while (b < 0):
-        print("Insert reward: ")
-        try:
-            b = int(str(input()))
-        except ValueError:
-            print("Invalid reward - Must be a positive value!")
-            b = -1
-    bet = convert_to_wei(b)
-    tx_hash = contract_battleships.functions.bet(match_id).transact({'from': usr_addr, 'value': bet})
-    tx_receipt = gan.eth.wait_for_transaction_receipt(tx_hash)
-    logs = contract_battleships.events.bid_placed().process_receipt(tx_receipt)
-    if(not logs):
-        logs = contract_battleships.events.match_ended().process_receipt(tx_receipt)
-        print("Match Ended - Reward Mismatch")
-        loop.close()
+    if(combined): #Wait for the opponent to place its bet
+        res = await manager.pump.drive(session.wait_bets())
+    else: #Bet and wait for the opponent to place its bet
+        res = await manager.pump.drive(session.bet(select_reward()))
+    #reward mismatch
+    if(res == -1):
         return
-
-    #Waiting for the opponent to palce bet
-    loop = asyncio.new_event_loop()
-    loop = asyncio.get_event_loop()
-    res = 0
-    try:
-        res = loop.run_until_complete(
-                asyncio.gather(
-                    place_bet(filter_bet, filter_end, 3, match_id)
-                )
-            )
-    finally:
-        #reward mismatch
-        if(res == -1):
-            return
     
     #Waits for game start event
-    logs = contract_battleships.events.your_turn().process_receipt(tx_receipt)
-    loop = asyncio.new_event_loop()
-    loop = asyncio.get_event_loop()
-    try:
-        loop.run_until_complete(
-            asyncio.gather(
-                play_game(filter_end, filter_accuse, filter_res, filter_play, filter_turn, 3, turn, board, board_2, nonces, gan, contract_battleships, match_id, usr_addr)
-            )
-        )
-    finally:
-        pass
-    loop.close() 
+    await manager.pump.drive(session.play(3))
+
+
+#--------------------------|Goes on with a match from its checkpoint, after a crash or a restart
+#args: manager  (MatchManager)
+#      match_id (Bytes)
+#      addr     (String) account of the match, if both players are checkpointed here
+#      screen   (Screen) board renderer
+#      combined (Bool) answers carrying the next shot
+async def resume(manager, match_id, addr=None, screen=None, combined=True):
+    from checkpoint import PLACED, READY, BET
+    t = time.perf_counter()
+    session = await manager.resume(match_id, addr, screen=screen, combined=combined)
+    print("Match resumed in %.1fms" % ((time.perf_counter() - t)*1e3))
+    session.show()
+
+    if(session.phase == PLACED):
+        await manager.pump.drive(session.wait_ready())
+    if(session.phase == READY):
+        session.salvo = select_salvo()
+        res = await manager.pump.drive(session.bet(select_reward()))
+    elif(session.phase == BET):
+        res = await manager.pump.drive(session.wait_bets())
+    else:
+        res = 1
+    if(res == -1):
+        return
+    await manager.pump.drive(session.play(3))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Battleships front-end")
+    parser.add_argument("--resume", metavar="MATCH_ID", help="go on with a checkpointed match (or the board root of a creation/join interrupted before it was mined)")
+    parser.add_argument("--account", help="account of the resumed match, if both players are checkpointed here")
+    parser.add_argument("--display", choices=["auto", "ansi", "plain"], default="auto", help="board renderer (auto: ANSI on a terminal)")
+    parser.add_argument("--single-calls", dest="combined", action="store_false", help="one contract call per step instead of create_and_bet, join_and_bet, answer_and_play")
+    args = parser.parse_args()
+    asyncio.run(run(args.resume, args.account, args.display, args.combined))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,243 @@
+#Author: Alessandro Mazzarella
+#Title: checkpoint
+#notice: Crash-safe on-disk state of a match session, memory-mapped
+
+import glob
+import mmap
+import os
+import struct
+import zlib
+import numpy as np
+from web3 import Web3
+from board import Board, MerkleTree, SeedNonces, EMPTY
+
+
+#Checkpoint file layout (little endian)
+#  header   magic, version, role (1 creator / -1 joiner), size, match id, account, nonce seed
+#  board    size*size cell codes (uint8)
+#  ships    placed ships of the board (start cell, length, vertical), as reveal_board takes them
+#  slot A   match state
+#  slot B   match state
+#The Merkle tree is not stored: the seed and the board rebuild it with the bulk hashing path.
+#The header, board and ships are written once, before the board is committed: until the
+#creation or join is mined the match id is zero and the file is named after the board root,
+#set_id() fills the id in and renames it. The match state is written alternately in the two slots, each with a sequence number and a
+#CRC: a crash while writing a slot leaves the other one intact, and load() takes the
+#valid slot with the highest sequence number.
+MAGIC = b"BSCK"
+VERSION = 4
+HEADER = struct.Struct("<4sBbH32s20s32sH")
+ID_OFFSET = struct.calcsize("<4sBbH") #Match id field of the header
+SLOT = struct.Struct("<QBqiqbBH") #seq, phase, block, log_index, accuse_block, turn, live_check, salvo
+CRC = struct.Struct("<I")
+SHIP = struct.Struct("<HB?") #start cell, length, vertical
+
+#Phases of a checkpointed match
+PLACED = 0  #Board committed, waiting for the opponent
+READY = 1   #Both boards committed, bet not sent yet
+BET = 2     #Our bet sent, waiting for the opponent's one
+PLAYING = 3
+
+#Opponent board code of a shot fired but not answered yet (checkpoint only)
+PENDING = 4
+
+
+#--------------------------|Checkpoint file of a match, one per player (both can run on the same machine)
+#args: directory (String)
+#      id        (Bytes) match id, or board root while the match id is not known
+#      addr      (String) account playing the match
+
+#returns: path (String)
+def checkpoint_path(directory, id, addr):
+    return os.path.join(directory, bytes(id).hex() + "-" + addr[2:].lower() + ".ckpt")
+
+
+#--------------------------|Checkpoint of a match to resume
+#args: directory (String)
+#      id        (Bytes) match id, or board root of a creation/join interrupted before its id was known
+#      addr      (String) account, needed only if both players of the match are checkpointed here
+
+#returns: path (String)
+def find_checkpoint(directory, id, addr=None):
+    if(addr is not None):
+        return checkpoint_path(directory, id, addr)
+    paths = glob.glob(os.path.join(directory, bytes(id).hex() + "-*.ckpt"))
+    if(len(paths) != 1):
+        raise ValueError(("No" if not paths else "More than one") + " checkpoint of match " + bytes(id).hex() + " in " + directory)
+    return paths[0]
+
+
+#--------------------------|Memory-mapped checkpoint of a match session
+#Built by create_checkpoint() or load_checkpoint(); the match state fields hold the
+#content of the last valid slot
+#args: path (String)
+#      mm   (mmap.mmap) the whole file
+class Checkpoint:
+    def __init__(self, path, mm):
+        self.path = path
+        self.mm = mm
+        _, _, self.role, self.n, self.id, addr, self.seed, n_ships = HEADER.unpack_from(mm, 0)
+        self.addr = Web3.to_checksum_address(addr)
+        cells = self.n * self.n
+        self.board_offset = HEADER.size
+        self.slot_size = SLOT.size + cells + CRC.size
+        self.ships_offset = self.board_offset + cells
+        self.slot_offset = self.ships_offset + n_ships*SHIP.size
+        self.seq = 0
+        self.phase = PLACED
+        self.block = 0
+        self.log_index = -1
+        self.accuse_block = 0
+        self.turn = self.role
+        self.live_check = 0
+        self.salvo = 1
+        self.board_2 = Board(self.n)
+        self.shots = []
+
+    #--------------------------|Committed board and its ships, copied out of the map
+    #returns: Board
+    def board(self):
+        board = Board(self.n)
+        board.cells[:] = np.frombuffer(self.mm, dtype=np.uint8, count=len(board.cells), offset=self.board_offset)
+        board.ships = list(SHIP.iter_unpack(self.mm[self.ships_offset : self.slot_offset]))
+        return board
+
+    #--------------------------|Merkle tree of the committed board, rebuilt from the board and the nonce seed
+    #args: board (Board) committed board, read from the map if not given
+
+    #returns: MerkleTree
+    def tree(self, board=None):
+        board = self.board() if board is None else board
+        return MerkleTree(board.to_array(), SeedNonces(self.seed, self.n * self.n))
+
+    #--------------------------|Reads both slots and keeps the valid one with the highest sequence number
+    #returns: Bool, False if neither slot is valid
+    def read_state(self):
+        best = None
+        for i in range(2):
+            offset = self.slot_offset + i*self.slot_size
+            body = self.mm[offset : offset + self.slot_size - CRC.size]
+            (crc,) = CRC.unpack_from(self.mm, offset + len(body))
+            if(zlib.crc32(body) != crc):
+                continue
+            state = SLOT.unpack_from(body, 0)
+            if(best is None or state[0] > best[0][0]):
+                best = (state, body[SLOT.size:])
+        if(best is None):
+            return False
+        (self.seq, self.phase, self.block, self.log_index, self.accuse_block, self.turn, self.live_check, self.salvo), grid = best
+        cells = np.frombuffer(grid, dtype=np.uint8)
+        self.board_2 = Board(self.n)
+        self.board_2.cells[:] = np.where(cells == PENDING, EMPTY, cells)
+        self.shots = [(k // self.n, k % self.n) for k in np.flatnonzero(cells == PENDING).tolist()]
+        return True
+
+    #--------------------------|Writes the match state in the older slot and syncs it
+    #args: phase        (Int) PLACED, READY, BET or PLAYING
+    #      block        (Int) block of the last processed event
+    #      log_index    (Int) log index of the last processed event, -1 for none in that block
+    #      turn         (Int) 1 our turn, -1 opponent's turn
+    #      salvo        (Int) shots per turn
+    #      live_check   (Int) inactivity check state of MatchSession.play
+    #      accuse_block (Int) block of the opponent's accuse
+    #      board_2      (Board) opponent's board
+    #      shots        (Int[][2]) our shots still waiting for a response, sorted by cell index
+    def save(self, phase, block, log_index, turn, salvo=1, live_check=0, accuse_block=0, board_2=None, shots=()):
+        board_2 = self.board_2 if board_2 is None else board_2
+        grid = board_2.cells.copy()
+        for r, c in shots:
+            grid[r*self.n + c] = PENDING
+        self.seq += 1
+        body = SLOT.pack(self.seq, phase, block, log_index, accuse_block, turn, live_check, salvo) + grid.tobytes()
+        offset = self.slot_offset + (self.seq % 2)*self.slot_size
+        self.mm[offset : offset + len(body)] = body
+        CRC.pack_into(self.mm, offset + len(body), zlib.crc32(body))
+        start = offset - offset % mmap.ALLOCATIONGRANULARITY #msync needs an aligned offset
+        self.mm.flush(start, offset + self.slot_size - start)
+        self.phase, self.block, self.log_index, self.turn, self.salvo = phase, block, log_index, turn, salvo
+        self.live_check, self.accuse_block, self.board_2, self.shots = live_check, accuse_block, board_2, list(shots)
+
+    #--------------------------|Fills in the match id once the creation or join is mined, and renames
+    #the file from the board root to the match id
+    #args: id (Bytes) match id
+    def set_id(self, id):
+        self.id = bytes(id)
+        self.mm[ID_OFFSET : ID_OFFSET + 32] = self.id
+        self.mm.flush(0, min(len(self.mm), mmap.ALLOCATIONGRANULARITY))
+        path = checkpoint_path(os.path.dirname(self.path), self.id, self.addr)
+        os.replace(self.path, path)
+        self.path = path
+
+    def close(self):
+        if(not self.mm.closed):
+            self.mm.close()
+
+    #--------------------------|Match over: nothing left to prove, the file is removed
+    def discard(self):
+        self.close()
+        if(os.path.exists(self.path)):
+            os.remove(self.path)
+
+
+#--------------------------|Maps a whole file for reading and writing
+def map_file(path):
+    with open(path, 'r+b') as f:
+        return mmap.mmap(f.fileno(), 0)
+
+
+#--------------------------|Writes the checkpoint of a board about to be committed
+#The file is filled through a map of a temporary file, synced and renamed over the
+#final path, so a checkpoint on disk is always complete
+#args: directory (String)
+#      id        (Bytes) match id, None if the creation or join is not mined yet (set_id() fills it in)
+#      addr      (String) account playing the match
+#      role      (Int) 1 creator, -1 joiner
+#      salvo     (Int) shots per turn
+#      board     (Board) committed board, with its placed ships
+#      tree      (MerkleTree) tree of the committed board, with SeedNonces
+#      phase     (Int) PLACED or READY
+#      block     (Int) first block replayed on resume
+
+#returns: Checkpoint
+def create_checkpoint(directory, id, addr, role, salvo, board, tree, phase, block):
+    os.makedirs(directory, exist_ok=True)
+    path = checkpoint_path(directory, tree.root if id is None else id, addr)
+    n = len(board)
+    cells = n*n
+    header = HEADER.pack(MAGIC, VERSION, role, n, bytes(32) if id is None else bytes(id), bytes.fromhex(addr[2:]), tree.nonces.seed, len(board.ships))
+    ships = b"".join(SHIP.pack(*ship) for ship in board.ships)
+    size = len(header) + cells + len(ships) + 2*(SLOT.size + cells + CRC.size)
+    tmp = path + ".tmp"
+    with open(tmp, 'w+b') as f:
+        f.truncate(size)
+        mm = mmap.mmap(f.fileno(), size)
+        offset = 0
+        for part in (header, board.cells.tobytes(), ships):
+            mm[offset : offset + len(part)] = part
+            offset += len(part)
+        ckpt = Checkpoint(tmp, mm)
+        ckpt.save(phase, block, -1, role, salvo, board_2=Board(n))
+        mm.flush()
+        mm.close()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    ckpt.path = path
+    ckpt.mm = map_file(path)
+    return ckpt
+
+
+#--------------------------|Maps a checkpoint back
+#args: path (String)
+
+#returns: Checkpoint
+def load_checkpoint(path):
+    mm = map_file(path)
+    magic, version = HEADER.unpack_from(mm, 0)[:2]
+    if(magic != MAGIC or version != VERSION):
+        mm.close()
+        raise ValueError("Not a Battleships checkpoint: " + path)
+    ckpt = Checkpoint(path, mm)
+    if(not ckpt.read_state()):
+        mm.close()
+        raise ValueError("Corrupted checkpoint: " + path)
+    return ckpt
@@ -0,0 +1,93 @@
+#Author: Alessandro Mazzarella
+#Title: deployment
+#notice: Cached contract ABI and deployment addresses, so the front-end starts without scanning the chain
+
+import json
+import os
+from eth_hash.auto import keccak
+from eth_utils import event_abi_to_log_topic
+
+
+#--------------------------|Cache file of a compiled contract json
+#args: path (String) compiled contract json
+
+#returns: path (String) e.g. build/contracts/Battleships.cache.json
+def cache_path(path):
+    return os.path.splitext(path)[0] + ".cache.json"
+
+
+def read_cache(path):
+    try:
+        with open(cache_path(path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+#--------------------------|Rewrites the cache atomically (temporary file renamed over it)
+def write_cache(path, cache):
+    tmp = cache_path(path) + ".tmp"
+    try:
+        with open(tmp, 'w') as f:
+            json.dump(cache, f)
+        os.replace(tmp, cache_path(path))
+    except OSError:
+        pass #Read-only build directory: no cache, the slow path still works
+
+
+#--------------------------|ABI of the compiled contract, parsed once per build
+#The truffle artifact (ABI, bytecode, sources, AST) is read only when its size or mtime
+#change; the cache keeps the ABI, the topic of every event, the hash of the deployed
+#bytecode and the deployments found on each chain
+#args: path (String) compiled contract json
+
+#returns: cache (Dictionary) 'abi', 'topics' {event name: hex topic}, 'code_hash', 'deployments'
+def load_artifact(path):
+    st = os.stat(path)
+    stamp = [st.st_mtime_ns, st.st_size]
+    cache = read_cache(path)
+    if(cache is not None and cache.get('artifact') == stamp):
+        return cache
+    with open(path) as f:
+        artifact = json.load(f)
+    abi = artifact['abi']
+    deployed = artifact.get('deployedBytecode') or "0x"
+    cache = {
+        'artifact': stamp,
+        'abi': abi,
+        'topics': {e['name']: "0x" + event_abi_to_log_topic(e).hex() for e in abi if e['type'] == 'event'},
+        'code_hash': keccak(bytes.fromhex(deployed[2:])).hex() if len(deployed) > 2 else None,
+        'deployments': {},
+    }
+    write_cache(path, cache)
+    return cache
+
+
+#--------------------------|Address of the deployed Battleships on the node's chain
+#Deployments are cached by chain id and code hash, and a cached address costs a single
+#eth_getCode: the code there must still hash as when it was found (a restarted Ganache
+#reuses the chain id with a new state). Otherwise the BattleshipsCreated logs are scanned
+#from block 0 once; with a deployed bytecode in the artifact, the first deployment of
+#this very build is taken, else the first deployment.
+#args: w3       (AsyncWeb3)
+#      path     (String) compiled contract json
+#      cache    (Dictionary) load_artifact(path)
+#      contract (AsyncWeb3.eth.contract) contract without address, decodes the logs
+
+#returns: address (String)
+async def find_deployment(w3, path, cache, contract):
+    key = str(await w3.eth.chain_id) + ":" + str(cache['code_hash'])
+    known = cache['deployments'].get(key)
+    if(known is not None):
+        code = await w3.eth.get_code(known['address'])
+        if(keccak(bytes(code)).hex() == known['code_hash']):
+            return known['address']
+    logs = await w3.eth.get_logs({'fromBlock': 0, 'toBlock': 'latest', 'topics': [cache['topics']['BattleshipsCreated']]})
+    for log in logs:
+        address = contract.events.BattleshipsCreated().process_log(log)['args']['addr']
+        code_hash = keccak(bytes(await w3.eth.get_code(address))).hex()
+        if(cache['code_hash'] is None or code_hash == cache['code_hash']):
+            cache['deployments'][key] = {'address': address, 'code_hash': code_hash}
+            write_cache(path, cache)
+            return address
+    raise LookupError("Battleships is not deployed on this chain")
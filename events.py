@@ -0,0 +1,362 @@
+#Author: Alessandro Mazzarella
+#Title: events
+#notice: Single log pump for all the Battleships events of the client
+
+import asyncio
+import time
+from eth_utils import event_abi_to_log_topic
+from web3 import AsyncWeb3, AsyncIPCProvider, WebSocketProvider
+from metrics import METRICS
+
+
+#--------------------------|Topic of an event of the contract ABI
+#args: abi  (Dictionary[]) contract ABI
+#      name (String) event name
+
+#returns: topic (Bytes)
+def event_topic(abi, name):
+    return bytes(event_abi_to_log_topic(next(e for e in abi if e['type'] == 'event' and e['name'] == name)))
+
+
+#--------------------------|Events of a single match, filled by the EventPump
+#args: pump (EventPump)
+#      id   (Bytes) match id
+class Subscription:
+    def __init__(self, pump, id):
+        self.pump = pump
+        self.id = id
+        self.queue = asyncio.Queue()
+        self.after = None #(block, log index) of the last queued log, or processed before a resume: older logs are dropped
+        self.held = None #position -> (event, emitted) routed while a replay is fetching its logs
+        self.replaying = asyncio.Lock() #One replay at a time: the session's and the pump's backfill
+
+    #--------------------------|Queues a decoded log unless it was queued or processed before a resume
+    #During a replay the log is held back and merged in chain order with the replayed ones
+    #args: log     (AttributeDict) raw log
+    #      ev      (AttributeDict) decoded event
+    #      emitted (Int) block timestamp, None if not measured
+    def put(self, log, ev, emitted=None):
+        position = (log['blockNumber'], log['logIndex'])
+        if(self.held is not None):
+            self.held[position] = (ev, emitted)
+        elif(self.after is None or position > self.after):
+            self.queue.put_nowait((ev, emitted))
+            self.after = position
+
+    #--------------------------|Next event of the match, None if nothing arrives within timeout
+    #args: timeout (Float) seconds, None waits forever
+
+    #returns: event (AttributeDict) with 'event' name and decoded 'args'
+    async def get(self, timeout=None):
+        try:
+            if(timeout is None):
+                ev, emitted = await self.queue.get()
+            else:
+                ev, emitted = await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        if(emitted is not None): #Block timestamp -> handled here (clamped: node clocks can run ahead)
+            METRICS.observe("event", max(0.0, time.time() - emitted), event=ev['event'])
+        return ev
+
+    #--------------------------|We just sent a transaction: poll fast for its events
+    def poke(self):
+        self.pump.poke()
+
+
+#--------------------------|Fetches the logs of the subscribed matches with one eth_getLogs per new block
+#Every match event carries the match id as first indexed topic, so the node only returns
+#the logs of our own matches whatever the total contract traffic; logs are routed by that
+#topic and decoded by the event topic. The interval drops to fast after our own
+#transactions and backs off to slow while the match is idle.
+#args: w3         (AsyncWeb3)
+#      contract   (AsyncWeb3.eth.contract)
+#      from_block (Int) first block to fetch, defaults to the block of the first poll
+#      fast       (Float) seconds between polls right after a transaction
+#      slow       (Float) maximum seconds between polls
+#      backoff    (Float) interval growth factor on empty polls
+#      topics     (Dictionary) {event name: hex topic} precomputed (deployment cache), defaults to hashing the ABI
+class EventPump:
+    def __init__(self, w3, contract, from_block=None, fast=0.25, slow=3, backoff=1.5, topics=None):
+        self.w3 = w3
+        self.contract = contract
+        self.last_block = None if from_block is None else from_block - 1
+        self.fast = fast
+        self.slow = slow
+        self.backoff = backoff
+        self.interval = slow
+        self.wakeup = asyncio.Event()
+        self.subscriptions = {}
+        self.position = (-1, -1) #(block, log index) of the last dispatched log
+        self.decoders = {}
+        if(topics is None):
+            topics = {abi['name']: bytes(event_abi_to_log_topic(abi)).hex() for abi in contract.abi if abi['type'] == 'event'}
+        for name, topic in topics.items():
+            self.decoders[bytes.fromhex(topic.removeprefix("0x"))] = contract.events[name]()
+
+    #--------------------------|Starts routing the events of a match
+    #Both players of a match can subscribe from the same process: each one gets every event
+    #returns: Subscription
+    def subscribe(self, id):
+        sub = Subscription(self, bytes(id))
+        self.subscriptions.setdefault(sub.id, []).append(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        subs = self.subscriptions.get(sub.id, [])
+        if(sub in subs):
+            subs.remove(sub)
+        if(not subs):
+            self.subscriptions.pop(sub.id, None)
+
+    def poke(self):
+        self.interval = self.fast
+        self.wakeup.set()
+
+    #--------------------------|eth_getLogs filter: any event whose first indexed topic is a subscribed id
+    def log_filter(self, from_block, to_block):
+        ids = ['0x' + id.hex() for id in self.subscriptions]
+        return {'address': self.contract.address, 'fromBlock': from_block, 'toBlock': to_block, 'topics': [None, ids]}
+
+    #--------------------------|One eth_getLogs over the blocks mined since the last poll
+    #returns: number of dispatched events (Int)
+    async def poll(self):
+        block = await self.w3.eth.block_number
+        if(self.last_block is None):
+            self.last_block = block - 1
+        if(block <= self.last_block or not self.subscriptions):
+            return 0
+        logs = await self.w3.eth.get_logs(self.log_filter(self.last_block+1, block))
+        self.last_block = block
+        return await self.dispatch(logs)
+
+    #--------------------------|Routes logs to the subscriptions of their match
+    #Logs come in chain order; the ones at or before the last dispatched log were already
+    #routed (a push pump's backfill overlapping its stream) and are dropped
+    #args: logs (AttributeDict[]) raw logs
+
+    #returns: number of dispatched events (Int)
+    async def dispatch(self, logs):
+        dispatched = 0
+        stamps = {}
+        for log in logs:
+            position = (log['blockNumber'], log['logIndex'])
+            if(len(log['topics']) < 2 or log.get('removed') or position <= self.position):
+                continue
+            self.position = position
+            subs = self.subscriptions.get(bytes(log['topics'][1]))
+            decoder = self.decoders.get(bytes(log['topics'][0]))
+            if(not subs or decoder is None):
+                continue
+            ev = decoder.process_log(log)
+            emitted = None
+            if(METRICS.enabled):
+                if(log['blockNumber'] not in stamps):
+                    stamps[log['blockNumber']] = (await self.w3.eth.get_block(log['blockNumber']))['timestamp']
+                emitted = stamps[log['blockNumber']]
+            for sub in subs:
+                sub.put(log, ev, emitted)
+            dispatched += 1
+        return dispatched
+
+    #--------------------------|Queues the events of a subscription mined after a position, up to the head
+    #Used when a session is resumed from a checkpoint, or subscribes after its own transaction
+    #was mined (join_and_bet): the events it missed come first, in order, then the polls and
+    #pushes go on from there. The events routed to the subscription while the logs are fetched
+    #are held back and merged with them, and logs up to the last replayed one are dropped in
+    #the next polls, so no event is handled twice.
+    #args: sub       (Subscription)
+    #      block     (Int) block of the last processed event
+    #      log_index (Int) log index of the last processed event, -1 replays the whole block
+
+    #returns: number of replayed events (Int)
+    async def replay(self, sub, block, log_index=-1):
+        async with sub.replaying:
+            sub.after = (block, log_index) if sub.after is None else max(sub.after, (block, log_index))
+            sub.held = {}
+            try:
+                head = await self.w3.eth.block_number
+                if(self.last_block is None):
+                    self.last_block = head
+                logs = []
+                if(block <= head):
+                    logs = await self.w3.eth.get_logs({'address': self.contract.address, 'fromBlock': block, 'toBlock': head, 'topics': [None, ['0x' + sub.id.hex()]]})
+            finally:
+                held, sub.held = sub.held, None
+            for log in logs:
+                decoder = self.decoders.get(bytes(log['topics'][0]))
+                if(decoder is not None and not log.get('removed')):
+                    held.setdefault((log['blockNumber'], log['logIndex']), (decoder.process_log(log), None))
+            size = sub.queue.qsize()
+            for position in sorted(held):
+                if(position > sub.after):
+                    sub.queue.put_nowait(held[position])
+                    sub.after = position
+            return sub.queue.qsize() - size
+
+    #--------------------------|Current block number, for the inactivity checks
+    #returns: block (Int)
+    async def block_number(self):
+        return await self.w3.eth.block_number
+
+    #--------------------------|Polling loop with adaptive interval
+    async def run(self):
+        while True:
+            if(await self.poll() > 0):
+                self.interval = self.fast
+            else:
+                self.interval = min(self.slow, self.interval * self.backoff)
+            self.wakeup.clear()
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    #--------------------------|Runs the pump while a coroutine is running
+    #returns: the coroutine result
+    async def drive(self, coro):
+        task = asyncio.ensure_future(self.run())
+        try:
+            return await coro
+        finally:
+            task.cancel()
+
+
+#--------------------------|EventPump pushed by the node through eth_subscribe (WebSocket or IPC)
+#A connection of its own subscribes to newHeads and to the logs of the subscribed matches,
+#filtered on the match id topic as the polled ones: the node pushes our logs as soon as
+#their block is mined. A match subscribed while connected renews the log subscription, and
+#its logs mined in the meantime are replayed. The last head is kept for the inactivity
+#checks, so they need no request.
+#When the connection drops, the pump polls the blocks since the last head through the
+#request connection and reconnects with backoff; once subscribed again, the blocks mined in
+#the meantime are fetched the same way (dispatch() drops the overlap with the stream).
+#args: w3, contract, from_block, topics as EventPump
+#      url   (String) ws:// or wss:// endpoint, or IPC socket path
+#      retry (Float) seconds before the first reconnection, doubled up to slow
+#      slow  (Float) maximum seconds between reconnections
+class SocketPump(EventPump):
+    def __init__(self, w3, contract, url, from_block=None, topics=None, retry=0.25, slow=3):
+        super().__init__(w3, contract, from_block, slow=slow, topics=topics)
+        self.url = url
+        self.retry = retry
+        self.delay = retry
+        self.head = None
+        self.connected = False
+        self.added = {} #match id subscribed while connected -> block its logs are replayed from
+        self.changed = asyncio.Event() #Set when the log subscription has to be renewed
+
+    def provider(self):
+        if(self.url.startswith(("ws://", "wss://"))):
+            return WebSocketProvider(self.url, max_connection_retries=1)
+        return AsyncIPCProvider(self.url, max_connection_retries=1)
+
+    #--------------------------|Whether the node accepts the subscriptions (else the node is HTTP only)
+    #args: timeout (Float) seconds
+
+    #returns: Bool
+    async def probe(self, timeout=2):
+        async def subscribe():
+            async with AsyncWeb3(self.provider()) as ws:
+                await ws.eth.unsubscribe(await ws.eth.subscribe('newHeads'))
+        try:
+            await asyncio.wait_for(subscribe(), timeout)
+            return True
+        except Exception:
+            return False
+
+    async def block_number(self):
+        if(self.connected and self.head is not None):
+            return self.head
+        return await super().block_number()
+
+    #--------------------------|Starts routing the events of a match; a new match id renews the log subscription
+    def subscribe(self, id):
+        new = bytes(id) not in self.subscriptions
+        sub = super().subscribe(id)
+        if(new and self.connected):
+            self.added[sub.id] = self.head #None: from the last polled block
+            self.changed.set()
+        return sub
+
+    #--------------------------|Log subscription on the subscribed match ids, replacing the previous one
+    #The new subscription starts before the old one ends, dispatch() drops the logs pushed by both
+    #args: ws  (AsyncWeb3) subscription connection
+    #      old (String) previous subscription id, None if there is none
+
+    #returns: subscription id (String), None without subscribed matches
+    async def subscribe_logs(self, ws, old=None):
+        new = None
+        if(self.subscriptions):
+            ids = ['0x' + id.hex() for id in self.subscriptions]
+            new = await ws.eth.subscribe('logs', {'address': self.contract.address, 'topics': [None, ids]})
+        if(old is not None):
+            await ws.eth.unsubscribe(old)
+        return new
+
+    #--------------------------|Dispatches the pushed heads and logs
+    async def read(self, ws, heads):
+        async for msg in ws.socket.process_subscriptions():
+            if(msg['subscription'] == heads):
+                self.head = msg['result']['number']
+                if(self.last_block is not None):
+                    self.last_block = max(self.last_block, self.head - 1) #Backfill from the last head on reconnection
+            else:
+                await self.dispatch([msg['result']])
+
+    #--------------------------|Subscribes, backfills and dispatches the pushed logs until the connection drops
+    async def listen(self):
+        async with AsyncWeb3(self.provider()) as ws:
+            heads = await ws.eth.subscribe('newHeads')
+            self.changed.clear()
+            self.added = {}
+            self.connected = True #Matches subscribed from now on renew the log subscription
+            self.delay = self.retry
+            logs = await self.subscribe_logs(ws)
+            await self.poll() #Blocks mined while we were not subscribed
+            reader = asyncio.ensure_future(self.read(ws, heads))
+            try:
+                while True:
+                    renew = asyncio.ensure_future(self.changed.wait())
+                    await asyncio.wait([reader, renew], return_when=asyncio.FIRST_COMPLETED)
+                    if(reader.done()):
+                        renew.cancel()
+                        return reader.result()
+                    self.changed.clear()
+                    added, self.added = self.added, {}
+                    logs = await self.subscribe_logs(ws, logs)
+                    for id, block in added.items(): #Logs mined before the node filtered on the new ids
+                        for sub in list(self.subscriptions.get(id, [])):
+                            await self.replay(sub, self.last_block if block is None else block)
+            finally:
+                reader.cancel()
+
+    #--------------------------|Keeps the subscriptions alive, polling while they are down
+    async def run(self):
+        while True:
+            try:
+                await self.listen()
+            except Exception:
+                pass
+            self.connected = False
+            self.head = None #Stale until the next pushed head
+            METRICS.count("reconnect")
+            try:
+                await self.poll()
+            except Exception:
+                pass
+            await asyncio.sleep(self.delay)
+            self.delay = min(self.slow, self.delay * 2)
+
+
+#--------------------------|Event pump for a node: pushed if it accepts subscriptions on url, polled otherwise
+#args: w3, contract, from_block, topics as EventPump
+#      url (String) ws:// endpoint or IPC path of the node, None polls through w3
+
+#returns: EventPump or SocketPump
+async def open_pump(w3, contract, from_block=None, topics=None, url=None):
+    if(url is not None):
+        pump = SocketPump(w3, contract, url, from_block, topics)
+        if(await pump.probe()):
+            return pump
+    return EventPump(w3, contract, from_block, topics=topics)
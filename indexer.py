@@ -0,0 +1,269 @@
+#Author: Alessandro Mazzarella
+#Title: indexer
+#notice: Local SQLite index of the Battleships logs and offline audit of every recorded proof
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from board import SeedNonces, merkle_tree, layout_ok, unpack_fleet, verify_proof, verify_multiproof, NODE_URL, CONTRACT_PATH
+from events import event_topic
+
+
+#Contract calls kept for the audit: the commitments and every proof or board sent
+AUDITED = ('create_match', 'upload_board', 'check_move', 'check_salvo', 'reveal_board',
+           'create_and_bet', 'join_and_bet', 'answer_and_play', 'answer_salvo_and_play')
+#Events emitted by those calls, whose transactions are fetched to decode the call
+CALL_EVENTS = ('newMatch', 'match_ready', 'turn_response', 'salvo_response', 'match_ended')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta(key TEXT PRIMARY KEY, value);
+CREATE TABLE IF NOT EXISTS events(block INTEGER, log_index INTEGER, tx BLOB, match BLOB, event TEXT, args TEXT,
+                                  PRIMARY KEY(block, log_index)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS events_match ON events(match, block, log_index);
+CREATE TABLE IF NOT EXISTS calls(tx BLOB PRIMARY KEY, block INTEGER, tx_index INTEGER, match BLOB, sender TEXT, function TEXT, args TEXT, accepted INTEGER);
+CREATE INDEX IF NOT EXISTS calls_match ON calls(match, block, tx_index);
+"""
+
+
+#--------------------------|Decoded arguments -> JSON text (bytes as hex)
+def args_json(args):
+    def plain(v):
+        if(isinstance(v, (bytes, bytearray))):
+            return "0x" + bytes(v).hex()
+        if(isinstance(v, (list, tuple))):
+            return [plain(x) for x in v]
+        return v
+    return json.dumps({k: plain(v) for k, v in dict(args).items()})
+
+
+#--------------------------|Opens (and creates) the index database
+#args: path (String)
+
+#returns: sqlite3.Connection
+def open_db(path):
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    db.executescript(SCHEMA)
+    return db
+
+
+def get_meta(db, key, default=None):
+    row = db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return default if row is None else row[0]
+
+
+def set_meta(db, key, value):
+    db.execute("INSERT OR REPLACE INTO meta(key, value) VALUES(?, ?)", (key, value))
+
+
+#--------------------------|Fills the index from the logs of the contract
+#The blocks are fetched in chunks with one eth_getLogs each: the chunk halves when the node
+#refuses a range (too many results) and grows back after a success. The transactions of the
+#audited calls are fetched concurrently and decoded; every chunk is committed with the last
+#indexed block, so memory stays bounded by a chunk and an interrupted run goes on from there.
+#args: w3          (AsyncWeb3)
+#      contract    (AsyncWeb3.eth.contract)
+#      db          (sqlite3.Connection)
+#      to_block    (Int) last block to index, defaults to the head minus confirmations
+#      chunk       (Int) blocks per eth_getLogs
+#      confirmations (Int) blocks left to the head (reorgs)
+#      concurrency (Int) transactions fetched at the same time
+
+#returns: number of indexed events (Int)
+async def index(w3, contract, db, to_block=None, chunk=2000, confirmations=0, concurrency=16):
+    decoders = {event_topic(contract.abi, e['name']): contract.events[e['name']]() for e in contract.abi if e['type'] == 'event'}
+    if(to_block is None):
+        to_block = await w3.eth.block_number - confirmations
+    start = get_meta(db, 'last_block', -1) + 1
+    limit = asyncio.Semaphore(concurrency)
+    size = chunk
+    total = 0
+    while(start <= to_block):
+        end = min(to_block, start + size - 1)
+        try:
+            logs = await w3.eth.get_logs({'address': contract.address, 'fromBlock': start, 'toBlock': end})
+        except Exception:
+            if(size == 1):
+                raise
+            size = max(1, size // 2)
+            continue
+        events = []
+        txs = {} #hash -> (match id, rejected)
+        for log in logs:
+            decoder = decoders.get(bytes(log['topics'][0])) if log['topics'] else None
+            if(decoder is None):
+                continue
+            ev = decoder.process_log(log)
+            id = ev['args'].get('id')
+            events.append((log['blockNumber'], log['logIndex'], bytes(log['transactionHash']), None if id is None else bytes(id), ev['event'], args_json(ev['args'])))
+            if(ev['event'] in CALL_EVENTS and not (ev['event'] == 'match_ended' and ev['args']['outcome'] == -2)):
+                h = bytes(log['transactionHash'])
+                rejected = ev['event'] == 'match_ended' and ev['args']['outcome'] == -1
+                txs[h] = (bytes(id), (h in txs and txs[h][1]) or rejected)
+
+        async def fetch(tx_hash):
+            async with limit:
+                return await w3.eth.get_transaction(tx_hash)
+        calls = []
+        for tx in await asyncio.gather(*[fetch(h) for h in txs]):
+            fn, args = contract.decode_function_input(tx['input'])
+            if(fn.fn_name not in AUDITED):
+                continue
+            h = bytes(tx['hash'])
+            id, rejected = txs[h] #create_match has no id argument: the one of its newMatch event
+            calls.append((h, tx['blockNumber'], tx['transactionIndex'], id, tx['from'], fn.fn_name, args_json(args), 0 if rejected else 1))
+        db.executemany("INSERT OR IGNORE INTO events VALUES(?, ?, ?, ?, ?, ?)", events)
+        db.executemany("INSERT OR IGNORE INTO calls VALUES(?, ?, ?, ?, ?, ?, ?, ?)", calls)
+        set_meta(db, 'last_block', end)
+        db.commit()
+        total += len(events)
+        start = end + 1
+        size = min(chunk, size * 2)
+    return total
+
+
+#--------------------------|Indexes the chain, then keeps up with the new blocks
+#args: interval (Float) seconds between two catch-ups
+#      index() options
+async def follow(w3, contract, db, interval=2, **kw):
+    while True:
+        await index(w3, contract, db, **kw)
+        await asyncio.sleep(interval)
+
+
+#--------------------------|Re-verifies every audited call of one match (runs in a worker process)
+#The verdict of each call is computed as the contract computes it, from the committed
+#root of the sender, and compared with the verdict recorded on chain
+#args: id   (String) match id, hex
+#      rows ((sender, function, args JSON, accepted)[]) calls of the match in chain order
+
+#returns: (calls checked (Int), rejected on chain (Int), mismatches ((id, function, recorded, recomputed)[]))
+def audit_match(id, rows):
+    roots = {}
+    size = ships = None
+    checked = rejected = 0
+    mismatches = []
+    for sender, function, args, accepted in rows:
+        args = json.loads(args)
+        if(function in ('create_match', 'create_and_bet')):
+            roots[sender] = bytes.fromhex(args['board_1'][2:])
+            size, ships = args['_size'], unpack_fleet(args['fleet'])
+            continue
+        if(function in ('upload_board', 'join_and_bet')):
+            roots[sender] = bytes.fromhex(args['board'][2:])
+            continue
+        root = roots.get(sender)
+        if(root is None or size is None):
+            continue
+        cells = size * size
+        if(function in ('check_move', 'answer_and_play')):
+            proof = [bytes.fromhex(p[2:]) for p in args['proof']]
+            verdict = verify_proof(root, args['res'], args['index'], args['nonce'], proof)
+        elif(function in ('check_salvo', 'answer_salvo_and_play')):
+            proof = [bytes.fromhex(p[2:]) for p in args['proof']]
+            verdict = verify_multiproof(root, cells, args['indexes'], args['res'], args['nonces'], proof)
+        else: #reveal_board
+            bitmap = args['bitmap']
+            board = [(bitmap[i >> 8] >> (i & 255)) & 1 for i in range(cells)] if len(bitmap) == (cells + 255) >> 8 else None
+            verdict = (board is not None and layout_ok(size, bitmap, args['ships'], ships) and
+                       merkle_tree(board, SeedNonces(bytes.fromhex(args['seed'][2:]), cells)) == root)
+        checked += 1
+        rejected += 1 - accepted
+        if(bool(verdict) != bool(accepted)):
+            mismatches.append((id, function, accepted, int(verdict)))
+    return checked, rejected, mismatches
+
+
+#--------------------------|Audits one batch of matches (worker process entry point)
+def audit_batch(batch):
+    checked = rejected = 0
+    mismatches = []
+    for id, rows in batch:
+        c, r, m = audit_match(id, rows)
+        checked += c
+        rejected += r
+        mismatches.extend(m)
+    return checked, rejected, mismatches
+
+
+#--------------------------|Re-verifies every recorded proof and board with a process pool
+#The calls are streamed from the index ordered by match (calls_match index), grouped into
+#batches of matches and handed to the workers, with at most two batches per worker in
+#flight: memory stays bounded by the batches whatever the size of the index.
+#args: db      (sqlite3.Connection)
+#      workers (Int) processes, defaults to the CPU count
+#      batch   (Int) matches per task
+
+#returns: {'matches', 'calls', 'rejected', 'mismatches', 'seconds'}
+def audit(db, workers=None, batch=256):
+    t = time.perf_counter()
+    workers = workers or os.cpu_count()
+    cursor = db.execute("SELECT match, sender, function, args, accepted FROM calls ORDER BY match, block, tx_index")
+    matches = ((id.hex(), [row[1:] for row in rows]) for id, rows in itertools.groupby(cursor, key=lambda row: row[0]))
+    batches = iter(lambda: list(itertools.islice(matches, batch)), [])
+    result = {'matches': 0, 'calls': 0, 'rejected': 0, 'mismatches': []}
+    with ProcessPoolExecutor(workers) as pool:
+        pending = {}
+        for jobs in batches:
+            pending[pool.submit(audit_batch, jobs)] = len(jobs)
+            while(len(pending) >= 2 * workers):
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    collect(result, f.result(), pending.pop(f))
+        for f in list(pending):
+            collect(result, f.result(), pending.pop(f))
+    result['seconds'] = time.perf_counter() - t
+    return result
+
+
+def collect(result, batch_result, matches):
+    checked, rejected, mismatches = batch_result
+    result['matches'] += matches
+    result['calls'] += checked
+    result['rejected'] += rejected
+    result['mismatches'].extend(mismatches)
+
+
+#--------------------------|Contract of the node from the deployment cache
+async def open_contract(url, path):
+    from web3 import AsyncWeb3, AsyncHTTPProvider
+    from deployment import find_deployment, load_artifact
+    w3 = AsyncWeb3(AsyncHTTPProvider(url))
+    cache = load_artifact(path)
+    address = await find_deployment(w3, path, cache, w3.eth.contract(abi=cache['abi']))
+    return w3, w3.eth.contract(abi=cache['abi'], address=address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Battleships match indexer and audit")
+    parser.add_argument("command", choices=["index", "audit"])
+    parser.add_argument("--db", default="matches.db", help="SQLite index")
+    parser.add_argument("--url", default=NODE_URL, help="node HTTP endpoint")
+    parser.add_argument("--contract", default=CONTRACT_PATH, help="compiled contract json")
+    parser.add_argument("--follow", action="store_true", help="keep indexing the new blocks")
+    parser.add_argument("--chunk", type=int, default=2000, help="blocks per eth_getLogs")
+    parser.add_argument("--workers", type=int, help="audit processes (default: CPU count)")
+    args = parser.parse_args()
+    db = open_db(args.db)
+    if(args.command == "index"):
+        async def run():
+            w3, contract = await open_contract(args.url, args.contract)
+            if(args.follow):
+                await follow(w3, contract, db, chunk=args.chunk)
+            print("%d events indexed up to block %d" % (await index(w3, contract, db, chunk=args.chunk), get_meta(db, 'last_block', -1)))
+        asyncio.run(run())
+    else:
+        result = audit(db, args.workers)
+        for id, function, recorded, recomputed in result['mismatches']:
+            print("MISMATCH match %s %s: accepted on chain %d, recomputed %d" % (id, function, recorded, recomputed))
+        print("%d matches, %d calls re-verified (%d rejected on chain), %d mismatches in %.1fs" % (result['matches'], result['calls'], result['rejected'], len(result['mismatches']), result['seconds']))
+
+
+if __name__ == "__main__":
+    main()
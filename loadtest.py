@@ -0,0 +1,215 @@
+#Author: Alessandro Mazzarella
+#Title: loadtest
+#notice: End-to-end load generator: bot players in a process pool against a local chain
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from board import HuntTargetPlayer, NODE_URL, CONTRACT_PATH
+from transactions import TxRejected
+
+
+LEVELS = [1, 10, 50, 100, 500] #Concurrent matches of the default run
+JOIN_ATTEMPTS = 20 #join_and_bet picks the match when mined; with join_match joiners race for the last open one and try again
+OPPONENT_TIMEOUT = 300 #Seconds a bot waits for its opponent to join and bet, then the match counts as an error
+
+
+#--------------------------|Percentile of sorted samples
+def percentile(s, q):
+    return s[min(len(s)-1, int(len(s)*q))] if s else 0
+
+
+#--------------------------|Joiner bot: joins a random match of the size, again if another joiner got it first
+#args: manager (MatchManager)
+#      addr    (Bytes) joining account
+#      size    (Int) board size
+#      combined (Bool) join_and_bet instead of join_match, upload_board and bet
+
+#returns: (session, attempts), session None if every attempt failed
+async def join_bot(manager, addr, size, combined=True):
+    for attempt in range(1, JOIN_ATTEMPTS + 1):
+        session = manager.session(addr, player=HuntTargetPlayer(size), verbose=False, combined=combined)
+        try:
+            if(await session.run(size=size, join=True, timeout=OPPONENT_TIMEOUT) != 0):
+                return session, attempt
+        except TxRejected: #Full by the time of the upload, caught by the preflight
+            pass
+        await asyncio.sleep(random.uniform(0, 0.2 * attempt))
+    return None, JOIN_ATTEMPTS
+
+
+#--------------------------|Plays matches between bots of one process over one connection
+#Creators and joiners use disjoint accounts, so a joiner never draws a match of its own
+#account; the matches of this process may be joined by the bots of the others.
+#args: url      (String) node endpoint, ws:// for eth_subscribe pushes
+#      abi      (Dictionary[])
+#      address  (String) deployed Battleships
+#      accounts (String[]) accounts of this process, at least two
+#      matches  (Int) matches created by this process
+#      size     (Int) board size
+#      combined (Bool) combined entry points (create_and_bet, join_and_bet, answer_and_play)
+
+#returns: {'matches', 'errors', 'join_attempts', 'seconds', 'shot', 'answer', 'rpc'}
+async def bot_matches(url, abi, address, accounts, matches, size, combined=True):
+    import warnings
+    from web3 import AsyncWeb3, AsyncHTTPProvider, WebSocketProvider
+    from events import open_pump
+    from metrics import METRICS, instrument
+    from session import MatchManager
+    warnings.filterwarnings("ignore", "The log with transaction hash")
+    socket = url.startswith("ws")
+    w3 = AsyncWeb3(WebSocketProvider(url) if socket else AsyncHTTPProvider(url))
+    if(socket):
+        await w3.provider.connect()
+    METRICS.enable() #In memory only: the RPC middleware counts the requests by method
+    instrument(w3)
+    contract = w3.eth.contract(abi=abi, address=address)
+    pump = await open_pump(w3, contract, await w3.eth.block_number, None, url if socket else None)
+    manager = MatchManager(w3, contract, accounts, pump)
+    creators, joiners = accounts[0::2], accounts[1::2]
+    sessions = [manager.session(creators[i % len(creators)], player=HuntTargetPlayer(size), verbose=False, combined=combined) for i in range(matches)]
+    t = time.perf_counter()
+    await asyncio.gather(*[s.create(size, auto=True, amount=1 if combined else None) for s in sessions])
+    results = await manager.run(*[s.run(timeout=OPPONENT_TIMEOUT) for s in sessions], *[join_bot(manager, joiners[i % len(joiners)], size, combined) for i in range(matches)])
+    seconds = time.perf_counter() - t
+    if(socket):
+        await w3.provider.disconnect()
+    bots = [r for r in results[matches:] if isinstance(r, tuple)]
+    played = sessions + [s for s, _ in bots if s is not None]
+    return {
+        'matches': sum(1 for r in results[:matches] if r in (1, -1)),
+        'errors': sum(1 for r in results if isinstance(r, Exception) or r == (None, JOIN_ATTEMPTS)), #Timeouts waiting for the opponent included
+        'join_attempts': sum(n for _, n in bots),
+        'seconds': seconds,
+        'shot': [x for s in played for x in s.latency['shot']],
+        'answer': [x for s in played for x in s.latency['answer']],
+        'rpc': {dict(labels)['method']: n for (name, labels), n in METRICS.counters.items() if name == 'rpc'},
+    }
+
+
+#--------------------------|Worker process entry point
+def bot_worker(*args):
+    return asyncio.run(bot_matches(*args))
+
+
+#--------------------------|Gas and transactions of the blocks mined during a load level
+#returns: (gas (Int), transactions (Int))
+async def block_totals(w3, first, last, batch=100):
+    gas = txs = 0
+    for start in range(first, last + 1, batch):
+        for block in await asyncio.gather(*[w3.eth.get_block(n) for n in range(start, min(last, start + batch - 1) + 1)]):
+            gas += block['gasUsed']
+            txs += len(block['transactions'])
+    return gas, txs
+
+
+#--------------------------|Runs one load level: the matches are split over the worker processes
+#Every process gets its own accounts, so no nonce is shared between two pipelines
+#args: pool     (ProcessPoolExecutor)
+#      w3       (AsyncWeb3) connection of the coordinator
+#      matches  (Int) concurrent matches
+#      workers  (Int) processes
+#      combined (Bool) combined entry points
+
+#returns: level results (Dictionary)
+async def run_level(pool, w3, url, abi, address, accounts, matches, size, workers, combined=True):
+    workers = max(1, min(workers, matches, len(accounts) // 2))
+    shares = [matches // workers + (i < matches % workers) for i in range(workers)]
+    first = await w3.eth.block_number + 1
+    loop = asyncio.get_running_loop()
+    t = time.perf_counter()
+    parts = await asyncio.gather(*[loop.run_in_executor(pool, bot_worker, url, abi, address, accounts[i::workers], n, size, combined)
+                                   for i, n in enumerate(shares)])
+    seconds = time.perf_counter() - t
+    gas, txs = await block_totals(w3, first, await w3.eth.block_number)
+    shot = sorted(x for p in parts for x in p['shot'])
+    answer = sorted(x for p in parts for x in p['answer'])
+    rpc = {}
+    for p in parts:
+        for method, n in p['rpc'].items():
+            rpc[method] = rpc.get(method, 0) + n
+    done = sum(p['matches'] for p in parts)
+    return {
+        'matches': matches, 'workers': workers, 'completed': done, 'errors': sum(p['errors'] for p in parts),
+        'seconds': seconds, 'matches_per_min': done / seconds * 60,
+        'join_attempts': sum(p['join_attempts'] for p in parts) / max(1, matches),
+        'shot_ms_p50': percentile(shot, 0.5)*1e3, 'shot_ms_p95': percentile(shot, 0.95)*1e3, 'shot_ms_p99': percentile(shot, 0.99)*1e3,
+        'answer_ms_p50': percentile(answer, 0.5)*1e3, 'answer_ms_p95': percentile(answer, 0.95)*1e3,
+        'turns': len(shot), 'rpc_per_turn': sum(rpc.values()) / max(1, len(shot)), 'rpc': rpc,
+        'gas_per_match': gas / max(1, done), 'txs_per_match': txs / max(1, done),
+    }
+
+
+#--------------------------|Load test from 1 to N concurrent matches
+#Without a url an in-process stand-in node (TestNode) is started and the contract deployed
+#on it; with a url the contract of the node is found through the deployment cache and the
+#node accounts are shared out between the processes.
+#args: levels   (Int[]) concurrent matches of each level
+#      size     (Int) board size
+#      workers  (Int) processes, defaults to the CPU count
+#      url      (String) local dev chain, ws:// or http://
+#      contract (String) compiled contract json
+#      accounts (Int) accounts of the in-process node
+#      combined (Bool) combined entry points
+
+#returns: results of each level (Dictionary[])
+async def load(levels=LEVELS, size=4, workers=None, url=None, contract=CONTRACT_PATH, accounts=40, combined=True):
+    from web3 import AsyncWeb3, AsyncHTTPProvider, WebSocketProvider
+    from benchmark import load_contract
+    node = None
+    if(url is None):
+        from testnode import TestNode
+        node = TestNode(accounts=accounts)
+        url = await node.start()
+        abi, bytecode = load_contract(contract)
+        factory = node.w3.eth.contract(abi=abi, bytecode=bytecode)
+        address = node.w3.eth.wait_for_transaction_receipt(factory.constructor().transact({'from': node.w3.eth.accounts[0]})).contractAddress
+    socket = url.startswith("ws")
+    w3 = AsyncWeb3(WebSocketProvider(url) if socket else AsyncHTTPProvider(url))
+    if(socket):
+        await w3.provider.connect()
+    if(node is None):
+        from deployment import find_deployment, load_artifact
+        cache = load_artifact(contract)
+        abi = cache['abi']
+        address = await find_deployment(w3, contract, cache, w3.eth.contract(abi=abi))
+    names = await w3.eth.accounts
+    results = []
+    print("%8s %8s %9s %10s %9s %9s %9s %10s %9s %12s %9s %7s" % ("matches", "workers", "seconds", "match/min", "shot p50", "shot p95", "shot p99", "answer p95", "rpc/turn", "gas/match", "tx/match", "joins"))
+    with ProcessPoolExecutor(workers or os.cpu_count()) as pool:
+        for matches in levels:
+            row = await run_level(pool, w3, url, abi, address, names, matches, size, workers or os.cpu_count(), combined)
+            results.append(row)
+            print("%8d %8d %9.1f %10.1f %9.0f %9.0f %9.0f %10.0f %9.1f %12.0f %9.1f %7.2f" % (row['completed'], row['workers'], row['seconds'], row['matches_per_min'],
+                  row['shot_ms_p50'], row['shot_ms_p95'], row['shot_ms_p99'], row['answer_ms_p95'], row['rpc_per_turn'], row['gas_per_match'], row['txs_per_match'], row['join_attempts'])
+                  + ("  %d errors" % row['errors'] if row['errors'] else ""))
+    if(socket):
+        await w3.provider.disconnect()
+    if(node is not None):
+        await node.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Battleships load generator: bot matches against a local chain")
+    parser.add_argument("--levels", default=",".join(map(str, LEVELS)), help="concurrent matches of each level, comma separated")
+    parser.add_argument("--size", type=int, default=4, help="board size")
+    parser.add_argument("--workers", type=int, help="bot processes (default: CPU count)")
+    parser.add_argument("--url", help="local dev chain (default: in-process stand-in node); e.g. " + NODE_URL)
+    parser.add_argument("--contract", default=CONTRACT_PATH, help="compiled contract json")
+    parser.add_argument("--accounts", type=int, default=40, help="accounts of the in-process node")
+    parser.add_argument("--json", metavar="OUT", help="write the results of every level to OUT")
+    parser.add_argument("--single-calls", dest="combined", action="store_false", help="one contract call per step instead of create_and_bet, join_and_bet, answer_and_play")
+    args = parser.parse_args()
+    results = asyncio.run(load([int(n) for n in args.levels.split(",")], args.size, args.workers, args.url, args.contract, args.accounts, args.combined))
+    if(args.json):
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+#Author: Alessandro Mazzarella
+#Title: metrics
+#notice: Timers, counters and event latencies of the front-end, exported as Prometheus text or JSON lines
+
+import atexit
+import json
+import os
+import time
+from web3.middleware import Web3Middleware
+
+
+#Histogram buckets (seconds) of the Prometheus export
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+#--------------------------|Observations of one metric/labels pair
+class Series:
+    __slots__ = ("count", "sum", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.buckets = [0] * len(BUCKETS)
+
+    def add(self, value):
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, le in enumerate(BUCKETS):
+            if(value <= le):
+                self.buckets[i] += 1
+                break
+
+
+#--------------------------|Timer returned while metrics are disabled: does nothing
+class NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_TIMER = NullTimer()
+
+
+#--------------------------|Times a block into a metric
+class Timer:
+    __slots__ = ("metrics", "name", "labels", "t")
+
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.t = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, time.perf_counter() - self.t, **self.labels)
+        return False
+
+
+#--------------------------|Metrics registry
+#Disabled by default: timer() returns a shared no-op and observe()/count() return at the
+#first check, so the hot paths only pay an attribute lookup. Once enabled, every observation
+#goes to the in-memory series (written as a Prometheus text file by flush()) and, if set,
+#to a JSON lines log.
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.series = {}
+        self.counters = {}
+        self.jsonl = None
+        self.prometheus = None
+
+    #--------------------------|Starts recording
+    #args: jsonl      (String) JSON lines log path, one line per observation
+    #      prometheus (String) Prometheus text file path, rewritten by flush() and at exit
+    def enable(self, jsonl=None, prometheus=None):
+        if(jsonl is not None):
+            self.jsonl = open(jsonl, 'a', buffering=1)
+        self.prometheus = prometheus
+        if(not self.enabled):
+            atexit.register(self.flush)
+        self.enabled = True
+
+    #--------------------------|Enables the metrics from BATTLESHIPS_METRICS_JSONL / BATTLESHIPS_METRICS_PROM
+    #returns: enabled (Bool)
+    def from_env(self):
+        jsonl = os.environ.get("BATTLESHIPS_METRICS_JSONL")
+        prometheus = os.environ.get("BATTLESHIPS_METRICS_PROM")
+        if(jsonl or prometheus):
+            self.enable(jsonl, prometheus)
+        return self.enabled
+
+    def timer(self, name, **labels):
+        if(not self.enabled):
+            return NULL_TIMER
+        return Timer(self, name, labels)
+
+    #--------------------------|Records a duration
+    #args: name    (String) metric name
+    #      seconds (Float)
+    #      labels  label=value pairs
+    def observe(self, name, seconds, **labels):
+        if(not self.enabled):
+            return
+        key = (name, tuple(sorted(labels.items())))
+        series = self.series.get(key)
+        if(series is None):
+            series = self.series[key] = Series()
+        series.add(seconds)
+        if(self.jsonl is not None):
+            self.jsonl.write(json.dumps({'t': time.time(), 'metric': name, 'value': seconds, **labels}) + "\n")
+
+    def count(self, name, n=1, **labels):
+        if(not self.enabled):
+            return
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + n
+        if(self.jsonl is not None):
+            self.jsonl.write(json.dumps({'t': time.time(), 'metric': name, 'count': n, **labels}) + "\n")
+
+    #--------------------------|Prometheus text exposition of all the metrics
+    #returns: text (String)
+    def prometheus_text(self):
+        lines = []
+        typed = set()
+        for (name, labels), value in sorted(self.counters.items()):
+            metric = "battleships_" + name + "_total"
+            if(metric not in typed):
+                lines.append("# TYPE " + metric + " counter")
+                typed.add(metric)
+            lines.append(metric + label_text(labels) + " " + str(value))
+        for (name, labels), s in sorted(self.series.items()):
+            metric = "battleships_" + name + "_seconds"
+            if(metric not in typed):
+                lines.append("# TYPE " + metric + " histogram")
+                typed.add(metric)
+            total = 0
+            for le, n in zip(BUCKETS, s.buckets):
+                total += n
+                lines.append(metric + "_bucket" + label_text(labels + (("le", str(le)),)) + " " + str(total))
+            lines.append(metric + "_bucket" + label_text(labels + (("le", "+Inf"),)) + " " + str(s.count))
+            lines.append(metric + "_sum" + label_text(labels) + " " + repr(s.sum))
+            lines.append(metric + "_count" + label_text(labels) + " " + str(s.count))
+        return "\n".join(lines) + "\n"
+
+    #--------------------------|Rewrites the Prometheus file (atomically, for the node exporter textfile collector)
+    def flush(self):
+        if(self.jsonl is not None):
+            self.jsonl.flush()
+        if(self.prometheus is None):
+            return
+        tmp = self.prometheus + ".tmp"
+        with open(tmp, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp, self.prometheus)
+
+
+#--------------------------|{a="1",b="2"} label set
+def label_text(labels):
+    if(not labels):
+        return ""
+    return "{" + ",".join(k + '="' + str(v).replace('"', '\\"') + '"' for k, v in labels) + "}"
+
+
+METRICS = Metrics()
+
+
+#--------------------------|Counts and times every JSON-RPC request by method
+#Only added to the provider when the metrics are enabled (see instrument()). The WebSocket
+#and IPC providers send and receive apart and only call the request processor: their
+#requests are counted, not timed.
+class RPCMetrics(Web3Middleware):
+
+    async def async_wrap_make_request(self, make_request):
+        async def middleware(method, params):
+            METRICS.count("rpc", method=method)
+            t = time.perf_counter()
+            try:
+                return await make_request(method, params)
+            finally:
+                METRICS.observe("rpc", time.perf_counter() - t, method=method)
+        return middleware
+
+    async def async_request_processor(self, method, params):
+        METRICS.count("rpc", method=method)
+        return method, params
+
+
+#--------------------------|Adds the RPC middleware to a connection if metrics are enabled
+def instrument(w3):
+    if(METRICS.enabled):
+        w3.middleware_onion.add(RPCMetrics, "metrics")
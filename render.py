@@ -0,0 +1,179 @@
+#Author: Alessandro Mazzarella
+#Title: render
+#notice: Terminal board renderer redrawing only the cells that changed
+
+import atexit
+import os
+import shutil
+import sys
+import numpy as np
+from board import MARKERS, row_label
+
+
+#Characters of the cell codes, indexed by code (EMPTY, SHIP, HIT, MISS)
+GLYPHS = np.array([MARKERS[k] for k in sorted(MARKERS)])
+GAP = 4 #Columns between boards drawn side by side
+PROMPT_LINES = 4 #Terminal lines left below the boards for messages and input
+
+
+#--------------------------|Geometry of a board drawn on the screen
+#Same layout as format_board: a title line, the column labels, then one line per row
+#args: title (String)
+#      n     (Int) board size
+class Panel:
+    __slots__ = ("title", "n", "label", "width", "row", "col", "frame")
+
+    def __init__(self, title, n):
+        self.title = title
+        self.n = n
+        self.label = len(row_label(n-1))
+        self.width = max(len(str(n-1)), 1)
+        self.row = 1 #Screen position (1-based) of the title line, set by the layout
+        self.col = 1
+        self.frame = None #Cell codes on the screen
+
+    def columns(self):
+        return max(len(self.title), self.label + self.n*(self.width + 1))
+
+    def lines(self, grid):
+        lines = [self.title, " "*self.label + "".join(" " + str(j).rjust(self.width) for j in range(self.n))]
+        for i in range(self.n):
+            lines.append(row_label(i).ljust(self.label) + "".join(" " + g.rjust(self.width) for g in GLYPHS[grid[i]].tolist()))
+        return lines
+
+    #--------------------------|ANSI sequence moving the cursor to a cell and writing its marker
+    def cell(self, k, code):
+        r, c = divmod(k, self.n)
+        return "\x1b[%d;%dH%s" % (self.row + 2 + r, self.col + self.label + 1 + c*(self.width + 1), GLYPHS[code].rjust(self.width))
+
+
+#--------------------------|Frame-buffered ANSI renderer
+#The boards are drawn once at the top of the screen, and the lines below them become a
+#scroll region for messages and prompts. Every later show() compares the cells with the
+#frame buffer and only moves the cursor to the changed ones (a new H/M marker, an opponent
+#hit), so a turn costs a few bytes of output instead of whole boards. Boards that do not
+#fit the terminal are printed in full instead, as PlainScreen does.
+#args: out (TextIO) defaults to sys.stdout
+class Screen:
+    batch = False
+
+    def __init__(self, out=None):
+        self.out = sys.stdout if out is None else out
+        self.panels = []
+        self.size = None
+        self.region = False
+        self.plain = PlainScreen(self.out)
+
+    #--------------------------|Draws boards, or the cells changed since the last call
+    #args: panels ((String, uint8 ndarray)) title and cell codes of each board
+    def show(self, *panels):
+        size = tuple(shutil.get_terminal_size())
+        layout = [(title, len(grid)) for title, grid in panels]
+        if(size != self.size or layout != [(p.title, p.n) for p in self.panels]):
+            self.size = size
+            self.panels = [Panel(title, n) for title, n in layout]
+            if(not self.arrange(*size)):
+                self.close()
+                self.panels = []
+                self.plain.show(*panels)
+                return
+            self.draw([grid for _, grid in panels])
+            return
+        out = []
+        for panel, (_, grid) in zip(self.panels, panels):
+            cells = grid.reshape(-1)
+            changed = np.flatnonzero(cells != panel.frame)
+            out.extend(panel.cell(k, cells[k]) for k in changed.tolist())
+            panel.frame[changed] = cells[changed]
+        if(out):
+            self.out.write("\x1b7" + "".join(out) + "\x1b8") #Save and restore the prompt cursor
+            self.out.flush()
+
+    #--------------------------|Places the boards side by side, or stacked if they are too wide
+    #returns: Bool, False if they do not fit the terminal
+    def arrange(self, columns, rows):
+        width = sum(p.columns() for p in self.panels) + GAP*(len(self.panels) - 1)
+        if(width <= columns):
+            col = 1
+            for p in self.panels:
+                p.row, p.col = 1, col
+                col += p.columns() + GAP
+            height = max(p.n + 2 for p in self.panels)
+        else:
+            row = 1
+            for p in self.panels:
+                p.row, p.col = row, 1
+                row += p.n + 3
+            height = row - 2
+            width = max(p.columns() for p in self.panels)
+        self.top = height + 2
+        return width <= columns and self.top + PROMPT_LINES <= rows
+
+    #--------------------------|Full redraw: clears the screen, draws the boards and sets the scroll region
+    def draw(self, grids):
+        out = ["\x1b[2J"]
+        for panel, grid in zip(self.panels, grids):
+            panel.frame = grid.reshape(-1).copy()
+            for i, line in enumerate(panel.lines(grid)):
+                out.append("\x1b[%d;%dH%s" % (panel.row + i, panel.col, line))
+        out.append("\x1b[%d;%dr\x1b[%d;1H" % (self.top, self.size[1], self.size[1]))
+        self.out.write("".join(out))
+        self.out.flush()
+        if(not self.region):
+            atexit.register(self.close)
+        self.region = True
+
+    #--------------------------|Gives the whole terminal back (scroll region reset)
+    def close(self):
+        if(self.region):
+            self.region = False
+            self.out.write("\x1b[r\x1b[%d;1H\n" % self.size[1])
+            self.out.flush()
+
+
+#--------------------------|Renderer for pipes and dumb terminals: prints the boards in full when a cell changed
+#args: out (TextIO) defaults to sys.stdout
+class PlainScreen:
+    batch = False
+
+    def __init__(self, out=None):
+        self.out = sys.stdout if out is None else out
+        self.frames = None
+
+    def show(self, *panels):
+        frames = [(title, grid.tobytes()) for title, grid in panels]
+        if(frames == self.frames):
+            return
+        self.frames = frames
+        text = []
+        for title, grid in panels:
+            text.extend(["", *Panel(title, len(grid)).lines(grid)])
+        self.out.write("\n".join(text) + "\n\n")
+        self.out.flush()
+
+    def close(self):
+        pass
+
+
+#--------------------------|Batch mode of headless bots: prints nothing
+class BatchScreen:
+    batch = True
+
+    def show(self, *panels):
+        pass
+
+    def close(self):
+        pass
+
+
+#--------------------------|Renderer for a mode
+#args: mode (String) 'ansi', 'plain', 'batch' or 'auto' (ANSI on a terminal, plain otherwise)
+#      out  (TextIO) defaults to sys.stdout
+def make_screen(mode="auto", out=None):
+    out = sys.stdout if out is None else out
+    if(mode == "batch"):
+        return BatchScreen()
+    if(mode == "auto"):
+        tty = hasattr(out, "isatty") and out.isatty() and os.environ.get("TERM") != "dumb"
+        mode = "ansi" if tty else "plain"
+    return Screen(out) if mode == "ansi" else PlainScreen(out)
@@ -0,0 +1,766 @@
+#Author: Alessandro Mazzarella
+#Title: session
+#notice: Match sessions and the manager running many of them over one connection
+
+import asyncio
+import time
+import warnings
+import numpy as np
+from web3 import AsyncWeb3, AsyncHTTPProvider
+from board import Board, EMPTY, HIT, MISS, HumanPlayer, HuntTargetPlayer, create_board, new_match, pack_fleet, unpack_fleet, convert_to_wei, row_label, verify_proof, verify_multiproof
+from checkpoint import PLACED, READY, BET, PLAYING, create_checkpoint, find_checkpoint, load_checkpoint
+from deployment import find_deployment, load_artifact
+from events import open_pump
+from metrics import METRICS, instrument
+from render import make_screen
+from transactions import TxPipeline, TxRejected, InvalidProof, MatchNotFound, NotYourTurn
+
+
+SHOT_RETRIES = 3 #Shots chosen again after the preflight rejects them, before the session gives up
+
+
+#--------------------------|Hands out the node accounts to the sessions, least busy first
+#Nonces are not tracked here: every account goes through the shared TxPipeline
+#args: accounts (Bytes[]) addresses unlocked on the node
+class AccountPool:
+    def __init__(self, accounts):
+        self.active = {addr: 0 for addr in accounts}
+
+    #--------------------------|Account for a new session
+    #args: addr (Bytes) a specific account, defaults to the least busy one
+
+    #returns: addr (Bytes)
+    def acquire(self, addr=None):
+        if(addr is None):
+            addr = min(self.active, key=self.active.get)
+        self.active[addr] = self.active.get(addr, 0) + 1
+        return addr
+
+    def release(self, addr):
+        self.active[addr] -= 1
+
+
+#--------------------------|Percentiles of a list of samples
+#returns: (count, mean, p50, p95, max) in seconds, zeros for no samples
+def summary(samples):
+    if(not samples):
+        return (0, 0, 0, 0, 0)
+    s = sorted(samples)
+    return (len(s), sum(s)/len(s), s[len(s)//2], s[min(len(s)-1, int(len(s)*0.95))], s[-1])
+
+
+#--------------------------|One match played by one account: create/join, bet and play
+#Waits, bets and plays through the manager's connection, log pump and
+#transaction pipeline. Latencies are sampled per match:
+#  think  - your_turn received -> our shots sent
+#  shot   - our shots sent -> Hit/Miss response received
+#  answer - opponent's shots received -> our proof sent
+#When the manager keeps checkpoints, the committed board and the match state after every
+#processed event are saved on disk, and resume() picks the match up after a restart
+#args: manager (MatchManager)
+#      addr    (Bytes) account playing the match
+#      player  (Player) shot strategy, defaults to HumanPlayer()
+#      salvo   (Int) shots per turn, 1 for classic turns
+#      verbose (Bool) print boards and moves
+#      screen  (Screen) board renderer, defaults to make_screen(): ANSI on a terminal, batch if not verbose
+#      combined (Bool) combined entry points: create_and_bet, join_and_bet and answers fired
+#                      back with the next shot (answer_and_play); False sends one call per step
+class MatchSession:
+    def __init__(self, manager, addr, player=None, salvo=1, verbose=True, screen=None, combined=True):
+        self.manager = manager
+        self.txs = manager.txs
+        self.contract = manager.contract
+        self.addr = addr
+        self.player = HumanPlayer() if player is None else player
+        self.salvo = salvo
+        self.verbose = verbose
+        self.combined = combined
+        self.screen = make_screen("auto" if verbose else "batch") if screen is None else screen
+        self.id = None
+        self.events = None
+        self.board = None
+        self.board_2 = None
+        self.incoming = None #Opponent's shots on our board (HIT/MISS), display only
+        self.tree = None
+        self.turn = 0
+        self.role = 0 #1 creator (player_1), -1 joiner (player_2)
+        self.phase = None
+        self.outcome = None
+        self.checkpoint = None
+        self.position = (0, -1) #(block, log index) of the last processed event
+        self.live_check = 0
+        self.accuse_block = 0
+        self.shots = []
+        self.latency = {'think': [], 'shot': [], 'answer': []}
+
+    def say(self, *args):
+        if(self.verbose):
+            print(*args)
+
+    #--------------------------|Draws both boards, the renderer only writes the cells changed since the last call
+    def show(self):
+        if(self.screen.batch or self.board is None):
+            return
+        own = self.board.grid if self.incoming is None else np.where(self.incoming.grid != EMPTY, self.incoming.grid, self.board.grid)
+        self.screen.show(("YOUR BOARD", own), ("OPPONENT'S BOARD", self.board_2.grid))
+
+    #--------------------------|Sends a contract call and polls fast for its events
+    #args: key gas cache key, defaults to the board size
+    #returns: PendingTx
+    #raises: TxRejected if the contract would revert the call
+    async def send(self, fn, value=0, key=None):
+        tx = {'from': self.addr}
+        if(value):
+            tx['value'] = value
+        if(key is None and self.board_2 is not None):
+            key = len(self.board_2)
+        pending = await self.txs.transact(fn, tx, key)
+        self.manager.pump.poke()
+        return pending
+
+    #--------------------------|Chooses shots and sends the call firing them, choosing again when the preflight rejects them
+    #The shots are checkpointed as pending before the call is sent, so a crash after the send never
+    #fires them again on resume. Nothing is mined on a rejection, so no event would ever follow: after
+    #SHOT_RETRIES rejections the error is raised and the match ends. NotYourTurn is raised at once, choosing again cannot help.
+    #args: build (Callable) shots -> (contract call, gas key)
+
+    #returns: shots ((row, col)[]) the shots sent
+    #raises: TxRejected
+    async def fire(self, build):
+        previous = self.shots
+        for attempt in range(SHOT_RETRIES):
+            shots = self.player.choose_shots(self.board_2, self.salvo)
+            fn, key = build(shots)
+            self.shots = shots
+            self.save()
+            try:
+                await self.send(fn, key=key)
+                return shots
+            except TxRejected as e:
+                self.shots = previous
+                self.save()
+                if(isinstance(e, NotYourTurn) or attempt == SHOT_RETRIES - 1):
+                    raise
+                self.say("Shot rejected: " + e.reason)
+
+    #--------------------------|Writes the checkpoint of the board, events are replayed from the current block
+    #Written before the board is committed: without a match id yet (creation or join not mined) the
+    #checkpoint is keyed by the board root, and the id is filled in by commit()
+    #args: phase (Int) PLACED, READY or BET
+    #      block (Int) block to replay the events from, defaults to the current one
+    async def start_checkpoint(self, phase, block=None):
+        self.phase = phase
+        if(self.manager.checkpoints is None):
+            return
+        if(block is None):
+            block = await self.txs.w3.eth.block_number
+        self.position = (block, -1)
+        self.checkpoint = create_checkpoint(self.manager.checkpoints, self.id, self.addr, self.role, self.salvo, self.board, self.tree, phase, block)
+
+    #--------------------------|Match id of a mined creation or join: events subscribed and the checkpoint filled in
+    #args: id (Bytes) match id
+    def commit(self, id):
+        self.id = id
+        self.events = self.manager.pump.subscribe(id)
+        if(self.checkpoint is not None):
+            self.checkpoint.set_id(id)
+
+    #--------------------------|Saves the match state after an event has been handled
+    #args: ev (AttributeDict) the handled event, None if the state changed without one
+    def save(self, ev=None):
+        if(ev is not None):
+            self.position = (ev['blockNumber'], ev['logIndex'])
+        if(self.checkpoint is not None):
+            self.checkpoint.save(self.phase, self.position[0], self.position[1], self.turn, self.salvo, self.live_check, self.accuse_block, self.board_2, self.shots)
+
+    #--------------------------|Whether the chain already has our answer to the last shot: the turn flipped, or our last ship sunk
+    #The answer to a shot replayed after a resume is rejected when it was sent before the crash; the same
+    #rejection after remove_match or any other change of the match is not ours to skip
+    #returns: Bool
+    async def answered(self):
+        turn, ships_1, ships_2 = await self.txs.call(self.contract.functions.match_state(self.id))
+        return turn != 0 and (turn == -self.role or (ships_1 if self.role == 1 else ships_2) == 0)
+
+    #--------------------------|Whether the pending shots of the checkpoint reached the node
+    #fire() saves them before sending: after a crash in between they are neither in the pool nor mined
+    #after the last handled event (only our own shot can follow our your_turn)
+    #returns: Bool
+    async def shots_sent(self):
+        eth = self.txs.w3.eth
+        if(await eth.get_transaction_count(self.addr, 'pending') > await eth.get_transaction_count(self.addr)):
+            return True
+        events = self.contract.events
+        for event in (events.turn_played, events.salvo_played):
+            for log in await event().get_logs(from_block=self.position[0], argument_filters={'id': self.id}):
+                if((log['blockNumber'], log['logIndex']) > self.position):
+                    return True
+        return False
+
+    #--------------------------|Match over (or refunded): the checkpoint is no longer needed
+    def end(self):
+        if(self.checkpoint is not None):
+            self.checkpoint.discard()
+            self.checkpoint = None
+
+    #--------------------------|Picks up a checkpointed match after a restart
+    #The board and the match state are read back from the map, the Merkle tree is rebuilt from
+    #the board and the nonce seed, pending shots that never reached the node are dropped, then the
+    #events of the match after the last processed one are replayed before the new ones
+    #args: checkpoint (Checkpoint)
+    async def resume(self, checkpoint):
+        self.checkpoint = checkpoint
+        self.id = checkpoint.id
+        self.board = checkpoint.board()
+        self.tree = checkpoint.tree(self.board)
+        self.board_2 = checkpoint.board_2
+        self.incoming = Board(len(self.board))
+        self.phase, self.turn, self.role, self.salvo = checkpoint.phase, checkpoint.turn, checkpoint.role, checkpoint.salvo
+        self.position = (checkpoint.block, checkpoint.log_index)
+        self.live_check, self.accuse_block, self.shots = checkpoint.live_check, checkpoint.accuse_block, checkpoint.shots
+        n = len(self.board_2)
+        for k in np.flatnonzero(self.board_2.cells != EMPTY).tolist(): #The strategy learns the answered shots again
+            self.player.on_response(k // n, k % n, 1 if self.board_2.cells[k] == HIT else 0)
+        if(self.shots and not await self.shots_sent()): #Chosen again when the replayed your_turn comes
+            self.shots = []
+        self.events = self.manager.pump.subscribe(self.id)
+        await self.manager.pump.replay(self.events, *self.position)
+
+    #--------------------------|Creates a new match with a fresh board
+    #args: size   (Int) board size
+    #      auto   (Bool) random ship placement
+    #      amount (Int) bet in Ether placed with the creation (create_and_bet), None bets later
+    #      ships  (Dictionary <ship -> number_available>) fleet of the match, defaults to fleet(size)
+
+    #returns: match_id (Bytes)
+    async def create(self, size, auto=False, amount=None, ships=None):
+        self.role = self.turn = 1
+        with METRICS.timer("phase", phase="placement"):
+            self.board, self.tree = create_board(size, ships, auto=auto, screen=self.screen)
+        self.board_2 = Board(size)
+        self.incoming = Board(size)
+        await self.start_checkpoint(PLACED if amount is None else BET) #On disk before the board is committed
+        with METRICS.timer("phase", phase="new_match"):
+            try:
+                id = await new_match(self.txs, self.tree.root, self.contract, self.addr, size, ships, amount=amount)
+            except TxRejected: #Nothing sent
+                self.end()
+                raise
+        self.commit(id)
+        return self.id
+
+    #--------------------------|Joins a match, the board is uploaded by upload()
+    #args: match_id (Bytes) match to join, defaults to a random open match
+    #      size     (Int) board size of the random match, defaults to any size
+
+    #returns: size (Int) board size of the match, None if there is no open match
+    async def join(self, match_id=None, size=None):
+        self.role = self.turn = -1
+        if(match_id is None):
+            fn = self.contract.functions.join_match() if size is None else self.contract.functions.join_match(size)
+            pending = await self.txs.transact(fn, {'from': self.addr})
+            logs = self.contract.events.size_ID().process_receipt(await pending.receipt())
+            if(not logs):
+                return None
+            match_id = logs[0]['args']['id']
+        else:
+            pending = await self.txs.transact(self.contract.functions.join_match_id(match_id), {'from': self.addr})
+            logs = self.contract.events.size_only().process_receipt(await pending.receipt())
+        self.id = match_id
+        self.events = self.manager.pump.subscribe(match_id)
+        return logs[0]['args']['size']
+
+    #--------------------------|Board size of the match to join, read without a transaction (eth_call)
+    #args: match_id (Bytes) match to join, defaults to a random open match
+    #      size     (Int) board size of the random match, defaults to any size
+
+    #returns: size (Int), None if there is no open match
+    #raises: TxRejected if the given match does not exist or is full
+    async def find_match(self, match_id=None, size=None):
+        fns = self.contract.functions
+        if(match_id is not None):
+            return await self.txs.call(fns.match_size(match_id))
+        _, size = await self.txs.call(fns.find_match(size or 0))
+        return size or None
+
+    #--------------------------|Fleet of the match to join, read without a transaction (eth_call)
+    #args: match_id (Bytes) match to join, defaults to the last open match of the size
+    #      size     (Int) board size of the random match
+
+    #returns: ships (Dictionary <ship -> number_available>), None if the match does not exist
+    async def match_fleet(self, match_id=None, size=None):
+        fns = self.contract.functions
+        if(match_id is None):
+            match_id, _ = await self.txs.call(fns.find_match(size))
+        return unpack_fleet(await self.txs.call(fns.match_fleet(match_id))) or None
+
+    #--------------------------|Joins a match, uploads the board and bets in one call (join_and_bet)
+    #The size and the fleet are read first (eth_call), the ships are placed, then the call joins the match;
+    #a random match is picked when the call is mined, so concurrent joiners never collide
+    #args: amount   (Int) bet in Ether
+    #      match_id (Bytes) match to join, defaults to a random open match
+    #      size     (Int) board size of the random match, defaults to any size
+    #      auto     (Bool) random ship placement
+
+    #returns: size (Int) board size of the match, None if there is no open match
+    #raises: TxRejected if the given match does not exist or is full
+    async def join_and_bet(self, amount, match_id=None, size=None, auto=False):
+        self.role = self.turn = -1
+        fns = self.contract.functions
+        if(match_id is not None or size is None):
+            size = await self.find_match(match_id, size)
+            if(size is None):
+                return None
+        ships = await self.match_fleet(match_id, size)
+        if(ships is None):
+            return None
+        with METRICS.timer("phase", phase="placement"):
+            self.board, self.tree = create_board(size, ships, auto=auto, screen=self.screen)
+        self.board_2 = Board(size)
+        self.incoming = Board(size)
+        await self.start_checkpoint(BET) #On disk before the stake is sent
+        try:
+            pending = await self.send(fns.join_and_bet(match_id or bytes(32), size, pack_fleet(ships), self.tree.root), convert_to_wei(amount))
+        except MatchNotFound:
+            self.end()
+            if(match_id is not None):
+                raise
+            return None
+        receipt = await pending.receipt()
+        logs = self.contract.events.match_ready().process_receipt(receipt)
+        if(not logs): #The last open match was taken between the preflight and the block, the bet is refunded
+            self.end()
+            return None
+        self.commit(logs[0]['args']['id'])
+        await self.manager.pump.replay(self.events, receipt['blockNumber']) #Our bet, and the opponent's answer to it
+        return size
+
+    #--------------------------|Places the ships of the joined match and uploads the root
+    #args: size (Int) board size returned by join()
+    #      auto (Bool) random ship placement
+    async def upload(self, size, auto=False):
+        ships = await self.match_fleet(self.id)
+        with METRICS.timer("phase", phase="placement"):
+            self.board, self.tree = create_board(size, ships, auto=auto, screen=self.screen)
+        self.board_2 = Board(size)
+        self.incoming = Board(size)
+        await self.start_checkpoint(READY)
+        #No need to wait: the bet is sent with the next nonce, so it is mined after the upload
+        await self.send(self.contract.functions.upload_board(self.id, self.tree.root))
+
+    #--------------------------|Waits for the other player to join our match
+    async def wait_ready(self):
+        with METRICS.timer("phase", phase="wait_opponent"):
+            while True:
+                ev = await self.events.get()
+                if(ev['event'] == 'match_ready'):
+                    self.phase = READY
+                    self.save(ev)
+                    return
+
+    #--------------------------|Places our bet and waits for the opponent's one
+    #args: amount (Int) reward in Ether
+
+    #returns: -1 (Bets do not correspond - Refund)
+    #          1 (Same bet - Match start)
+    async def bet(self, amount):
+        with METRICS.timer("phase", phase="bet"):
+            pending = await self.send(self.contract.functions.bet(self.id), convert_to_wei(amount))
+            self.phase = BET
+            self.save()
+            tx_receipt = await pending.receipt()
+            if(not self.contract.events.bid_placed().process_receipt(tx_receipt)):
+                self.say("Match Ended - Reward Mismatch")
+                self.end()
+                return -1
+            return await self.wait_bets()
+
+    #--------------------------|Waits for the opponent's bet, ours is already sent
+    #returns: -1 (Bets do not correspond - Refund)
+    #          1 (Same bet - Match start)
+    async def wait_bets(self):
+        while True:
+            ev = await self.events.get()
+            if(ev['event'] == 'match_ended'):
+                self.say("Match Ended")
+                self.end()
+                return -1
+            if(ev['event'] == 'bid_placed'):
+                if(ev['args']['bid']==2):
+                    self.say("Match Start")
+                    self.phase = PLAYING
+                    self.save(ev)
+                    return 1
+
+    #--------------------------|Match logic loop
+    #args: poll_interval (Int) seconds between inactivity checks
+
+    #returns: outcome (Int) 1 won, -1 lost
+    async def play(self, poll_interval=3):
+        board_1, board_2, tree, player = self.board, self.board_2, self.tree, self.player
+        fns = self.contract.functions
+        id = self.id
+        turn = self.turn
+        lenght = len(board_1)
+        live_check = self.live_check #Inactivity flag check
+        curr_block_num = self.accuse_block
+        shots = self.shots #Pending shot coordinates
+        t_check = t_turn = t_shot = time.perf_counter()
+        t1 = time.time()
+        while True:
+            ev = await self.events.get(poll_interval)
+            name = ev['event'] if ev is not None else None
+
+            # Event Match ended
+            if(name == 'match_ended'):
+                if(ev['args']['outcome'] == -1): #cheating
+                    if(turn == 1):
+                        self.say("The opponent tried to cheat - You WON!")
+                    else:
+                        self.say("No cheating allowed - You LOOSE!")
+                    self.outcome = turn
+                    break
+
+                elif(ev['args']['outcome'] == -2): #inactivity
+                    if(turn == 1):
+                        self.say("Inactivity penalty! - You LOOSE!")
+                    else:
+                        self.say("Opponent left the game - You WON!")
+                    self.outcome = -turn
+                    break
+
+                elif(ev['args']['outcome'] == 0): #legit match
+                    if(turn == 1):
+                        self.say("All enemy ships destroyed! - Verifying your board...")
+                        t_check = time.perf_counter()
+                        await self.send(fns.reveal_board(id, board_1.to_bitmap(), tree.nonces.seed, board_1.layout()))
+                elif(ev['args']['outcome'] == 1):
+                    if(turn == 1):
+                        METRICS.observe("phase", time.perf_counter() - t_check, phase="reveal_board")
+                        self.say("\nCongratulations - You WON!")
+                    else:
+                        self.say("\nGame Over - You LOOSE...")
+                    self.outcome = turn
+                    break
+
+            #Event Accuse
+            elif(name == 'accuse'):
+                live_check = 2
+                if(turn == -1):
+                    curr_block_num = ev['args']['block_num']
+                if(turn == 1):
+                    await self.send(fns.accuse_res(id))
+                    live_check = 0
+
+            #Event Turn_Response
+            elif(name == 'turn_response'):
+                if(turn == 1 and shots):
+                    self.latency['shot'].append(time.perf_counter() - t_shot)
+                    METRICS.observe("phase", time.perf_counter() - t_turn, phase="turn")
+                    res = ev['args']['res']
+                    row, col = shots[0]
+                    if(res == 1):
+                        self.say("\n|----- HIT! -----|")
+                        board_2.grid[row,col] = HIT
+                    else:
+                        self.say("\n|----- MISS -----|")
+                        board_2.grid[row,col] = MISS
+                    player.on_response(row, col, res)
+                    self.show()
+                    shots = []
+
+            #Event Your_turn
+            elif(name == 'your_turn'):
+                turn *= -1
+                if(turn == 1 and shots): #Already fired with our answer (answer_and_play), or before a restart
+                    self.show()
+                elif(turn == 1): #our turn
+                    self.show()
+                    t_turn = time.perf_counter()
+                    if(self.salvo > 1):
+                        shots = await self.fire(lambda shots: (fns.play_salvo(id, [r for r,c in shots], [c for r,c in shots]), (lenght, len(shots))))
+                    else:
+                        shots = await self.fire(lambda shots: (fns.play_turn(id, shots[0][0], shots[0][1]), None))
+                    t_shot = time.perf_counter()
+                    self.latency['think'].append(t_shot - t_turn)
+
+                else:
+                    self.say("\nOpponent's turn...")
+                    t1 = time.time()
+                    live_check = 1
+
+            #Event Turn_played
+            elif(name == 'turn_played'):
+                if(turn==-1): #Opponents made its move
+                    t_played = time.perf_counter()
+                    live_check = 0
+                    row = ev['args']['row']
+                    col = ev['args']['col']
+                    k = (row*lenght)+col
+                    res = int(board_1.cells[k]) #Answer from the committed board
+                    self.say("The opponent shot at: " + row_label(row)+str(col) + (" - HIT" if res == 1 else " - MISS"))
+                    self.incoming.grid[row,col] = HIT if res == 1 else MISS
+                    self.show()
+                    proof = tree.get_proof(k)
+                    if(not verify_proof(tree.root, res, k, tree.nonces[k], proof)): #The contract would end the match as cheating
+                        raise InvalidProof('check_move', "answer does not match the committed board")
+                    try:
+                        if(self.combined and self.salvo == 1): #Our next shot goes with the answer
+                            t_turn = time.perf_counter()
+                            shots = await self.fire(lambda shots: (fns.answer_and_play(id, res, k, tree.nonces[k], proof, shots[0][0], shots[0][1]), None))
+                            t_shot = time.perf_counter()
+                            self.latency['think'].append(t_shot - t_turn)
+                        else:
+                            await self.send(fns.check_move(id, res, k, tree.nonces[k], proof))
+                        self.latency['answer'].append(time.perf_counter() - t_played)
+                    except TxRejected: #Replayed after a resume: the chain must already have our answer (and shot)
+                        if(not await self.answered()):
+                            raise
+                        self.say("Answer already sent")
+                else: #Our shot, as the chain recorded it
+                    shots = [(ev['args']['row'], ev['args']['col'])]
+                    self.say("Waiting for response...")
+
+            #Event Salvo_played
+            elif(name == 'salvo_played'):
+                if(turn==-1): #Opponent fired a salvo
+                    t_played = time.perf_counter()
+                    live_check = 0
+                    keys = [(r*lenght)+c for r,c in zip(ev['args']['rows'], ev['args']['cols'])]
+                    values = [int(board_1.cells[k]) for k in keys]
+                    for k, v in zip(keys, values):
+                        self.say("The opponent shot at: " + row_label(k // lenght)+str(k % lenght) + (" - HIT" if v == 1 else " - MISS"))
+                        self.incoming.cells[k] = HIT if v == 1 else MISS
+                    self.show()
+                    proof = tree.get_multiproof(keys)
+                    nonces = [tree.nonces[k] for k in keys]
+                    if(not verify_multiproof(tree.root, lenght*lenght, keys, values, nonces, proof)):
+                        raise InvalidProof('check_salvo', "answer does not match the committed board")
+                    try:
+                        if(self.combined and self.salvo > 1):
+                            t_turn = time.perf_counter()
+                            shots = await self.fire(lambda shots: (fns.answer_salvo_and_play(id, values, keys, nonces, proof, [r for r,c in shots], [c for r,c in shots]),
+                                                                   (lenght, len(keys), len(proof), len(shots))))
+                            t_shot = time.perf_counter()
+                            self.latency['think'].append(t_shot - t_turn)
+                        else:
+                            await self.send(fns.check_salvo(id, values, keys, nonces, proof), key=(lenght, len(keys), len(proof)))
+                        self.latency['answer'].append(time.perf_counter() - t_played)
+                    except TxRejected: #Replayed after a resume: the chain must already have our answer (and shot)
+                        if(not await self.answered()):
+                            raise
+                        self.say("Answer already sent")
+                else: #Our salvo, as the chain recorded it
+                    shots = list(zip(ev['args']['rows'], ev['args']['cols']))
+
+            #Event Salvo_response
+            elif(name == 'salvo_response'):
+                if(turn == 1):
+                    self.latency['shot'].append(time.perf_counter() - t_shot)
+                    METRICS.observe("phase", time.perf_counter() - t_turn, phase="turn")
+                    for (r, c), res in zip(shots, ev['args']['res']):
+                        self.say(row_label(r)+str(c) + (" |----- HIT! -----|" if res == 1 else " |----- MISS -----|"))
+                        board_2.grid[r,c] = HIT if res == 1 else MISS
+                        player.on_response(r, c, res)
+                    self.show()
+                    shots = []
+
+            if(live_check == 1 and turn == -1):
+                t2 = time.time()
+                if(t2 - t1 > 10):
+                    if(player.confirm_accuse()):
+                        await self.send(fns.accuse_player(id))
+                    else:
+                        t1 = time.time()
+                        t2 = t1
+            elif(live_check == 2 and turn == -1):
+                latest_block_num = await self.manager.pump.block_number() #Last pushed head with a SocketPump
+                if(latest_block_num - curr_block_num >= 5):
+                    await self.send(fns.withdraw(id))
+                    live_check = 3 #Withdraw sent, waiting for match_ended
+            self.turn, self.live_check, self.accuse_block, self.shots = turn, live_check, curr_block_num, shots
+            self.save(ev)
+        self.turn = turn
+        self.end()
+        return self.outcome
+
+    #--------------------------|Whole match for headless players
+    #Sessions that already created, joined or resumed their match go on from their phase
+    #args: size     (Int) board size of a new match
+    #      match_id (Bytes) match to join
+    #      join     (Bool) join a random match of the given size (any size if None)
+    #      amount   (Int) reward in Ether
+    #      timeout  (Float) seconds to wait for the opponent to join and bet, None waits forever
+
+    #returns: outcome (Int) 1 won, -1 lost, 0 no match/refund
+    #raises: asyncio.TimeoutError if the opponent does not join and bet within timeout
+    async def run(self, size=None, match_id=None, join=False, amount=1, timeout=None):
+        try:
+            if(self.id is None and not join and match_id is None):
+                await self.create(size, auto=True, amount=amount if self.combined else None)
+            elif(self.id is None and self.combined):
+                if(await self.join_and_bet(amount, match_id, size, auto=True) is None):
+                    return 0
+            elif(self.id is None):
+                size = await self.join(match_id, size)
+                if(size is None):
+                    return 0
+                await self.upload(size, auto=True)
+            if(await asyncio.wait_for(self.wait_opponent(amount), timeout) == -1):
+                return 0
+            return await self.play()
+        finally:
+            self.close()
+
+    #--------------------------|Waits for the opponent to join, then bets, from the current phase
+    #args: amount (Int) reward in Ether
+
+    #returns: -1 (Refund), 1 (Match start)
+    async def wait_opponent(self, amount):
+        if(self.phase == PLACED):
+            await self.wait_ready()
+        if(self.phase == READY):
+            return await self.bet(amount)
+        if(self.phase == BET):
+            return await self.wait_bets()
+        return 1
+
+    def close(self):
+        self.screen.close()
+        if(self.checkpoint is not None):
+            self.checkpoint.close()
+        if(self.events is not None):
+            self.manager.pump.unsubscribe(self.events)
+        if(self.addr is not None):
+            self.manager.accounts.release(self.addr)
+            self.addr = None
+
+    #--------------------------|Per-match latency line
+    def report(self):
+        line = (self.id or b'').hex()[:12]
+        for kind, samples in self.latency.items():
+            n, mean, p50, p95, top = summary(samples)
+            line += "  %s n=%d mean=%.0fms p95=%.0fms max=%.0fms" % (kind, n, mean*1e3, p95*1e3, top*1e3)
+        return line
+
+
+#--------------------------|Runs many match sessions on one event loop
+#All the sessions share one AsyncWeb3 connection, one EventPump (a single eth_getLogs
+#per block for all the matches, or one log subscription with a SocketPump) and one
+#TxPipeline/AccountPool (local nonces per account)
+#args: w3          (AsyncWeb3)
+#      contract    (AsyncWeb3.eth.contract)
+#      accounts    (Bytes[]) accounts of the sessions
+#      pump        (EventPump or SocketPump)
+#      checkpoints (String) directory of the match checkpoints, None disables them
+class MatchManager:
+    def __init__(self, w3, contract, accounts, pump, checkpoints=None):
+        self.w3 = w3
+        self.contract = contract
+        self.txs = TxPipeline(w3)
+        self.accounts = AccountPool(accounts)
+        self.pump = pump
+        self.checkpoints = checkpoints
+        self.sessions = []
+
+    #--------------------------|New session on a pooled account
+    #args: addr (Bytes) a specific account, defaults to the least busy one
+    #      **kw  MatchSession options (player, salvo, verbose, screen)
+
+    #returns: MatchSession
+    def session(self, addr=None, **kw):
+        s = MatchSession(self, self.accounts.acquire(addr), **kw)
+        self.sessions.append(s)
+        return s
+
+    #--------------------------|Session of a checkpointed match, on the account that played it
+    #args: match_id (Bytes)
+    #      addr     (String) account, needed only if both players of the match are checkpointed here
+    #      **kw     MatchSession options (player, verbose, screen)
+
+    #returns: MatchSession
+    async def resume(self, match_id, addr=None, **kw):
+        checkpoint = load_checkpoint(find_checkpoint(self.checkpoints, match_id, addr))
+        if(not any(checkpoint.id)): #Interrupted before the creation or join was mined
+            checkpoint.set_id(await self.find_commitment(checkpoint))
+        s = self.session(checkpoint.addr, **kw)
+        await s.resume(checkpoint)
+        return s
+
+    #--------------------------|Match id of a checkpoint written before its creation or join was mined
+    #The newMatch (creator) or match_ready (joiner) logs of the account after the checkpoint
+    #block are matched on the board root their transaction committed
+    #args: checkpoint (Checkpoint) without a match id
+
+    #returns: match_id (Bytes)
+    #raises: ValueError if no such call was mined: nothing is at stake
+    async def find_commitment(self, checkpoint):
+        event = self.contract.events.newMatch if checkpoint.role == 1 else self.contract.events.match_ready
+        root = checkpoint.tree().root
+        for log in await event().get_logs(from_block=checkpoint.block, argument_filters={'player': checkpoint.addr}):
+            tx = await self.w3.eth.get_transaction(log['transactionHash'])
+            _, args = self.contract.decode_function_input(tx['input'])
+            if(args.get('board_1', args.get('board')) == root):
+                return log['args']['id']
+        raise ValueError("No match committed the board of " + checkpoint.path + ": nothing is at stake")
+
+    #--------------------------|Runs coroutines (e.g. session.run()) while pumping their events
+    #returns: results (List), exceptions included
+    async def run(self, *coros):
+        return await self.pump.drive(asyncio.gather(*coros, return_exceptions=True))
+
+    #--------------------------|Latency of every session, plus all matches merged
+    def report(self):
+        for s in self.sessions:
+            print(s.report())
+        for kind in ('think', 'shot', 'answer'):
+            n, mean, p50, p95, top = summary([t for s in self.sessions for t in s.latency[kind]])
+            print("%-7s n=%-6d mean=%7.1fms p50=%7.1fms p95=%7.1fms max=%7.1fms" % (kind, n, mean*1e3, p50*1e3, p95*1e3, top*1e3))
+        METRICS.flush()
+
+
+#--------------------------|Connects to the node and finds the deployed contract
+#The ABI and the address come from the deployment cache (one eth_getCode to validate it)
+#Metrics are enabled here when BATTLESHIPS_METRICS_JSONL/BATTLESHIPS_METRICS_PROM are set
+#The events are pushed through eth_subscribe when the node accepts a WebSocket/IPC
+#connection on events_url, and polled through the HTTP endpoint otherwise
+#args: url         (String) node HTTP endpoint
+#      path        (String) compiled contract json
+#      checkpoints (String) directory of the match checkpoints, None disables them
+#      events_url  (String) node ws:// endpoint or IPC path for the event subscriptions
+
+#returns: MatchManager
+async def connect(url="HTTP://127.0.0.1:7545", path="build/contracts/Battleships.json", checkpoints=None, events_url=None):
+    warnings.filterwarnings("ignore","The log with transaction hash")
+    warnings.simplefilter(action='ignore', category=FutureWarning)
+    w3 = AsyncWeb3(AsyncHTTPProvider(url))
+    if(METRICS.from_env()):
+        instrument(w3)
+    cache = load_artifact(path)
+    contract_instance = w3.eth.contract(abi = cache['abi'])
+    _address = await find_deployment(w3, path, cache, contract_instance)
+    contract = w3.eth.contract(abi = cache['abi'], address = _address)
+    pump = await open_pump(w3, contract, await w3.eth.block_number, cache['topics'], events_url)
+    return MatchManager(w3, contract, await w3.eth.accounts, pump, checkpoints)
+
+
+#--------------------------|House bot: plays matches between pairs of bots and reports latencies
+#Creators and joiners use alternate node accounts, so no account plays against itself
+#args: matches    (Int) concurrent matches
+#      size       (Int) board size
+#      url        (String) node HTTP endpoint
+#      events_url (String) node ws:// endpoint, polling if the node does not accept it
+async def house(matches=100, size=8, url="HTTP://127.0.0.1:7545", events_url="ws://127.0.0.1:7545"):
+    manager = await connect(url, events_url=events_url)
+    accounts = list(manager.accounts.active)
+    creators = [manager.session(accounts[(2*i) % len(accounts)], player=HuntTargetPlayer(size), verbose=False) for i in range(matches)]
+    ids = await asyncio.gather(*[s.create(size, auto=True, amount=1 if s.combined else None) for s in creators])
+    joiners = [manager.session(accounts[(2*i+1) % len(accounts)], player=HuntTargetPlayer(size), verbose=False) for i in range(matches)]
+    t = time.perf_counter()
+    results = await manager.run(*[s.run() for s in creators], *[s.run(match_id=id) for s, id in zip(joiners, ids)])
+    print("%d matches in %.1fs, %d errors" % (matches, time.perf_counter() - t, sum(isinstance(r, Exception) for r in results)))
+    manager.report()
+
+
+if __name__ == "__main__":
+    import sys
+    asyncio.run(house(*map(int, sys.argv[1:3])))
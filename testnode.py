@@ -0,0 +1,169 @@
+#Author: Alessandro Mazzarella
+#Title: testnode
+#notice: Local stand-in node: an eth-tester chain served as JSON-RPC over WebSocket, with eth_subscribe
+
+import asyncio
+import itertools
+import json
+import os
+from collections.abc import Mapping
+from websockets.asyncio.server import serve
+from web3 import Web3, EthereumTesterProvider
+
+
+#--------------------------|Python result of eth-tester -> JSON-RPC wire value (quantities and bytes as hex strings)
+def wire(value):
+    if(isinstance(value, bool) or value is None or isinstance(value, str)):
+        return value
+    if(isinstance(value, int)):
+        return hex(value)
+    if(isinstance(value, (bytes, bytearray))):
+        return "0x" + bytes(value).hex()
+    if(isinstance(value, Mapping)):
+        return {k: wire(v) for k, v in value.items()}
+    if(isinstance(value, (list, tuple))):
+        return [wire(v) for v in value]
+    return value
+
+
+#--------------------------|eth_subscribe logs filter check (address and positional topics, None or a list of options)
+def matches(log, filter):
+    address = filter.get('address')
+    if(address is not None):
+        options = address if isinstance(address, list) else [address]
+        if(log['address'].lower() not in [a.lower() for a in options]):
+            return False
+    for i, topic in enumerate(filter.get('topics') or []):
+        if(topic is None):
+            continue
+        options = topic if isinstance(topic, list) else [topic]
+        if(i >= len(log['topics']) or log['topics'][i].lower() not in [t.lower() for t in options]):
+            return False
+    return True
+
+
+#--------------------------|In-process chain reachable over ws://, pushing newHeads and logs to its subscribers
+#Every request is answered by eth-tester (automine: one block per transaction); the blocks
+#mined by a request are then pushed to the eth_subscribe subscriptions, headers first and
+#logs after, as a node does. drop() cuts the subscribed connections to exercise the
+#reconnection of the clients.
+#args: host     (String)
+#      port     (Int) 0 picks a free port
+#      accounts (Int) unlocked accounts, funded from the first one beyond the 10 of eth-tester
+class TestNode:
+    def __init__(self, host="127.0.0.1", port=0, accounts=10):
+        self.host = host
+        self.port = port
+        self.w3 = Web3(EthereumTesterProvider())
+        self.request = self.w3.provider.request_func(self.w3, self.w3.middleware_onion)
+        self.ids = itertools.count(1)
+        self.clients = set()
+        self.subscriptions = {} #id -> (client, kind, filter)
+        tester = self.w3.provider.ethereum_tester
+        bank = self.w3.eth.accounts[0]
+        for _ in range(accounts - len(self.w3.eth.accounts)):
+            self.w3.eth.send_transaction({'from': bank, 'to': tester.add_account("0x" + os.urandom(32).hex()), 'value': 10**22})
+        self.head = self.w3.eth.block_number
+        self.server = None
+
+    #--------------------------|Starts serving
+    #returns: url (String) ws:// endpoint
+    async def start(self):
+        self.server = await serve(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.url
+
+    @property
+    def url(self):
+        return "ws://%s:%d" % (self.host, self.port)
+
+    async def stop(self):
+        if(self.server is not None):
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    #--------------------------|Closes the connections holding subscriptions, as a network failure would
+    #The request connections stay up, the subscriptions are lost
+    async def drop(self):
+        for client in {sub[0] for sub in self.subscriptions.values()}:
+            await client.close()
+
+    #--------------------------|Mines empty blocks and pushes their heads
+    async def mine(self, blocks=1):
+        self.w3.testing.mine(blocks)
+        await self.notify()
+
+    async def handle(self, client):
+        self.clients.add(client)
+        try:
+            async for message in client:
+                request = json.loads(message)
+                if(isinstance(request, list)):
+                    response = [self.call(r, client) for r in request]
+                else:
+                    response = self.call(request, client)
+                await client.send(json.dumps(response))
+                await self.notify()
+        except Exception:
+            pass
+        finally:
+            self.clients.discard(client)
+            for id in [id for id, sub in self.subscriptions.items() if sub[0] is client]:
+                del self.subscriptions[id]
+
+    #--------------------------|Answers one JSON-RPC request
+    def call(self, request, client):
+        method, params = request['method'], request.get('params') or []
+        response = {'jsonrpc': "2.0", 'id': request.get('id')}
+        try:
+            if(method == 'eth_subscribe'):
+                id = hex(next(self.ids))
+                self.subscriptions[id] = (client, params[0], params[1] if len(params) > 1 else {})
+                response['result'] = id
+            elif(method == 'eth_unsubscribe'):
+                response['result'] = self.subscriptions.pop(params[0], None) is not None
+            elif(method == 'evm_mine'):
+                self.w3.testing.mine(1)
+                response['result'] = "0x0"
+            else:
+                result = self.request(method, params)
+                if('error' in result):
+                    response['error'] = result['error']
+                else:
+                    response['result'] = wire(result['result'])
+        except Exception as e:
+            response['error'] = {'code': -32000, 'message': str(e)}
+        return response
+
+    #--------------------------|Pushes the blocks mined since the last notification
+    async def notify(self):
+        block = self.w3.eth.block_number
+        while(self.head < block):
+            self.head += 1
+            header = wire(self.request("eth_getBlockByNumber", [hex(self.head), False])['result'])
+            for id, (client, kind, filter) in list(self.subscriptions.items()):
+                if(kind == 'newHeads'):
+                    results = [header]
+                elif(kind == 'logs'):
+                    logs = wire(self.request("eth_getLogs", [{'fromBlock': hex(self.head), 'toBlock': hex(self.head)}])['result'])
+                    results = [log for log in logs if matches(log, filter)]
+                else:
+                    continue
+                for result in results:
+                    try:
+                        await client.send(json.dumps({'jsonrpc': "2.0", 'method': "eth_subscription", 'params': {'subscription': id, 'result': result}}))
+                    except Exception:
+                        break
+
+
+#--------------------------|Serves a stand-in node until interrupted
+async def main(port=8546):
+    node = TestNode(port=port)
+    print("Stand-in node on " + await node.start())
+    await asyncio.Future()
+
+
+if __name__ == "__main__":
+    import sys
+    asyncio.run(main(*map(int, sys.argv[1:2])))
@@ -0,0 +1,184 @@
+#Author: Alessandro Mazzarella
+#Title: transactions
+#notice: Non-blocking transaction pipeline on AsyncWeb3
+
+import asyncio
+import time
+from metrics import METRICS
+
+
+GAS_MARGIN = 1.25 #Headroom on a cached estimate: later calls of the same function may write more slots
+GAS_HEADROOM = 100000 #Branches the estimate did not take: payouts and removal of the match (cheating, refund, withdraw)
+
+
+#--------------------------|A call the contract would revert, caught by the preflight before paying for it
+#args: fn     (String) contract function
+#      reason (String) revert reason of the contract
+class TxRejected(Exception):
+    def __init__(self, fn, reason):
+        super().__init__(fn + ": " + reason)
+        self.fn = fn
+        self.reason = reason
+
+class NotYourTurn(TxRejected): pass
+class MatchNotFound(TxRejected): pass
+class MatchFull(TxRejected): pass
+class MatchNotFinished(TxRejected): pass
+class InvalidMove(TxRejected): pass
+class NotAllowed(TxRejected): pass
+#An answer whose proof does not match the committed root: the contract would not revert, it would end the match
+class InvalidProof(TxRejected): pass
+
+#Revert reasons of Battleships.sol -> typed error
+REVERTS = {
+    "Not your turn - Wait for the opponent": NotYourTurn,
+    "No match found": MatchNotFound,
+    "Match already full": MatchFull,
+    "Match still pending": MatchNotFinished,
+    "Match still not finished!": MatchNotFinished,
+    "Invalid Operation!": InvalidMove,
+    "Invalid salvo": InvalidMove,
+    "Salvo must be sorted": InvalidMove,
+    "No matching salvo": InvalidMove,
+    "Salvo pending": InvalidMove,
+    "Invalid response": InvalidMove,
+    "Invalid response!": InvalidMove,
+    "Invalid fleet": InvalidMove,
+    "Fleet mismatch": MatchNotFound, #join_and_bet with id 0: the match taken was created with another fleet
+    "Invalid size": InvalidMove,
+    "User not allowed": NotAllowed,
+    "You cannot accuse yourself": NotAllowed,
+    "Accuse already done!": NotAllowed,
+    "No accuse pending!": NotAllowed,
+    "Invalid Withdraw": NotAllowed,
+}
+
+
+#--------------------------|Node error of a reverted call -> typed error
+#web3 raises ContractLogicError, eth-tester its own TransactionFailed: both carry "execution reverted: <reason>"
+#args: fn    (String) contract function
+#      error (Exception)
+
+#returns: TxRejected, None if the error is not a revert (network, node...)
+def rejection(fn, error):
+    message = str(getattr(error, 'message', None) or error)
+    if("revert" not in message):
+        return None
+    reason = message.split("execution reverted:", 1)[-1].strip().strip("'\"")
+    return REVERTS.get(reason, TxRejected)(fn, reason)
+
+
+#--------------------------|A sent transaction whose receipt is tracked in the background
+#args: tx_hash (Bytes)
+#      task    (asyncio.Task) resolving to the receipt
+class PendingTx:
+    def __init__(self, tx_hash, task):
+        self.tx_hash = tx_hash
+        self.task = task
+
+    #--------------------------|Waits for the transaction to be mined
+    #returns: receipt (AttributeDict)
+    async def receipt(self):
+        return await self.task
+
+
+#--------------------------|Sends transactions back to back with local nonce management
+#Nonces are fetched once per account and then assigned locally, so the next transaction
+#can be sent without waiting for the previous receipt; receipts are polled concurrently
+#and only awaited by the callers that need the resulting events.
+#Every call is first simulated with eth_call, so a call the contract would revert raises a
+#TxRejected subclass instead of being mined and paid for. The gas limit is estimated once
+#per function and board size (salvo calls: and proof lenght) and then reused, which saves the eth_estimateGas round trip
+#that build_transaction would make on every call: the preflight runs alongside the build.
+#The cached limit keeps a fixed headroom over the estimate, since the same call may take a
+#costlier branch later (a wrong answer pays out and removes the match); unused gas is not charged.
+#The preflight is skipped while the account has unmined transactions, whose effects (e.g.
+#the uploaded board a pipelined bet relies on) the latest state does not show yet; for the
+#same reason a limit that is not cached yet is estimated only once they are mined.
+#args: w3           (AsyncWeb3)
+#      poll_latency (Float) seconds between receipt polls
+#      timeout      (Float) seconds before giving up on a receipt
+#      preflight    (Bool) simulate every call before sending it
+class TxPipeline:
+    def __init__(self, w3, poll_latency=0.1, timeout=120, preflight=True):
+        self.w3 = w3
+        self.poll_latency = poll_latency
+        self.timeout = timeout
+        self.preflight = preflight
+        self.nonces = {}
+        self.locks = {}
+        self.gas = {} #(function, key) -> gas limit
+        self.inflight = {} #addr -> unmined transactions
+        self.last = {} #addr -> receipt task of the last transaction sent
+
+    #--------------------------|Simulates, builds, signs (node side) and sends a contract call
+    #args: fn   (AsyncContractFunction) e.g. contract.functions.play_turn(id, row, col)
+    #      tx   (Dictionary) transaction fields, 'from' is required
+    #      key  gas cache key: the board size, with the salvo and proof lenght for the salvo calls
+
+    #returns: PendingTx
+    #raises: TxRejected (subclass by revert reason) if the contract would revert the call
+    async def transact(self, fn, tx, key=None):
+        addr = tx['from']
+        name = fn.fn_name
+        key = (name, key)
+        lock = self.locks.setdefault(addr, asyncio.Lock())
+        with METRICS.timer("transact", fn=name):
+            async with lock:
+                if(addr not in self.nonces):
+                    self.nonces[addr] = await self.w3.eth.get_transaction_count(addr, 'pending')
+                tx = dict(tx, nonce=self.nonces[addr])
+                try:
+                    if(key not in self.gas and self.inflight.get(addr)): #The estimate needs the state they leave
+                        await asyncio.wait([self.last[addr]])
+                    simulate = self.preflight and not self.inflight.get(addr)
+                    if(key not in self.gas): #The estimate simulates the call as well
+                        self.gas[key] = int(await fn.estimate_gas(tx) * GAS_MARGIN) + GAS_HEADROOM
+                        simulate = False
+                    tx['gas'] = self.gas[key]
+                    if(simulate):
+                        _, built = await asyncio.gather(fn.call(tx), fn.build_transaction(tx))
+                    else:
+                        built = await fn.build_transaction(tx)
+                except Exception as e:
+                    error = rejection(name, e)
+                    if(error is None):
+                        raise
+                    METRICS.count("rejected", fn=name)
+                    raise error from None
+                tx_hash = await self.w3.eth.send_transaction(built)
+                self.nonces[addr] += 1
+                self.inflight[addr] = self.inflight.get(addr, 0) + 1
+        task = asyncio.ensure_future(self.w3.eth.wait_for_transaction_receipt(tx_hash, self.timeout, self.poll_latency))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception()) #Unawaited receipts must not warn
+        task.add_done_callback(lambda t: self.mined(addr, key, tx['gas'], t))
+        self.last[addr] = task
+        if(METRICS.enabled):
+            METRICS.count("transact", fn=name)
+            sent = time.perf_counter()
+            task.add_done_callback(lambda t: METRICS.observe("receipt", time.perf_counter() - sent, fn=name))
+        return PendingTx(tx_hash, task)
+
+    #--------------------------|Reads a view function (eth_call), reverts raised as TxRejected
+    #returns: decoded result
+    async def call(self, fn, tx=None):
+        try:
+            return await fn.call(tx)
+        except Exception as e:
+            error = rejection(fn.fn_name, e)
+            if(error is None):
+                raise
+            raise error from None
+
+    #--------------------------|Receipt callback: one less unmined transaction, a cached limit that ran out of gas is dropped
+    def mined(self, addr, key, gas, task):
+        self.inflight[addr] -= 1
+        if(task.cancelled() or task.exception() is not None):
+            return
+        receipt = task.result()
+        if(receipt['status'] == 0 and receipt['gasUsed'] >= gas):
+            self.gas.pop(key, None)
+
+    #--------------------------|Forgets the local nonce of an account (e.g. after a dropped transaction)
+    def reset(self, addr):
+        self.nonces.pop(addr, None)